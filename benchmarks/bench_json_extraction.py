@@ -0,0 +1,177 @@
+"""
+JSON提取基准测试 - 对比旧版parse_json_response和容错提取器的成功率与吞吐量
+
+默认使用离线假LLM生成的题目响应，并按比例注入常见缺陷（说明文字、尾逗号、截断、
+中文弯引号、损坏元素、多个代码块、裸换行）；也可以用 --corpus 指定记录下来的真实LLM输出
+（JSONL，每行包含response或output字段）。
+
+示例:
+    python benchmarks/bench_json_extraction.py --samples 5000
+    python benchmarks/bench_json_extraction.py --corpus recorded_outputs.jsonl
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_llm import build_fake_response
+from json_utils import extract_json
+
+PROMPT_KINDS = ["生成选择题", "生成填空题", "生成连线题"]
+
+
+def legacy_parse(response: str):
+    """旧版parse_json_response：取第一个代码块后整体json.loads"""
+    if "```json" in response:
+        start = response.find("```json") + 7
+        end = response.find("```", start)
+        json_str = response[start:end].strip()
+    elif "```" in response:
+        start = response.find("```") + 3
+        end = response.find("```", start)
+        json_str = response[start:end].strip()
+    else:
+        json_str = response.strip()
+    return json.loads(json_str)
+
+
+def tolerant_parse(response: str):
+    """容错提取器"""
+    extraction = extract_json(response)
+    if not extraction.values:
+        raise ValueError("没有JSON")
+    return extraction.merged()
+
+
+def _mutate_trailing_comma(text, rng):
+    return text.replace("}\n]", "},\n]").replace('"\n    }', '",\n    }', 1)
+
+
+def _mutate_truncate(text, rng):
+    return text[:int(len(text) * rng.uniform(0.6, 0.95))]
+
+
+def _mutate_smart_quotes(text, rng):
+    return re.sub(r'"(question_text|explanation|topic)"', r"“\1”", text)
+
+
+def _mutate_bad_element(text, rng):
+    return text.replace('"difficulty": ', '"difficulty": hard_', 1)
+
+
+def _mutate_prose(text, rng):
+    return f"好的，以下是根据知识点生成的题目[共若干道]：\n\n{text}\n\n以上题目均基于文档内容，如需调整请告诉我。"
+
+
+def _mutate_multi_fence(text, rng):
+    body = text.strip("`\njson")
+    data = json.loads(body)
+    blocks = [f"第{i + 1}题：\n```json\n{json.dumps(item, ensure_ascii=False, indent=2)}\n```" for i, item in enumerate(data)]
+    return "\n\n".join(blocks)
+
+
+def _mutate_newline(text, rng):
+    return re.sub(r'("explanation": "[^"]{4})', r"\1\n", text)
+
+
+MUTATIONS = {
+    "clean": lambda text, rng: text,
+    "prose": _mutate_prose,
+    "trailing_comma": _mutate_trailing_comma,
+    "truncated": _mutate_truncate,
+    "smart_quotes": _mutate_smart_quotes,
+    "bad_element": _mutate_bad_element,
+    "multi_fence": _mutate_multi_fence,
+    "raw_newline": _mutate_newline,
+}
+
+
+def build_synthetic_corpus(samples: int, seed: int):
+    """生成带缺陷的响应语料，返回[(缺陷类型, 响应, 原始元素数)]"""
+    rng = random.Random(seed)
+    corpus = []
+    names = list(MUTATIONS)
+    for i in range(samples):
+        kind = PROMPT_KINDS[i % len(PROMPT_KINDS)]
+        points = [f"概念{i}-{j}：第{j}条知识点的描述内容" for j in range(rng.randint(3, 8))]
+        prompt = f"请{kind}\n文档主题: 主题{i}\n知识点列表:\n" + "\n".join(f"- {p}" for p in points) + "\n\n"
+        response = build_fake_response(prompt, random.Random(i), rng.randint(20, 120))
+        expected = len(json.loads(response.strip("`\njson")))
+        mutation = names[i % len(names)]
+        corpus.append((mutation, MUTATIONS[mutation](response, rng), expected))
+    return corpus
+
+
+def load_corpus(path: str):
+    """读取记录的LLM输出，原始元素数未知时记为0"""
+    corpus = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            text = record.get("response") or record.get("output") or ""
+            corpus.append((record.get("kind", "recorded"), text, int(record.get("expected", 0))))
+    return corpus
+
+
+def count_elements(value) -> int:
+    if isinstance(value, list):
+        return sum(1 for item in value if isinstance(item, dict))
+    return 1 if isinstance(value, dict) else 0
+
+
+def run(parser, corpus, repeat: int):
+    """返回(每种缺陷的统计, 总耗时秒)"""
+    stats = defaultdict(lambda: {"responses": 0, "parsed": 0, "elements": 0, "expected": 0})
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for mutation, text, expected in corpus:
+            row = stats[mutation]
+            row["responses"] += 1
+            row["expected"] += expected
+            try:
+                value = parser(text)
+            except Exception:
+                continue
+            row["parsed"] += 1
+            row["elements"] += count_elements(value)
+    return stats, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON提取成功率和吞吐量基准测试")
+    parser.add_argument("--corpus", type=str, help="记录的LLM输出（JSONL，含response或output字段）")
+    parser.add_argument("--samples", type=int, default=4000, help="未指定语料时生成的响应数")
+    parser.add_argument("--repeat", type=int, default=3, help="重复解析的轮数，用于稳定吞吐量")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else build_synthetic_corpus(args.samples, args.seed)
+    total_bytes = sum(len(text.encode("utf-8")) for _, text, _ in corpus) * args.repeat
+    print(f"语料: {len(corpus)} 个响应，{total_bytes / args.repeat / 1024 / 1024:.2f} MB")
+
+    results = {}
+    for name, func in (("legacy", legacy_parse), ("tolerant", tolerant_parse)):
+        stats, elapsed = run(func, corpus, args.repeat)
+        results[name] = stats
+        print(f"\n[{name}] 耗时 {elapsed:.2f}s，吞吐量 {total_bytes / elapsed / 1024 / 1024:.1f} MB/s，"
+              f"每个响应 {elapsed / (len(corpus) * args.repeat) * 1e6:.0f}µs")
+
+    print(f"\n{'缺陷类型':<16}{'旧版成功率':>10}{'新版成功率':>10}{'旧版元素':>10}{'新版元素':>10}{'原始元素':>10}")
+    for mutation in sorted(results["tolerant"]):
+        old = results["legacy"][mutation]
+        new = results["tolerant"][mutation]
+        print(f"{mutation:<16}{old['parsed'] / old['responses']:>12.1%}{new['parsed'] / new['responses']:>12.1%}"
+              f"{old['elements'] // args.repeat:>12}{new['elements'] // args.repeat:>12}{new['expected'] // args.repeat:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+端到端流水线基准测试 - 使用离线假LLM运行QuestionGeneratorGraph
+
+示例:
+    python benchmarks/bench_pipeline.py --docs 50 --concurrency 10
+    python benchmarks/bench_pipeline.py --latency-ms 0 --jitter-ms 0   # 只测量流水线自身开销
+    python benchmarks/bench_pipeline.py --backend auto --record run.jsonl.gz   # 录制真实提供商的响应
+    python benchmarks/bench_pipeline.py --replay run.jsonl.gz --replay-latency   # 按录制的响应和耗时回放
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import get_settings
+
+
+def percentile(values, q):
+    """计算分位数"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))
+    return ordered[index]
+
+
+async def run_benchmark(args):
+    # 配置必须在创建LLM服务之前设置
+    settings = get_settings()
+    settings.llm_backend = args.backend
+    settings.llm_cache_enabled = False
+    # 指纹索引只保存在内存中，每次运行从空索引开始，录制和回放时的调用序列一致
+    settings.document_index_path = ""
+    if args.record:
+        settings.llm_cassette_mode = "record"
+        settings.llm_cassette_path = args.record
+    elif args.replay:
+        settings.llm_cassette_mode = "replay"
+        settings.llm_cassette_path = args.replay
+        settings.llm_cassette_replay_latency = args.replay_latency
+        settings.llm_cassette_latency_scale = args.latency_scale
+    settings.fake_llm_latency_ms = args.latency_ms
+    settings.fake_llm_latency_jitter_ms = args.jitter_ms
+    settings.fake_llm_latency_distribution = args.distribution
+    settings.fake_llm_error_rate = args.error_rate
+    settings.fake_llm_explanation_chars = args.explanation_chars
+
+    from schemas import GraphState
+    from nodes import DocumentProcessorNode
+    from question_generator_graph import QuestionGeneratorGraph
+
+    graph = QuestionGeneratorGraph()
+    processor = DocumentProcessorNode()
+    base = processor.load_from_file(args.file)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    failures = 0
+
+    async def run_one(index: int):
+        nonlocal failures
+        # 每个文档内容略有不同，避免请求完全相同
+        document = processor.create_from_text(f"{base.title}-{index}", f"{base.content}\n\n文档编号: {index}")
+        async with semaphore:
+            started = time.perf_counter()
+            state = await graph.run(GraphState(document=document, current_step="start"))
+            latencies.append(time.perf_counter() - started)
+            if state.current_step != "completed":
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[run_one(i) for i in range(args.docs)])
+    elapsed = time.perf_counter() - started
+
+    print(f"文档数: {args.docs}  并发: {args.concurrency}  总耗时: {elapsed:.2f}s")
+    print(f"吞吐量: {args.docs / elapsed:.2f} 文档/秒  失败: {failures}")
+    print(f"单文档延迟: 平均 {statistics.mean(latencies) * 1000:.1f}ms  "
+          f"p50 {percentile(latencies, 0.5) * 1000:.1f}ms  "
+          f"p95 {percentile(latencies, 0.95) * 1000:.1f}ms  "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f}ms")
+
+    from llm_service import get_llm_service
+    cassette_stats = get_llm_service().get_cassette_stats()
+    if cassette_stats["enabled"]:
+        print(f"录制回放[{cassette_stats['mode']}]: 录制 {cassette_stats['recorded']} 条，"
+              f"回放 {cassette_stats['replayed']} 次，未命中 {cassette_stats['misses']} 次")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线端到端流水线基准测试")
+    parser.add_argument("--file", default="sample_document.md", help="基准文档")
+    parser.add_argument("--backend", default="fake", help="fake | auto（使用真实提供商，通常配合--record）")
+    parser.add_argument("--record", metavar="PATH", help="把LLM请求、响应和耗时录制到文件")
+    parser.add_argument("--replay", metavar="PATH", help="回放录制文件，文档数和基准文档需与录制时一致")
+    parser.add_argument("--replay-latency", action="store_true", help="回放时按录制的耗时等待")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="回放耗时的缩放倍数")
+    parser.add_argument("--docs", type=int, default=20, help="运行的文档数")
+    parser.add_argument("--concurrency", type=int, default=5, help="同时运行的文档数")
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="假LLM平均延迟")
+    parser.add_argument("--jitter-ms", type=float, default=300.0, help="假LLM延迟抖动")
+    parser.add_argument("--distribution", default="lognormal", help="constant | uniform | normal | lognormal")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入错误的概率")
+    parser.add_argument("--explanation-chars", type=int, default=60, help="每道题解释的长度")
+    asyncio.run(run_benchmark(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
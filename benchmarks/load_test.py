@@ -0,0 +1,187 @@
+"""
+网络路径压测 - 通过本地OpenAI兼容桩服务驱动LLMService/QuestionGeneratorGraph
+
+示例:
+    # 自动启动进程内桩服务，200个文档并发运行完整工作流
+    python benchmarks/load_test.py --docs 200 --concurrency 200
+
+    # 连接已经单独启动的桩服务（python stub_server.py --script phases.json）
+    python benchmarks/load_test.py --base-url http://127.0.0.1:8765/v1 --mode llm --requests 2000
+
+    # 3个延迟不同的端点，按权重、延迟和错误率路由
+    python benchmarks/load_test.py --mode llm --endpoints 3 --latency-spread 0.5 --routing weighted
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import get_settings
+
+
+def percentile(values, q):
+    """计算分位数"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))
+    return ordered[index]
+
+
+def report(name: str, latencies, failures: int, elapsed: float):
+    """输出吞吐量和延迟分布"""
+    total = len(latencies) + failures
+    print(f"\n📊 {name}: 共 {total} 个，成功 {len(latencies)}，失败 {failures}，总耗时 {elapsed:.2f}s")
+    print(f"   吞吐量: {len(latencies) / elapsed:.2f}/s")
+    if latencies:
+        print(f"   延迟: 平均 {statistics.mean(latencies) * 1000:.0f}ms  "
+              f"p50 {percentile(latencies, 0.5) * 1000:.0f}ms  "
+              f"p95 {percentile(latencies, 0.95) * 1000:.0f}ms  "
+              f"p99 {percentile(latencies, 0.99) * 1000:.0f}ms  "
+              f"max {max(latencies) * 1000:.0f}ms")
+
+
+async def run_llm_load(args, service):
+    """直接对LLMService施压"""
+    from prompts import MultipleChoicePrompt
+
+    template = MultipleChoicePrompt.get_prompt()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, failures = [], 0
+
+    async def one(index: int):
+        nonlocal failures
+        prompt = template.format(topic=f"压测主题{index}", key_points=f"- 知识点{index}：压测内容")
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await service.invoke_with_fallback(prompt, stage="multiple_choice", use_cache=False)
+                latencies.append(time.perf_counter() - started)
+            except Exception:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(args.requests)])
+    report("LLM调用", latencies, failures, time.perf_counter() - started)
+
+
+async def run_graph_load(args):
+    """运行完整工作流"""
+    from schemas import GraphState
+    from nodes import DocumentProcessorNode
+    from question_generator_graph import QuestionGeneratorGraph
+
+    graph = QuestionGeneratorGraph()
+    processor = DocumentProcessorNode()
+    base = processor.load_from_file(args.file)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, failures = [], 0
+
+    async def one(index: int):
+        nonlocal failures
+        document = processor.create_from_text(f"{base.title}-{index}", f"{base.content}\n\n文档编号: {index}")
+        async with semaphore:
+            started = time.perf_counter()
+            state = await graph.run(GraphState(document=document, current_step="start"))
+            if state.current_step == "completed":
+                latencies.append(time.perf_counter() - started)
+            else:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(args.docs)])
+    report("文档", latencies, failures, time.perf_counter() - started)
+
+
+async def run(args):
+    servers = []
+    base_urls = [args.base_url] if args.base_url else []
+    if not base_urls:
+        from stub_server import start_stub_server, StubScript
+        for index in range(max(1, args.endpoints)):
+            # 第i个端点的延迟为基准延迟的(1 + i × latency_spread)倍
+            script = StubScript.from_file(args.script) if args.script else StubScript([{
+                "latency_ms": args.latency_ms * (1 + index * args.latency_spread),
+                "jitter_ms": args.jitter_ms,
+                "rate_429": args.rate_429,
+                "rate_5xx": args.rate_5xx
+            }])
+            server = start_stub_server(script=script)
+            servers.append(server)
+            base_urls.append(server.base_url)
+            print(f"🧪 已启动进程内桩服务: {server.base_url}")
+
+    # 只使用指向桩服务的OpenAI提供商，配置必须在创建LLM服务之前设置
+    settings = get_settings()
+    settings.llm_backend = "auto"
+    settings.dashscope_api_key = None
+    settings.openai_api_key = "stub-key"
+    settings.openai_base_url = base_urls[0]
+    settings.llm_cache_enabled = False
+    settings.llm_concurrency_max = args.max_concurrency
+    settings.llm_rate_limits = {**settings.llm_rate_limits, "openai": {"qps": args.qps, "tpm": args.tpm}}
+    if len(base_urls) > 1:
+        settings.llm_routing = args.routing
+        settings.llm_endpoints = [
+            {"name": f"stub-{index + 1}", "type": "openai", "api_key": "stub-key", "base_url": url,
+             "qps": args.qps, "tpm": args.tpm}
+            for index, url in enumerate(base_urls)
+        ]
+
+    from llm_service import get_llm_service
+    service = get_llm_service()
+
+    if args.mode == "llm":
+        await run_llm_load(args, service)
+    else:
+        await run_graph_load(args)
+
+    for name, stats in service.get_limiter_stats().items():
+        print(f"🚦 限流[{name}]: 并发上限 {stats['concurrency_limit']}，"
+              f"平均排队 {stats['avg_queue_delay'] * 1000:.0f}ms，最大排队 {stats['max_queue_delay'] * 1000:.0f}ms，"
+              f"过载 {stats['overloaded']} 次")
+    pool_stats = service.get_pool_stats()
+    if pool_stats["enabled"]:
+        async_pool = pool_stats["async_pool"]
+        print(f"🔌 连接池: 请求 {pool_stats['requests']} 次，当前连接 {async_pool['connections']} 个"
+              f"（空闲 {async_pool['idle']}），HTTP/2: {pool_stats['http2']}")
+    for name, stats in service.get_health_status().items():
+        print(f"⚡ 熔断器[{name}]: {stats['state']}，失败 {stats['failures']} 次，拒绝 {stats['rejected']} 次")
+    routing_stats = service.get_routing_stats()
+    if routing_stats["enabled"]:
+        for name, stats in routing_stats["endpoints"].items():
+            print(f"🧭 路由[{name}]: 首选 {stats['selected']} 次，调用 {stats['calls']} 次，"
+                  f"延迟EWMA {stats['latency'] or 0:.2f}s，错误率 {stats['error_rate']:.1%}")
+    for server in servers:
+        print(f"🧪 桩服务统计[{server.base_url}]: {server.stats.snapshot()}")
+        server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="通过本地桩服务压测LLM网络路径")
+    parser.add_argument("--base-url", type=str, help="已启动的桩服务地址，不指定时自动启动进程内桩服务")
+    parser.add_argument("--mode", choices=["graph", "llm"], default="graph", help="压测完整工作流或只压测LLM调用")
+    parser.add_argument("--file", default="sample_document.md", help="graph模式使用的文档")
+    parser.add_argument("--docs", type=int, default=100, help="graph模式的文档数")
+    parser.add_argument("--requests", type=int, default=1000, help="llm模式的请求数")
+    parser.add_argument("--concurrency", type=int, default=100, help="同时进行的文档数或请求数")
+    parser.add_argument("--script", type=str, help="桩服务行为脚本")
+    parser.add_argument("--latency-ms", type=float, default=800.0)
+    parser.add_argument("--jitter-ms", type=float, default=200.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    parser.add_argument("--max-concurrency", type=int, default=256, help="客户端自适应并发上限")
+    parser.add_argument("--qps", type=float, default=0, help="客户端QPS限制，0表示不限制")
+    parser.add_argument("--tpm", type=float, default=0, help="客户端TPM限制，0表示不限制")
+    parser.add_argument("--endpoints", type=int, default=1, help="启动的桩服务端点数，大于1时使用llm_endpoints")
+    parser.add_argument("--latency-spread", type=float, default=0.0, help="各端点之间的延迟差异比例")
+    parser.add_argument("--routing", choices=["priority", "weighted"], default="weighted", help="多端点时的路由方式")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+录制回放模块 - 把LLM请求、响应和耗时写入录制文件，回放时按请求哈希返回，不访问网络
+"""
+import os
+import gzip
+import json
+import time
+import atexit
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Tuple, IO
+
+try:
+    from langchain_core.messages import AIMessage, AIMessageChunk
+except ImportError:
+    from langchain.schema import AIMessage, AIMessageChunk
+
+from fake_llm import apply_output_limits
+
+logger = logging.getLogger(__name__)
+
+
+class CassetteMissError(LookupError):
+    """回放时录制文件中没有对应的请求"""
+
+    # 按请求无效处理：不重试，也不熔断提供商
+    status_code = 404
+
+
+def request_key(prompt: str) -> str:
+    """请求哈希：只取决于Prompt，自适应max_tokens等每次运行可能不同的参数不参与"""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    录制文件
+
+    每行一条JSON记录（请求哈希、阶段、提供商、模型、Prompt、响应、耗时、token用量和结束原因），
+    路径以.gz结尾时用gzip压缩。录制时每条记录立即写入；同一请求录制了多次时按录制顺序轮流回放。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursors: Dict[str, int] = {}
+        self._file: Optional[IO[str]] = None
+        self.stats = {"recorded": 0, "replayed": 0, "misses": 0}
+
+    def _open(self, mode: str) -> IO[str]:
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def load(self) -> int:
+        """读取录制文件，返回记录数；文件不存在时为0"""
+        if not os.path.exists(self.path):
+            return 0
+        count = 0
+        entries: Dict[str, List[Dict[str, Any]]] = {}
+        try:
+            with self._open("r") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    entry = json.loads(line)
+                    entries.setdefault(entry["key"], []).append(entry)
+                    count += 1
+        except (EOFError, OSError, ValueError) as e:
+            # 录制进程异常退出时最后一段可能不完整，已读出的记录仍然可用
+            logger.warning(f"录制文件{self.path}读取到第{count}条后中断: {e}")
+        with self._lock:
+            self._entries = entries
+            self._cursors = {}
+        return count
+
+    def record(
+        self,
+        prompt: str,
+        response: str,
+        latency: float,
+        stage: str = "default",
+        provider: str = "",
+        model: str = "",
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        finish_reason: Optional[str] = None,
+        if_missing: bool = False
+    ):
+        """
+        追加一条记录
+
+        Args:
+            prompt: 请求Prompt
+            response: 响应文本（结构化输出时为题目数组的JSON文本）
+            latency: 调用耗时（秒）
+            if_missing: 为True时同一请求已有记录则跳过（用于缓存命中的响应）
+        """
+        key = request_key(prompt)
+        entry = {
+            "key": key,
+            "stage": stage,
+            "provider": provider,
+            "model": model,
+            "prompt": prompt,
+            "response": response,
+            "latency": round(latency, 4),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "finish_reason": finish_reason,
+            "recorded_at": round(time.time(), 3)
+        }
+        with self._lock:
+            if if_missing and key in self._entries:
+                return
+            self._entries.setdefault(key, []).append(entry)
+            try:
+                if self._file is None:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    self._file = self._open("a")
+                    atexit.register(self.close)
+                self._file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+                self._file.flush()
+                self.stats["recorded"] += 1
+            except OSError as e:
+                logger.error(f"录制文件写入失败: {e}")
+
+    def lookup(self, prompt: str) -> Optional[Dict[str, Any]]:
+        """按请求哈希取出一条记录，同一请求的多条记录轮流返回"""
+        key = request_key(prompt)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.stats["misses"] += 1
+                return None
+            cursor = self._cursors.get(key, 0)
+            self._cursors[key] = cursor + 1
+            self.stats["replayed"] += 1
+            return entries[cursor % len(entries)]
+
+    def close(self):
+        """关闭录制文件（gzip文件在关闭时写入结尾校验）"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "path": self.path,
+                "requests": len(self._entries),
+                "entries": sum(len(entries) for entries in self._entries.values()),
+                **self.stats
+            }
+
+
+class CassetteChatModel:
+    """
+    回放录制文件的聊天模型
+
+    接口与FakeChatModel一致；响应、token用量和结束原因取自录制记录，
+    仍按本次请求的max_tokens和stop截断，开启replay_latency时按录制的耗时（乘以latency_scale）等待。
+    """
+
+    def __init__(
+        self,
+        cassette: Cassette,
+        replay_latency: bool = False,
+        latency_scale: float = 1.0,
+        model_name: str = "cassette",
+        chunk_chars: int = 16
+    ):
+        self.cassette = cassette
+        self.replay_latency = replay_latency
+        self.latency_scale = max(0.0, latency_scale)
+        self.model_name = model_name
+        self.chunk_chars = max(1, chunk_chars)
+        self.calls = 0
+
+    def _lookup(self, prompt: str) -> Dict[str, Any]:
+        self.calls += 1
+        entry = self.cassette.lookup(prompt)
+        if entry is None:
+            raise CassetteMissError(f"录制文件中没有该请求（{request_key(prompt)[:12]}）")
+        return entry
+
+    def _latency(self, entry: Dict[str, Any]) -> float:
+        return entry.get("latency", 0.0) * self.latency_scale if self.replay_latency else 0.0
+
+    @staticmethod
+    def _limit(entry: Dict[str, Any], **kwargs) -> Tuple[str, str]:
+        """
+        按本次请求的stop和max_tokens截断录制的响应
+
+        max_tokens按录制的真实输出token数换算，录制时没有超出预算的响应回放时也不会被截断。
+        """
+        content, _ = apply_output_limits(entry["response"], stop=kwargs.get("stop"))
+        finish_reason = entry.get("finish_reason") or "stop"
+        max_tokens = kwargs.get("max_tokens")
+        completion_tokens = entry.get("completion_tokens", 0)
+        if max_tokens and completion_tokens > max_tokens:
+            content = content[:int(len(content) * max_tokens / completion_tokens)]
+            finish_reason = "length"
+        return content, finish_reason
+
+    def _message(self, entry: Dict[str, Any], **kwargs) -> AIMessage:
+        content, finish_reason = self._limit(entry, **kwargs)
+        prompt_tokens = entry.get("prompt_tokens", 0)
+        completion_tokens = entry.get("completion_tokens", 0)
+        if kwargs.get("max_tokens"):
+            completion_tokens = min(completion_tokens, kwargs["max_tokens"])
+        return AIMessage(
+            content=content,
+            response_metadata={"model_name": entry.get("model") or self.model_name, "finish_reason": finish_reason},
+            usage_metadata={
+                "input_tokens": prompt_tokens,
+                "output_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        )
+
+    def invoke(self, prompt: str, **kwargs) -> AIMessage:
+        """同步调用"""
+        entry = self._lookup(prompt)
+        time.sleep(self._latency(entry))
+        return self._message(entry, **kwargs)
+
+    async def ainvoke(self, prompt: str, **kwargs) -> AIMessage:
+        """异步调用"""
+        entry = self._lookup(prompt)
+        await asyncio.sleep(self._latency(entry))
+        return self._message(entry, **kwargs)
+
+    async def astream(self, prompt: str, **kwargs):
+        """流式调用：首个片段在20%延迟后到达，其余片段均匀分布在剩余时间内"""
+        entry = self._lookup(prompt)
+        latency = self._latency(entry)
+        content, _ = self._limit(entry, **kwargs)
+        chunks = [content[i:i + self.chunk_chars] for i in range(0, len(content), self.chunk_chars)]
+        await asyncio.sleep(latency * 0.2)
+        step = latency * 0.8 / max(1, len(chunks))
+        for chunk in chunks:
+            yield AIMessageChunk(content=chunk)
+            if step:
+                await asyncio.sleep(step)
@@ -0,0 +1,176 @@
+"""
+检查点模块 - 把工作流每一步完成后的状态写入本地SQLite，进程中断或题型生成失败后按运行ID从断点继续
+"""
+import os
+import time
+import asyncio
+import logging
+import sqlite3
+from typing import Any, AsyncIterator, Dict, Optional, Sequence, Tuple
+
+from config import get_settings
+
+try:
+    from langgraph.checkpoint.sqlite import SqliteSaver
+except ImportError:
+    SqliteSaver = None
+
+logger = logging.getLogger(__name__)
+
+
+if SqliteSaver is not None:
+
+    class SqliteCheckpointer(SqliteSaver):
+        """
+        SQLite检查点存储
+
+        基于同步的SqliteSaver，异步接口把同一组读写放到线程池中执行，不阻塞事件循环。
+        （langgraph自带的AsyncSqliteSaver依赖aiosqlite的内部接口，与新版aiosqlite不兼容。）
+        写入由SqliteSaver的锁串行化，多个文档并发运行时共享同一个连接。
+        每个运行最后一次写入检查点的时间记录在checkpoint_runs表中，按存活时间和运行数上限清理。
+        """
+
+        def setup(self) -> None:
+            if self.is_setup:
+                return
+            # 与SqliteSaver.setup相同，由调用方（cursor）持有锁
+            super().setup()
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoint_runs ("
+                " thread_id TEXT PRIMARY KEY,"
+                " updated_at REAL NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_checkpoint_runs_updated ON checkpoint_runs(updated_at)"
+            )
+            # 记录表创建之前保存的运行按当前时间计算存活时间
+            self.conn.execute(
+                "INSERT OR IGNORE INTO checkpoint_runs (thread_id, updated_at)"
+                " SELECT DISTINCT thread_id, ? FROM checkpoints",
+                (time.time(),)
+            )
+            self.conn.commit()
+
+        def put(self, config, checkpoint, metadata, new_versions):
+            result = super().put(config, checkpoint, metadata, new_versions)
+            with self.cursor() as cur:
+                cur.execute(
+                    "INSERT OR REPLACE INTO checkpoint_runs (thread_id, updated_at) VALUES (?, ?)",
+                    (str(config["configurable"]["thread_id"]), time.time())
+                )
+            return result
+
+        def delete_thread(self, thread_id: str) -> None:
+            super().delete_thread(thread_id)
+            with self.cursor() as cur:
+                cur.execute("DELETE FROM checkpoint_runs WHERE thread_id = ?", (str(thread_id),))
+
+        def prune(self, max_runs: int = 0, ttl_seconds: float = 0) -> int:
+            """
+            删除超过存活时间或超出运行数上限（按最后写入时间保留最近的）的运行
+
+            Args:
+                max_runs: 保留的运行数上限，0表示不限制
+                ttl_seconds: 运行的存活时间（秒），0表示不过期
+
+            Returns:
+                删除的运行数
+            """
+            with self.cursor(transaction=False) as cur:
+                expired = set()
+                if ttl_seconds and ttl_seconds > 0:
+                    expired.update(row[0] for row in cur.execute(
+                        "SELECT thread_id FROM checkpoint_runs WHERE updated_at < ?", (time.time() - ttl_seconds,)
+                    ).fetchall())
+                if max_runs and max_runs > 0:
+                    expired.update(row[0] for row in cur.execute(
+                        "SELECT thread_id FROM checkpoint_runs ORDER BY updated_at DESC LIMIT -1 OFFSET ?",
+                        (max_runs,)
+                    ).fetchall())
+            for thread_id in expired:
+                self.delete_thread(thread_id)
+            if expired:
+                logger.info(f"已清理 {len(expired)} 个过期运行的检查点")
+            return len(expired)
+
+        async def aget_tuple(self, config):
+            return await asyncio.to_thread(self.get_tuple, config)
+
+        async def alist(
+            self,
+            config,
+            *,
+            filter: Optional[Dict[str, Any]] = None,
+            before=None,
+            limit: Optional[int] = None
+        ) -> AsyncIterator[Any]:
+            items = await asyncio.to_thread(
+                lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+            )
+            for item in items:
+                yield item
+
+        async def aput(self, config, checkpoint, metadata, new_versions):
+            return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+        async def aput_writes(self, config, writes: Sequence[Tuple[str, Any]], task_id: str, task_path: str = ""):
+            return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+        async def adelete_thread(self, thread_id: str):
+            return await asyncio.to_thread(self.delete_thread, thread_id)
+
+        async def aprune(self, max_runs: int = 0, ttl_seconds: float = 0) -> int:
+            return await asyncio.to_thread(self.prune, max_runs, ttl_seconds)
+
+else:
+    SqliteCheckpointer = None
+
+
+def create_checkpointer(path: str, max_runs: int = 0, ttl_seconds: float = 0) -> Optional[Any]:
+    """
+    创建SQLite检查点存储，并清理过期的运行
+
+    Args:
+        path: 数据库文件路径
+        max_runs: 保留的运行数上限，0表示不限制
+        ttl_seconds: 运行的存活时间（秒），0表示不过期
+
+    Returns:
+        检查点存储；未安装langgraph-checkpoint-sqlite或打开失败时为None（不保存检查点）
+    """
+    if SqliteCheckpointer is None:
+        print("⚠️  未安装langgraph-checkpoint-sqlite，工作流不保存检查点，无法断点续跑")
+        return None
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        checkpointer = SqliteCheckpointer(conn)
+        checkpointer.setup()
+        checkpointer.prune(max_runs, ttl_seconds)
+        return checkpointer
+    except sqlite3.Error as e:
+        logger.error(f"检查点数据库打开失败，工作流不保存检查点: {e}")
+        return None
+
+
+_checkpointer: Optional[Any] = None
+_checkpointer_created = False
+
+
+def get_checkpointer() -> Optional[Any]:
+    """获取全局检查点存储；关闭检查点时为None"""
+    global _checkpointer, _checkpointer_created
+    if not _checkpointer_created:
+        settings = get_settings()
+        if settings.graph_checkpoint_enabled and settings.graph_checkpoint_path:
+            _checkpointer = create_checkpointer(
+                settings.graph_checkpoint_path,
+                max_runs=settings.graph_checkpoint_max_runs,
+                ttl_seconds=settings.graph_checkpoint_ttl_seconds
+            )
+        _checkpointer_created = True
+    return _checkpointer
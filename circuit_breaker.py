@@ -0,0 +1,192 @@
+"""
+熔断器模块 - 按错误率和延迟隔离故障的LLM提供商
+"""
+import time
+import threading
+from collections import deque
+from enum import Enum
+from typing import Dict, Any, Optional
+
+
+class CircuitState(str, Enum):
+    """熔断器状态枚举"""
+    CLOSED = "closed"  # 正常放行
+    OPEN = "open"  # 熔断，直接拒绝
+    HALF_OPEN = "half_open"  # 试探，放行少量请求
+
+
+class CircuitBreaker:
+    """
+    基于滑动窗口的熔断器
+
+    最近window_size次调用（至少min_calls次）中失败率或慢调用率超过阈值时熔断，
+    设置consecutive_failures时连续失败达到该次数也会熔断（默认0，只按窗口判断）；
+    熔断open_seconds秒后进入半开状态，试探请求全部成功则恢复，任一失败则重新熔断。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate_threshold: float = 0.5,
+        slow_call_seconds: float = 60.0,
+        slow_call_rate_threshold: float = 0.8,
+        window_size: int = 20,
+        min_calls: int = 5,
+        consecutive_failures: int = 0,
+        open_seconds: float = 30.0,
+        half_open_max_calls: int = 1
+    ):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.min_calls = max(1, min_calls)
+        self.consecutive_failure_limit = max(0, consecutive_failures)
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = max(1, half_open_max_calls)
+
+        # 窗口中每项为(是否失败, 是否慢调用)
+        self._window: deque = deque(maxlen=max(1, window_size))
+        self._state = CircuitState.CLOSED
+        self._opened_at = 0.0
+        self._consecutive_failures = 0
+        self._half_open_in_flight = 0
+        self._half_open_successes = 0
+        self._lock = threading.Lock()
+        self.tripped = False  # 由trip()熔断（认证失败、额度耗尽等），此时不再作为兜底提供商
+
+        self.last_error: Optional[str] = None
+        self.stats: Dict[str, int] = {
+            "successes": 0,
+            "failures": 0,
+            "rejected": 0,
+            "opened": 0
+        }
+
+    @property
+    def state(self) -> CircuitState:
+        """当前状态，熔断时间到期后自动转为半开"""
+        with self._lock:
+            self._refresh_state()
+            return self._state
+
+    def _refresh_state(self):
+        if self._state == CircuitState.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = CircuitState.HALF_OPEN
+            self._half_open_in_flight = 0
+            self._half_open_successes = 0
+
+    def allow_request(self) -> bool:
+        """判断是否放行一次调用；半开状态下放行的调用必须随后记录结果或调用release"""
+        with self._lock:
+            self._refresh_state()
+            if self._state == CircuitState.CLOSED:
+                return True
+            if self._state == CircuitState.HALF_OPEN and self._half_open_in_flight < self.half_open_max_calls:
+                self._half_open_in_flight += 1
+                return True
+            self.stats["rejected"] += 1
+            return False
+
+    def open_remaining(self) -> float:
+        """距离进入半开状态的秒数，未熔断时为0"""
+        with self._lock:
+            self._refresh_state()
+            if self._state != CircuitState.OPEN:
+                return 0.0
+            return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def opened_since(self, since: float) -> bool:
+        """熔断器是否在since（time.monotonic()）之后打开且仍处于熔断状态"""
+        with self._lock:
+            self._refresh_state()
+            return self._state == CircuitState.OPEN and self._opened_at > since
+
+    def release(self):
+        """放弃一次已放行但未产生结果的调用（例如被取消）"""
+        with self._lock:
+            if self._state == CircuitState.HALF_OPEN and self._half_open_in_flight > 0:
+                self._half_open_in_flight -= 1
+
+    def record_success(self, latency: float = 0.0):
+        """记录一次成功调用"""
+        with self._lock:
+            self.stats["successes"] += 1
+            self._consecutive_failures = 0
+            slow = latency >= self.slow_call_seconds
+            if self._state == CircuitState.HALF_OPEN:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+                if slow:
+                    self._open()
+                    return
+                self._half_open_successes += 1
+                if self._half_open_successes >= self.half_open_max_calls:
+                    self._close()
+                return
+            self._window.append((False, slow))
+            self._evaluate()
+
+    def record_failure(self, error: Optional[Exception] = None, latency: float = 0.0):
+        """记录一次失败调用"""
+        with self._lock:
+            self.stats["failures"] += 1
+            self._consecutive_failures += 1
+            if error is not None:
+                self.last_error = str(error)
+            if self._state == CircuitState.HALF_OPEN:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+                self._open()
+                return
+            self._window.append((True, latency >= self.slow_call_seconds))
+            self._evaluate()
+
+    def trip(self, error: Optional[Exception] = None):
+        """立即熔断（例如主动探测失败时）"""
+        with self._lock:
+            if error is not None:
+                self.last_error = str(error)
+            self.tripped = True
+            self._open()
+
+    def _evaluate(self):
+        if self._state != CircuitState.CLOSED:
+            return
+        if self.consecutive_failure_limit and self._consecutive_failures >= self.consecutive_failure_limit:
+            self._open()
+            return
+        calls = len(self._window)
+        if calls < self.min_calls:
+            return
+        failures = sum(1 for failed, _ in self._window if failed)
+        slow_calls = sum(1 for _, slow in self._window if slow)
+        if failures / calls >= self.failure_rate_threshold or slow_calls / calls >= self.slow_call_rate_threshold:
+            self._open()
+
+    def _open(self):
+        if self._state != CircuitState.OPEN:
+            self.stats["opened"] += 1
+        self._state = CircuitState.OPEN
+        self._opened_at = time.monotonic()
+        self._half_open_in_flight = 0
+        self._half_open_successes = 0
+
+    def _close(self):
+        self._state = CircuitState.CLOSED
+        self.tripped = False
+        self._window.clear()
+        self._consecutive_failures = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取熔断器状态和统计信息"""
+        with self._lock:
+            self._refresh_state()
+            calls = len(self._window)
+            failures = sum(1 for failed, _ in self._window if failed)
+            return {
+                "state": self._state.value,
+                "failure_rate": failures / calls if calls else 0.0,
+                "window_calls": calls,
+                "consecutive_failures": self._consecutive_failures,
+                "last_error": self.last_error,
+                **self.stats
+            }
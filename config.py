@@ -2,7 +2,7 @@
 配置管理模块
 """
 import os
-from typing import Optional
+from typing import Optional, Dict, Any, List
 
 try:
     from pydantic import BaseSettings
@@ -18,6 +18,48 @@ class Settings(BaseSettings):
     # OpenAI API配置 (备选方案)
     openai_api_key: Optional[str] = None
     openai_base_url: str = "https://api.openai.com/v1"
+    # 通义千问接入方式
+    # sdk: 使用dashscope SDK（ChatTongyi），连接由SDK自行管理
+    # openai_compatible: 通过DashScope的OpenAI兼容接口调用，与OpenAI共享HTTP连接池
+    #                    （错误类型、用量字段和可用模型与SDK不同，需要时手动开启）
+    dashscope_transport: str = "sdk"
+    dashscope_base_url: str = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+    
+    # 多端点配置：非空时替代上面的通义千问/OpenAI主备，可以配置多个密钥和OpenAI兼容端点
+    # 每项: {"name": "qwen-a", "type": "dashscope" | "openai", "model": "qwen-plus",
+    #        "api_key": "..." 或 "api_key_env": "ALI_API_KEY_2", "base_url": "...",
+    #        "weight": 1.0, "max_concurrency": 16, "qps": 10, "tpm": 1000000}
+    llm_endpoints: List[Dict[str, Any]] = []
+    # 路由方式
+    # priority: 按配置顺序主备，前面的端点熔断时才使用后面的
+    # weighted: 按权重、实时延迟和错误率（EWMA）分配请求，达到并发上限的端点降低优先级
+    llm_routing: str = "priority"
+    llm_routing_ewma_alpha: float = 0.2  # 延迟和错误率EWMA的平滑系数
+    
+    # 共享HTTP连接池配置（所有LLM实例复用）
+    http_max_connections: int = 100  # 连接总数上限
+    http_max_keepalive_connections: int = 20  # 保持空闲的连接数上限
+    http_keepalive_expiry: float = 30.0  # 空闲连接保持时间（秒）
+    http_connect_timeout: float = 5.0  # 建立连接超时（秒）
+    http_read_timeout: float = 120.0  # 读取响应超时（秒）
+    http_http2: bool = False  # 启用HTTP/2多路复用，需要安装h2
+    
+    # LLM后端选择
+    # auto: 根据API密钥使用通义千问/OpenAI
+    # fake: 进程内离线假LLM，不需要API密钥和网络，用于基准测试和性能分析
+    llm_backend: str = "auto"
+    fake_llm_latency_ms: float = 800.0  # 平均延迟，设为0可单独测量流水线自身开销
+    fake_llm_latency_jitter_ms: float = 300.0  # 延迟抖动（标准差或半宽）
+    fake_llm_latency_distribution: str = "lognormal"  # constant | uniform | normal | lognormal
+    fake_llm_error_rate: float = 0.0  # 注入429/5xx错误的概率
+    fake_llm_explanation_chars: int = 60  # 每道题解释的长度，用于控制响应大小
+    fake_llm_seed: int = 42
+    
+    # 录制回放：record时把每次LLM请求、响应和耗时写入录制文件；replay时按请求哈希回放录制的响应，不访问网络
+    llm_cassette_mode: str = "off"  # off | record | replay
+    llm_cassette_path: str = ".cache/llm_cassette.jsonl.gz"  # .gz结尾时gzip压缩
+    llm_cassette_replay_latency: bool = False  # 回放时按录制的耗时等待，用于带真实延迟分布的性能测试
+    llm_cassette_latency_scale: float = 1.0  # 回放耗时的缩放倍数
     
     # 应用配置
     debug: bool = True
@@ -27,10 +69,106 @@ class Settings(BaseSettings):
     default_model: str = "qwen-plus"  # 通义千问模型
     backup_model: str = "gpt-3.5-turbo"  # 备选OpenAI模型
     
+    # 分阶段模型配置：按阶段（analysis、multiple_choice、fill_in_the_blank、matching）或分组（generation）覆盖模型和参数
+    # 每项可包含: model（通义千问使用的模型）、backup_model（OpenAI使用的模型）、
+    #            models（按提供商名称指定模型，如{"qwen-b": "qwen-max"}）、temperature、max_tokens
+    # 例: {"analysis": {"model": "qwen-turbo", "temperature": 0.3}, "matching": {"model": "qwen-max"}}
+    llm_stage_settings: Dict[str, Dict[str, Any]] = {}
+    # 模型单价（每千token的输入/输出价格），用于按阶段统计费用；没有完全匹配时按最长前缀匹配，仍未找到的模型不计费用
+    llm_model_prices: Dict[str, Dict[str, float]] = {
+        "qwen-turbo": {"input": 0.0003, "output": 0.0006},
+        "qwen-plus": {"input": 0.0008, "output": 0.002},
+        "qwen-max": {"input": 0.0024, "output": 0.0096}
+    }
+    llm_cost_currency: str = "CNY"  # 价格的货币单位，只用于显示
+    
+    # 健康检查配置
+    # lazy: 不主动探测，提供商在真实调用失败前均视为健康
+    # background: 启动后在后台线程探测，不阻塞启动
+    # startup: 启动时同步探测（旧行为，会多一次LLM往返）
+    llm_health_check: str = "lazy"
+    llm_unhealthy_after_failures: int = 0  # 连续失败多少次后直接熔断，0表示只按下面的滑动窗口判断
+    
+    # 熔断器配置（每个提供商独立）
+    circuit_failure_rate_threshold: float = 0.5  # 窗口内失败率达到该值时熔断
+    circuit_slow_call_seconds: float = 60.0  # 超过该耗时的调用视为慢调用
+    circuit_slow_call_rate_threshold: float = 0.8  # 窗口内慢调用比例达到该值时熔断
+    circuit_window_size: int = 20  # 滑动窗口调用数
+    circuit_min_calls: int = 5  # 窗口内至少有多少次调用才按比例判断
+    circuit_open_seconds: float = 30.0  # 熔断持续时间，之后进入半开试探
+    circuit_half_open_max_calls: int = 1  # 半开状态允许的试探调用数
+    
+    # 请求对冲配置：调用超过近期延迟分位数仍未返回时，向备选（或同一）提供商发送副本
+    llm_hedge_enabled: bool = False
+    llm_hedge_percentiles: Dict[str, float] = {"analysis": 0.95, "generation": 0.9}  # 按阶段或阶段分组设置
+    llm_hedge_min_delay: float = 2.0  # 对冲等待时间下限（秒）
+    llm_hedge_max_ratio: float = 0.1  # 每个阶段最多对冲的调用比例
+    llm_hedge_min_samples: int = 10  # 至少积累多少个延迟样本才开始对冲
+    
+    # 限流配置：每个提供商独立的QPS/TPM令牌桶 + AIMD自适应并发
+    llm_rate_limit_enabled: bool = True
+    llm_rate_limits: Dict[str, Dict[str, float]] = {
+        "dashscope": {"qps": 10, "tpm": 1000000},
+        "openai": {"qps": 5, "tpm": 200000}
+    }  # 0表示不限制
+    llm_concurrency_initial: int = 4  # 初始并发上限
+    llm_concurrency_min: int = 1
+    llm_concurrency_max: int = 32
+    llm_concurrency_latency_tolerance: float = 2.0  # 延迟不超过基线的倍数时继续提升并发
+    
+    # 重试配置：超时/5xx按指数退避加抖动重试，429优先按Retry-After等待，认证失败等错误不重试
+    llm_retry_max_attempts: int = 3  # 每个提供商的最大尝试次数（含首次）
+    llm_retry_base_delay: float = 0.5  # 退避基准时间（秒）
+    llm_retry_max_delay: float = 20.0  # 单次退避上限（秒）
+    llm_retry_max_retry_after: float = 60.0  # 服务端Retry-After的采纳上限（秒）
+    document_deadline_seconds: float = 600.0  # 每个文档的处理时间预算，重试不会超过该时间；0表示不限制
+    
+    # 工作流检查点：每个节点完成后把状态写入SQLite，按运行ID从最后完成的节点继续（需要langgraph-checkpoint-sqlite）
+    graph_checkpoint_enabled: bool = True
+    graph_checkpoint_path: str = ".cache/checkpoints.sqlite3"
+    graph_checkpoint_max_runs: int = 1000  # 保留的失败或未完成运行数上限（按最后写入时间），0表示不限制
+    graph_checkpoint_ttl_seconds: int = 7 * 24 * 3600  # 运行检查点的存活时间，0表示不过期
+    
+    # 追踪：非空时每次运行把节点、LLM调用和解析校验步骤的时间线写入该目录（每次运行一个文件）
+    trace_dir: str = ""
+    trace_format: str = "chrome"  # chrome: Chrome trace-event（chrome://tracing、Perfetto） | otlp: OTLP/JSON
+    
+    # 请求合并：相同的请求（Prompt和输出参数一致）正在进行时，后到的调用等待同一个上游请求
+    llm_single_flight_enabled: bool = True
+    
+    # 结构化输出：题目生成时按题目模型推导的Schema请求JSON，不支持的提供商自动使用文本模式
+    # auto/tool: 使用函数调用 | json_mode: 使用JSON对象响应格式 | off: 只使用文本模式
+    llm_structured_output: str = "auto"
+    
     # 题目生成配置
-    max_questions_per_type: int = 5
+    llm_streaming_generation: bool = False  # 流式生成：每道题的JSON对象一闭合就校验并输出
+    max_questions_per_type: int = 5  # 每类题目的目标数量，超过一次调用的知识点数时分组并行生成
+    generation_chunk_size: int = 5  # 每次调用使用的知识点数（连线题至少为一道题所需的知识点数）
+    generation_max_parallel_chunks: int = 4  # 每个题型同时进行的分组调用数
     temperature: float = 0.7
-    max_tokens: int = 10000
+    max_tokens: int = 10000  # 单次调用的输出token上限
+    
+    # 输出预算：按阶段的历史输出量和知识点数估算每次调用的max_tokens（不超过max_tokens）
+    llm_adaptive_max_tokens: bool = True
+    llm_output_budget_headroom: float = 1.5  # 预算相对估计值的余量倍数
+    llm_output_budget_quantum: int = 512  # 预算向上取整的粒度
+    llm_output_budget_min_tokens: int = 512  # 预算下限
+    llm_early_stop: bool = True  # 题目JSON数组结束后立即停止生成（stop序列）
+    
+    # 近似重复文档：内容与已分析文档的SimHash指纹足够接近时，直接复用其主题和知识点
+    document_dedup_enabled: bool = True
+    document_similarity_threshold: float = 0.95  # 64位指纹中相同位的比例，0.95即最多3位不同
+    document_index_path: str = ".cache/document_index.sqlite3"  # 为空时只在内存中保存
+    document_index_max_entries: int = 50000
+    document_index_ttl_seconds: int = 30 * 24 * 3600  # 分析结果的存活时间，0表示不过期
+    
+    # LLM响应缓存配置
+    llm_cache_enabled: bool = True  # 关闭后所有调用直接访问LLM
+    llm_cache_refresh: bool = False  # 忽略已有缓存并用新响应覆盖
+    llm_cache_path: str = ".cache/llm_cache.sqlite3"  # 为空时只使用内存缓存
+    llm_cache_memory_entries: int = 256  # 内存LRU条目上限
+    llm_cache_max_entries: int = 10000  # 磁盘缓存条目上限
+    llm_cache_ttl_seconds: int = 7 * 24 * 3600  # 缓存存活时间，0表示不过期
     
     def __init__(self, **kwargs):
         """直接从环境变量读取API密钥确保一致性"""
@@ -0,0 +1,321 @@
+"""
+文档指纹索引模块 - 用SimHash识别近似重复的文档，复用已有的文档分析结果
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Optional, Dict, Any, List, Tuple
+
+from config import get_settings
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_BITS = 64
+
+# 第i张表把字节值映射为它的第i位（0或1）
+_BIT_TABLES = tuple(bytes(value >> bit & 1 for value in range(256)) for bit in range(8))
+
+# 只保留文字和数字，忽略空白、标点和大小写差异
+_NORMALIZE_PATTERN = re.compile(r"[^\w]+", re.UNICODE)
+
+
+def normalize_text(text: str) -> str:
+    """去掉空白和标点并转为小写"""
+    return _NORMALIZE_PATTERN.sub("", text or "").lower()
+
+
+def content_hash(text: str) -> str:
+    """归一化文本的SHA-256，用于精确匹配"""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def simhash(text: str, shingle_size: int = 3) -> int:
+    """
+    计算文本的64位SimHash指纹
+
+    特征为归一化文本的字符n-gram（中文没有空格分词），重复出现的n-gram按次数加权。
+    所有特征的8字节哈希拼接后按字节列切片，用translate/count统计每一位上置1的特征数，
+    避免在Python层对每个特征逐位循环。
+
+    Args:
+        text: 文档内容
+        shingle_size: n-gram长度
+
+    Returns:
+        64位指纹（无符号整数）
+    """
+    normalized = normalize_text(text)
+    if not normalized:
+        return 0
+    shingles = [normalized[i:i + shingle_size] for i in range(max(1, len(normalized) - shingle_size + 1))]
+    # 每个不同的n-gram只哈希一次
+    hashed = {
+        shingle: hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest()
+        for shingle in set(shingles)
+    }
+    digests = b"".join(map(hashed.__getitem__, shingles))
+    count = len(shingles)
+
+    fingerprint = 0
+    for position in range(FINGERPRINT_BITS // 8):
+        column = digests[position::8]
+        for bit, table in enumerate(_BIT_TABLES):
+            # 某一位上置1的特征超过一半时该位为1
+            if column.translate(table).count(1) * 2 > count:
+                fingerprint |= 1 << (position * 8 + bit)
+    return fingerprint
+
+
+def document_signature(text: str) -> Tuple[str, int]:
+    """文档的(归一化内容哈希, SimHash指纹)"""
+    return content_hash(text), simhash(text)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def max_distance_for(threshold: float) -> int:
+    """相似度阈值（相同位的比例）对应的最大汉明距离"""
+    threshold = min(1.0, max(0.0, threshold))
+    return int((1.0 - threshold) * FINGERPRINT_BITS + 1e-9)
+
+
+class IndexedDocument:
+    """索引中的一篇已分析文档"""
+
+    def __init__(self, content_hash: str, fingerprint: int, title: str, topics: List[str],
+                 key_points: List[str], created_at: float):
+        self.content_hash = content_hash
+        self.fingerprint = fingerprint
+        self.title = title
+        self.topics = topics
+        self.key_points = key_points
+        self.created_at = created_at
+
+
+class DocumentFingerprintIndex:
+    """
+    SimHash指纹索引
+
+    指纹被切成max_distance+1段，每段一张倒排表。两个指纹的汉明距离不超过max_distance时，
+    按抽屉原理至少有一段完全相同，因此查询只需比较各段命中的候选，不必扫描全部文档。
+    条目保存在内存中，配置路径时同时写入SQLite，重启后重新加载；超过存活时间的条目不再命中并被删除。
+    """
+
+    def __init__(self, path: Optional[str] = None, max_distance: int = 3, max_entries: int = 50000,
+                 ttl_seconds: Optional[float] = None):
+        self.path = path
+        self.max_distance = max(0, min(max_distance, FINGERPRINT_BITS - 1))
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds if ttl_seconds and ttl_seconds > 0 else None
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._entries: Dict[str, IndexedDocument] = {}
+        self._segments = self._segment_bounds(self.max_distance + 1)
+        self._tables: List[Dict[int, List[str]]] = [{} for _ in self._segments]
+        self.stats: Dict[str, int] = {"exact_hits": 0, "near_hits": 0, "misses": 0, "candidates": 0, "expired": 0}
+
+        if path:
+            self._open_disk(path)
+
+    @staticmethod
+    def _segment_bounds(count: int) -> List[Tuple[int, int]]:
+        """把64位切成count段，返回每段的(起始位, 位数)"""
+        bounds = []
+        start = 0
+        for index in range(count):
+            width = FINGERPRINT_BITS // count + (1 if index < FINGERPRINT_BITS % count else 0)
+            bounds.append((start, width))
+            start += width
+        return bounds
+
+    def _segment_keys(self, fingerprint: int) -> List[int]:
+        return [(fingerprint >> start) & ((1 << width) - 1) for start, width in self._segments]
+
+    def _open_disk(self, path: str):
+        """打开SQLite存储并加载已有条目，失败时只使用内存索引"""
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS document_fingerprints ("
+                " content_hash TEXT PRIMARY KEY,"
+                " fingerprint TEXT NOT NULL,"
+                " title TEXT NOT NULL,"
+                " topics TEXT NOT NULL,"
+                " key_points TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            if self.ttl_seconds is not None:
+                conn.execute(
+                    "DELETE FROM document_fingerprints WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+                )
+            conn.commit()
+            self._conn = conn
+            rows = conn.execute(
+                "SELECT content_hash, fingerprint, title, topics, key_points, created_at"
+                " FROM document_fingerprints ORDER BY created_at DESC LIMIT ?",
+                (self.max_entries,)
+            ).fetchall()
+            for row in reversed(rows):
+                self._insert(IndexedDocument(
+                    row[0], int(row[1], 16), row[2], json.loads(row[3]), json.loads(row[4]), row[5]
+                ))
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f"文档指纹索引打开失败，仅使用内存索引: {e}")
+            self._conn = None
+
+    def _insert(self, entry: IndexedDocument):
+        """加入内存索引，超过上限时淘汰最早的条目"""
+        if entry.content_hash in self._entries:
+            self._remove(entry.content_hash)
+        self._entries[entry.content_hash] = entry
+        for table, key in zip(self._tables, self._segment_keys(entry.fingerprint)):
+            table.setdefault(key, []).append(entry.content_hash)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, digest: str):
+        entry = self._entries.pop(digest, None)
+        if entry is None:
+            return
+        for table, key in zip(self._tables, self._segment_keys(entry.fingerprint)):
+            bucket = table.get(key)
+            if bucket and digest in bucket:
+                bucket.remove(digest)
+                if not bucket:
+                    del table[key]
+
+    def _expired(self, entry: IndexedDocument, now: float) -> bool:
+        return self.ttl_seconds is not None and now - entry.created_at > self.ttl_seconds
+
+    def _delete(self, digest: str):
+        """从内存和磁盘中删除一个条目（调用方持有锁）"""
+        self._remove(digest)
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute("DELETE FROM document_fingerprints WHERE content_hash = ?", (digest,))
+            self._conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"文档指纹删除失败: {e}")
+
+    def remove(self, digest: str):
+        """删除一篇文档的分析结果（例如强制重新分析时使旧结果失效）"""
+        with self._lock:
+            self._delete(digest)
+
+    def lookup(self, signature: Tuple[str, int]) -> Tuple[Optional[IndexedDocument], int]:
+        """
+        查找与文档相同或近似重复的已分析文档
+
+        Args:
+            signature: document_signature()的结果
+
+        Returns:
+            (最接近的文档, 汉明距离)；没有找到时为(None, -1)
+        """
+        digest, fingerprint = signature
+        now = time.time()
+        with self._lock:
+            exact = self._entries.get(digest)
+            if exact is not None and self._expired(exact, now):
+                self._delete(digest)
+                self.stats["expired"] += 1
+                exact = None
+            if exact is not None:
+                self.stats["exact_hits"] += 1
+                return exact, 0
+
+            best, best_distance = None, self.max_distance + 1
+            seen = set()
+            expired = []
+            for table, key in zip(self._tables, self._segment_keys(fingerprint)):
+                for candidate in table.get(key, ()):
+                    if candidate in seen:
+                        continue
+                    seen.add(candidate)
+                    entry = self._entries[candidate]
+                    if self._expired(entry, now):
+                        expired.append(candidate)
+                        continue
+                    distance = hamming_distance(fingerprint, entry.fingerprint)
+                    if distance < best_distance:
+                        best, best_distance = entry, distance
+            for candidate in expired:
+                self._delete(candidate)
+            self.stats["expired"] += len(expired)
+            self.stats["candidates"] += len(seen)
+            if best is None:
+                self.stats["misses"] += 1
+                return None, -1
+            self.stats["near_hits"] += 1
+            return best, best_distance
+
+    def add(self, signature: Tuple[str, int], title: str, topics: List[str], key_points: List[str]):
+        """
+        记录一篇已分析的文档
+
+        Args:
+            signature: document_signature()的结果
+            title: 文档标题
+            topics: 分析得到的主题
+            key_points: 分析得到的知识点
+        """
+        digest, fingerprint = signature
+        entry = IndexedDocument(digest, fingerprint, title, list(topics), list(key_points), time.time())
+        with self._lock:
+            self._insert(entry)
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO document_fingerprints"
+                    " (content_hash, fingerprint, title, topics, key_points, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        entry.content_hash, f"{entry.fingerprint:016x}", title,
+                        json.dumps(entry.topics, ensure_ascii=False),
+                        json.dumps(entry.key_points, ensure_ascii=False), entry.created_at
+                    )
+                )
+                if len(self._entries) >= self.max_entries:
+                    self._conn.execute(
+                        "DELETE FROM document_fingerprints WHERE content_hash NOT IN"
+                        " (SELECT content_hash FROM document_fingerprints ORDER BY created_at DESC LIMIT ?)",
+                        (self.max_entries,)
+                    )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"文档指纹写入失败: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取条目数和命中统计"""
+        with self._lock:
+            return {"entries": len(self._entries), "max_distance": self.max_distance, **self.stats}
+
+
+_document_index: Optional[DocumentFingerprintIndex] = None
+
+
+def get_document_index() -> DocumentFingerprintIndex:
+    """获取全局文档指纹索引"""
+    global _document_index
+    if _document_index is None:
+        settings = get_settings()
+        _document_index = DocumentFingerprintIndex(
+            path=settings.document_index_path or None,
+            max_distance=max_distance_for(settings.document_similarity_threshold),
+            max_entries=settings.document_index_max_entries,
+            ttl_seconds=settings.document_index_ttl_seconds
+        )
+    return _document_index
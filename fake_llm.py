@@ -0,0 +1,308 @@
+"""
+离线假LLM模块 - 根据Prompt内容生成符合结构要求的确定性响应，用于无网络的基准测试和性能分析
+"""
+import re
+import json
+import math
+import random
+import asyncio
+import hashlib
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+try:
+    from langchain_core.messages import AIMessage, AIMessageChunk
+except ImportError:
+    from langchain.schema import AIMessage, AIMessageChunk
+
+
+class FakeLLMError(Exception):
+    """假LLM注入的错误"""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# 注入错误时使用的错误类型：(消息, 状态码)
+FAKE_ERRORS = [
+    ("Error code: 429 - Requests rate limit exceeded", 429),
+    ("Error code: 500 - Internal server error", 500),
+    ("Error code: 503 - Service temporarily unavailable", 503)
+]
+
+
+def detect_prompt_kind(prompt: str) -> str:
+    """根据Prompt内容判断调用类型: analysis / multiple_choice / fill_in_the_blank / matching / chat"""
+    if "提取关键知识点和主题" in prompt:
+        return "analysis"
+    if "生成选择题" in prompt:
+        return "multiple_choice"
+    if "生成填空题" in prompt:
+        return "fill_in_the_blank"
+    if "生成连线题" in prompt:
+        return "matching"
+    return "chat"
+
+
+def _extract_block(prompt: str, header: str) -> List[str]:
+    """提取header之后、下一个空行之前的非空行"""
+    index = prompt.find(header)
+    if index < 0:
+        return []
+    lines = []
+    for line in prompt[index + len(header):].split("\n"):
+        line = line.strip()
+        if not line:
+            if lines:
+                break
+            continue
+        lines.append(line)
+    return lines
+
+
+def _extract_key_points(prompt: str) -> Tuple[str, List[str]]:
+    """从题目生成Prompt中提取主题和知识点"""
+    match = re.search(r"文档主题:\s*(.+)", prompt)
+    topic = match.group(1).strip() if match else "文档主题"
+    points = [line[1:].strip() for line in _extract_block(prompt, "知识点列表:") if line.startswith("-")]
+    return topic, [point for point in points if point] or [topic]
+
+
+def _split_point(point: str, index: int) -> Tuple[str, str]:
+    """把知识点拆成(术语, 描述)，用于构造选项和匹配对"""
+    for separator in ("：", ":", "是", "，"):
+        if separator in point:
+            left, right = point.split(separator, 1)
+            if left.strip() and right.strip():
+                return left.strip()[:20], right.strip()[:40]
+    return f"概念{index + 1}", point[:40]
+
+
+def _unique(items: List[str]) -> List[str]:
+    """为重复项追加序号，保证列表元素唯一"""
+    seen: Dict[str, int] = {}
+    result = []
+    for item in items:
+        count = seen.get(item, 0)
+        seen[item] = count + 1
+        result.append(item if count == 0 else f"{item}（{count + 1}）")
+    return result
+
+
+def build_fake_response(prompt: str, rng: random.Random, explanation_chars: int = 60) -> str:
+    """
+    根据Prompt构造符合结构要求的响应文本
+
+    Args:
+        prompt: 提示词
+        rng: 随机数生成器（由Prompt哈希播种，保证同一Prompt结果一致）
+        explanation_chars: 答案解释的长度，用于控制响应大小
+
+    Returns:
+        响应文本
+    """
+    kind = detect_prompt_kind(prompt)
+    filler = ("这是离线假LLM生成的解释内容。" * (explanation_chars // 14 + 1))[:explanation_chars]
+
+    if kind == "analysis":
+        match = re.search(r"文档标题:\s*(.+)", prompt)
+        title = match.group(1).strip() if match else "文档"
+        content = prompt.split("文档内容:", 1)[-1].split("请按照以下格式输出", 1)[0]
+        sentences = [
+            s.strip(" -*#\t") for s in re.split(r"[。\n]", content)
+            if 8 <= len(s.strip(" -*#\t")) <= 120
+        ]
+        topics = [title] + [s for s in sentences if len(s) <= 16][:3]
+        key_points = sentences[:12] or [f"{title}的核心概念"]
+        return "\n".join(
+            ["## 主要主题"] + [f"- {topic}" for topic in topics]
+            + ["", "## 关键知识点"] + [f"- {point}" for point in key_points]
+            + ["", "## 难度分层", "- 基础层（易）：前三个知识点", "- 应用层（中）：中间知识点", "- 综合层（难）：其余知识点"]
+        )
+
+    if kind == "chat":
+        return "收到收到"
+
+    topic, points = _extract_key_points(prompt)
+    # 多轮出题时按出题角度改写题干，使各轮题目不重复
+    match = re.search(r"出题角度:\s*(.+)", prompt)
+    angle = f"（{match.group(1).strip()}）" if match else ""
+    questions: List[Dict[str, Any]] = []
+
+    if kind == "multiple_choice":
+        for i, point in enumerate(points):
+            term, description = _split_point(point, i)
+            options = [f"{letter}. {text}" for letter, text in zip(
+                "ABCD", [description, f"与{term}无关的说法", f"{term}的反例", "以上都不对"]
+            )]
+            correct = options[0]
+            rng.shuffle(options)
+            options = [f"{'ABCD'[j]}. {option[3:]}" for j, option in enumerate(options)]
+            correct = next(option for option in options if option[3:] == correct[3:])
+            questions.append({
+                "question_id": f"mc_{i + 1:03d}",
+                "question_text": f"关于“{term}”{angle}，以下哪项描述是正确的？",
+                "options": options,
+                "correct_answer": correct,
+                "topic": topic,
+                "difficulty": rng.choice(["easy", "medium"]),
+                "explanation": filler
+            })
+    elif kind == "fill_in_the_blank":
+        for i, point in enumerate(points):
+            term, description = _split_point(point, i)
+            questions.append({
+                "question_id": f"fb_{i + 1:03d}",
+                "question_text": f"{angle}____的含义是：{description}",
+                "blanks": [{"position": 1, "correct_answer": term, "hint": f"与{topic}相关"}],
+                "topic": topic,
+                "difficulty": "medium",
+                "explanation": filler
+            })
+    else:
+        pairs = [_split_point(point, i) for i, point in enumerate(points)]
+        for start in range(0, max(1, len(pairs) - 2), 4):
+            group = pairs[start:start + 4]
+            while len(group) < 3:
+                group.append((f"概念{len(group) + 1}", f"定义{len(group) + 1}"))
+            # 左右两侧的项目必须唯一，重复时追加序号
+            left_items = _unique([f"{left}{angle}" for left, _ in group])
+            right_items = _unique([right for _, right in group])
+            shuffled = right_items[:]
+            rng.shuffle(shuffled)
+            questions.append({
+                "question_id": f"mt_{start // 4 + 1:03d}",
+                "question_text": f"请将下列关于{topic}的概念与其描述进行匹配：",
+                "left_items": left_items,
+                "right_items": shuffled,
+                "correct_pairs": [
+                    {"left_item": left, "right_item": right}
+                    for left, right in zip(left_items, right_items)
+                ],
+                "topic": topic,
+                "difficulty": "hard",
+                "explanation": filler
+            })
+
+    return "```json\n" + json.dumps(questions, ensure_ascii=False, indent=2) + "\n```"
+
+
+def apply_output_limits(content: str, max_tokens: Optional[int] = None, stop: Optional[List[str]] = None) -> Tuple[str, str]:
+    """按stop序列和max_tokens（约1.5个字符一个token）截断响应，返回(内容, 结束原因)"""
+    if isinstance(stop, str):
+        stop = [stop]
+    for sequence in stop or []:
+        index = content.find(sequence)
+        if index >= 0:
+            content = content[:index]
+    if max_tokens and len(content) > int(max_tokens * 1.5):
+        return content[:int(max_tokens * 1.5)], "length"
+    return content, "stop"
+
+
+class FakeChatModel:
+    """
+    进程内确定性假LLM
+
+    响应内容只取决于Prompt和种子；延迟和错误按配置的分布随机注入，
+    接口与LangChain聊天模型的invoke/ainvoke/astream保持一致。
+    """
+
+    def __init__(
+        self,
+        model_name: str = "fake-llm",
+        latency_ms: float = 800.0,
+        latency_jitter_ms: float = 300.0,
+        latency_distribution: str = "lognormal",
+        error_rate: float = 0.0,
+        explanation_chars: int = 60,
+        seed: int = 42,
+        chunk_chars: int = 16
+    ):
+        self.model_name = model_name
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.latency_distribution = latency_distribution
+        self.error_rate = error_rate
+        self.explanation_chars = explanation_chars
+        self.seed = seed
+        self.chunk_chars = max(1, chunk_chars)
+        self._rng = random.Random(seed)
+        self.calls = 0
+
+    def _content_rng(self, prompt: str) -> random.Random:
+        digest = hashlib.sha256(f"{self.seed}:{prompt}".encode("utf-8")).hexdigest()
+        return random.Random(int(digest[:16], 16))
+
+    def sample_latency(self) -> float:
+        """按配置的分布采样一次延迟（秒）"""
+        mean = max(0.0, self.latency_ms)
+        jitter = max(0.0, self.latency_jitter_ms)
+        distribution = self.latency_distribution
+        if mean == 0 and jitter == 0:
+            return 0.0
+        if distribution == "constant" or jitter == 0:
+            value = mean
+        elif distribution == "uniform":
+            value = self._rng.uniform(mean - jitter, mean + jitter)
+        elif distribution == "normal":
+            value = self._rng.gauss(mean, jitter)
+        else:
+            # 对数正态分布：均值为mean，标准差约为jitter，长尾更接近真实服务
+            sigma2 = math.log1p((jitter / mean) ** 2) if mean > 0 else 1.0
+            mu = (math.log(mean) if mean > 0 else 0.0) - sigma2 / 2
+            value = self._rng.lognormvariate(mu, sigma2 ** 0.5)
+        return max(0.0, value) / 1000.0
+
+    def _maybe_fail(self):
+        if self.error_rate > 0 and self._rng.random() < self.error_rate:
+            message, status_code = self._rng.choice(FAKE_ERRORS)
+            raise FakeLLMError(message, status_code)
+
+    def _message(self, prompt: str, content: str, finish_reason: str = "stop") -> AIMessage:
+        prompt_tokens = max(1, int(len(prompt) / 1.5))
+        completion_tokens = max(1, int(len(content) / 1.5))
+        return AIMessage(
+            content=content,
+            response_metadata={"model_name": self.model_name, "finish_reason": finish_reason},
+            usage_metadata={
+                "input_tokens": prompt_tokens,
+                "output_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        )
+
+    def invoke(self, prompt: str, **kwargs) -> AIMessage:
+        """同步调用"""
+        self.calls += 1
+        latency = self.sample_latency()
+        self._maybe_fail()
+        time.sleep(latency)
+        content = build_fake_response(prompt, self._content_rng(prompt), self.explanation_chars)
+        return self._message(prompt, *apply_output_limits(content, kwargs.get("max_tokens"), kwargs.get("stop")))
+
+    async def ainvoke(self, prompt: str, **kwargs) -> AIMessage:
+        """异步调用"""
+        self.calls += 1
+        latency = self.sample_latency()
+        self._maybe_fail()
+        await asyncio.sleep(latency)
+        content = build_fake_response(prompt, self._content_rng(prompt), self.explanation_chars)
+        return self._message(prompt, *apply_output_limits(content, kwargs.get("max_tokens"), kwargs.get("stop")))
+
+    async def astream(self, prompt: str, **kwargs):
+        """流式调用：首个片段在20%延迟后到达，其余片段均匀分布在剩余时间内"""
+        self.calls += 1
+        latency = self.sample_latency()
+        self._maybe_fail()
+        content = build_fake_response(prompt, self._content_rng(prompt), self.explanation_chars)
+        content, _ = apply_output_limits(content, kwargs.get("max_tokens"), kwargs.get("stop"))
+        chunks = [content[i:i + self.chunk_chars] for i in range(0, len(content), self.chunk_chars)]
+        await asyncio.sleep(latency * 0.2)
+        step = latency * 0.8 / max(1, len(chunks))
+        for chunk in chunks:
+            yield AIMessageChunk(content=chunk)
+            if step:
+                await asyncio.sleep(step)
+
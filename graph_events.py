@@ -0,0 +1,105 @@
+"""
+工作流事件模块 - 流式运行时每个节点完成后产生的事件
+"""
+from typing import Dict, Any, List, Optional, Tuple
+
+from schemas import GraphState
+
+# 事件类型
+DOCUMENT_PROCESSED = "document_processed"  # 文档处理完成，data: title、content_length
+ANALYSIS_READY = "analysis_ready"  # 文档分析完成，data: topics、key_points、reused_from
+QUESTIONS_READY = "questions_ready"  # 一个题型生成完成，data: question_type、questions
+GENERATION_FAILED = "generation_failed"  # 一个题型生成失败，data: question_type、error
+OUTPUT_READY = "output_ready"  # 输出格式化完成，data: output（与保存到文件的JSON相同）
+ERROR = "error"  # 工作流失败，data: error
+FINISHED = "finished"  # 运行结束（最后一个事件），state为最终状态
+
+# 题目生成节点 -> 题型字段
+GENERATOR_NODES = {
+    "generate_multiple_choice": "multiple_choice",
+    "generate_fill_blank": "fill_in_the_blank",
+    "generate_matching": "matching"
+}
+
+
+class GraphEvent:
+    """工作流事件"""
+
+    def __init__(
+        self,
+        type: str,
+        node: Optional[str] = None,
+        data: Optional[Dict[str, Any]] = None,
+        run_id: Optional[str] = None,
+        elapsed: float = 0.0,
+        state: Optional[GraphState] = None
+    ):
+        self.type = type
+        self.node = node  # 产生事件的节点，finished事件为None
+        self.data = data or {}
+        self.run_id = run_id
+        self.elapsed = elapsed  # 距运行开始的秒数
+        self.state = state  # 只有finished事件带有最终状态
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为可JSON序列化的字典（题目转换为字典，不含最终状态）"""
+        data = dict(self.data)
+        if "questions" in data:
+            data["questions"] = [question.dict() for question in data["questions"]]
+        return {
+            "type": self.type,
+            "node": self.node,
+            "run_id": self.run_id,
+            "elapsed": round(self.elapsed, 3),
+            "data": data
+        }
+
+    def __repr__(self) -> str:
+        return f"GraphEvent(type={self.type!r}, node={self.node!r}, elapsed={self.elapsed:.3f})"
+
+
+def events_from_update(node: str, update: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    把一个节点的状态更新转换为事件（不含run_id和耗时）
+
+    Args:
+        node: 节点名称
+        update: 节点写入的状态字段
+
+    Returns:
+        (事件类型, 数据)列表
+    """
+    if not isinstance(update, dict):
+        return []
+    if update.get("current_step") == "error":
+        return [(ERROR, {"error": update.get("error_message") or "未知错误"})]
+
+    if node in GENERATOR_NODES:
+        question_type = GENERATOR_NODES[node]
+        events = []
+        for error in (update.get("generation_errors") or {}).values():
+            if error is not None:
+                events.append((GENERATION_FAILED, {"question_type": question_type, "error": error}))
+        question_set = update.get("question_set")
+        questions = getattr(question_set, question_type, None) if question_set else None
+        if questions:
+            events.append((QUESTIONS_READY, {"question_type": question_type, "questions": list(questions)}))
+        return events
+
+    document = update.get("document")
+    if node == "document_processor":
+        return [(DOCUMENT_PROCESSED, {
+            "title": document.title if document else None,
+            "content_length": len(document.content) if document else 0
+        })]
+    if node == "document_analyzer":
+        return [(ANALYSIS_READY, {
+            "topics": list(update.get("topics") or []),
+            "key_points": list(update.get("key_points") or []),
+            "reused_from": update.get("analysis_reused_from")
+        })]
+    if node == "format_output":
+        output = (document.metadata or {}).get("formatted_output") if document else None
+        return [(OUTPUT_READY, {"output": output})]
+    # error_handler只记录日志，错误事件已由失败的节点产生
+    return []
@@ -0,0 +1,102 @@
+"""
+请求对冲模块 - 慢请求超过近期延迟分位数后发出副本请求，先返回者胜出
+"""
+import math
+import threading
+from collections import deque
+from typing import Dict, Any, Optional
+
+
+class RequestHedger:
+    """
+    按调用阶段维护延迟分布和对冲预算
+
+    每个阶段的对冲触发时间为该阶段近期成功调用延迟的指定分位数（不低于min_delay），
+    对冲次数不超过该阶段调用次数的max_ratio，避免故障期间请求量翻倍。
+    """
+
+    def __init__(
+        self,
+        percentiles: Dict[str, float],
+        default_percentile: float = 0.95,
+        stage_groups: Optional[Dict[str, str]] = None,
+        min_delay: float = 1.0,
+        max_ratio: float = 0.1,
+        window_size: int = 100,
+        min_samples: int = 10
+    ):
+        self.percentiles = dict(percentiles or {})
+        self.default_percentile = default_percentile
+        self.stage_groups = dict(stage_groups or {})
+        self.min_delay = min_delay
+        self.max_ratio = max_ratio
+        self.window_size = max(1, window_size)
+        self.min_samples = max(1, min_samples)
+
+        self._latencies: Dict[str, deque] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _stage_stats(self, stage: str) -> Dict[str, int]:
+        if stage not in self._stats:
+            self._stats[stage] = {"calls": 0, "fired": 0, "won": 0}
+        return self._stats[stage]
+
+    def percentile_for(self, stage: str) -> float:
+        """获取阶段的对冲分位数，依次查找阶段名、阶段分组和默认值"""
+        if stage in self.percentiles:
+            return self.percentiles[stage]
+        group = self.stage_groups.get(stage)
+        if group and group in self.percentiles:
+            return self.percentiles[group]
+        return self.default_percentile
+
+    def record_latency(self, stage: str, latency: float):
+        """记录一次成功调用的延迟"""
+        with self._lock:
+            window = self._latencies.get(stage)
+            if window is None:
+                window = self._latencies[stage] = deque(maxlen=self.window_size)
+            window.append(latency)
+
+    def hedge_delay(self, stage: str) -> Optional[float]:
+        """
+        计算本次调用的对冲等待时间并计入调用次数
+
+        样本不足或对冲预算已用完时返回None，表示不对冲。
+        """
+        with self._lock:
+            stats = self._stage_stats(stage)
+            stats["calls"] += 1
+            window = self._latencies.get(stage)
+            if not window or len(window) < self.min_samples:
+                return None
+            if stats["fired"] + 1 > stats["calls"] * self.max_ratio:
+                return None
+            ordered = sorted(window)
+            index = min(len(ordered) - 1, max(0, math.ceil(self.percentile_for(stage) * len(ordered)) - 1))
+            return max(self.min_delay, ordered[index])
+
+    def record_fired(self, stage: str):
+        """记录一次对冲请求发出"""
+        with self._lock:
+            self._stage_stats(stage)["fired"] += 1
+
+    def record_won(self, stage: str):
+        """记录一次对冲请求先于原请求返回"""
+        with self._lock:
+            self._stage_stats(stage)["won"] += 1
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """获取各阶段的对冲统计"""
+        with self._lock:
+            result = {}
+            for stage, stats in self._stats.items():
+                calls = stats["calls"]
+                result[stage] = {
+                    **stats,
+                    "fire_rate": stats["fired"] / calls if calls else 0.0,
+                    "win_rate": stats["won"] / stats["fired"] if stats["fired"] else 0.0,
+                    "percentile": self.percentile_for(stage)
+                }
+            return result
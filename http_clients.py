@@ -0,0 +1,127 @@
+"""
+共享HTTP连接池模块 - 所有LLM实例复用同一组显式配置的同步/异步httpx客户端
+"""
+import logging
+import threading
+from typing import Dict, Any
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class SharedHTTPClients:
+    """
+    LLMService持有的共享HTTP连接池
+
+    连接上限、keep-alive和超时统一配置，避免每个LLM实例各自建池、
+    高并发时重复TLS握手或耗尽本地端口。
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 120.0,
+        http2: bool = False
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(
+            connect=connect_timeout,
+            read=read_timeout,
+            write=read_timeout,
+            pool=read_timeout
+        )
+        self.http2 = http2 and self._http2_available()
+
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"requests": 0, "responses": 0, "errors": 0}
+        self.status_counts: Dict[str, int] = {}
+
+        self.sync_client = httpx.Client(
+            limits=self.limits,
+            timeout=self.timeout,
+            http2=self.http2,
+            event_hooks={"request": [self._on_request], "response": [self._on_response]}
+        )
+        self.async_client = httpx.AsyncClient(
+            limits=self.limits,
+            timeout=self.timeout,
+            http2=self.http2,
+            event_hooks={"request": [self._on_async_request], "response": [self._on_async_response]}
+        )
+
+    @staticmethod
+    def _http2_available() -> bool:
+        """HTTP/2需要安装h2包，缺失时退回HTTP/1.1"""
+        try:
+            import h2  # noqa: F401
+            return True
+        except ImportError:
+            print("⚠️  未安装h2，HTTP/2不可用，使用HTTP/1.1连接池")
+            return False
+
+    def _on_request(self, request: httpx.Request):
+        with self._lock:
+            self.stats["requests"] += 1
+
+    def _on_response(self, response: httpx.Response):
+        status_class = f"{response.status_code // 100}xx"
+        with self._lock:
+            self.stats["responses"] += 1
+            self.status_counts[status_class] = self.status_counts.get(status_class, 0) + 1
+            if response.status_code >= 400:
+                self.stats["errors"] += 1
+
+    async def _on_async_request(self, request: httpx.Request):
+        self._on_request(request)
+
+    async def _on_async_response(self, response: httpx.Response):
+        self._on_response(response)
+
+    @staticmethod
+    def _pool_snapshot(client) -> Dict[str, Any]:
+        """读取httpcore连接池中的连接状态"""
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", []) or [])
+        idle = sum(1 for connection in connections if getattr(connection, "is_idle", lambda: False)())
+        http2 = sum(1 for connection in connections if "HTTP/2" in repr(connection))
+        return {
+            "connections": len(connections),
+            "idle": idle,
+            "active": len(connections) - idle,
+            "http2_connections": http2
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取连接池配置和使用统计"""
+        with self._lock:
+            counters = dict(self.stats)
+            status_counts = dict(self.status_counts)
+        return {
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            "connect_timeout": self.timeout.connect,
+            "read_timeout": self.timeout.read,
+            "http2": self.http2,
+            "status_counts": status_counts,
+            "sync_pool": self._pool_snapshot(self.sync_client),
+            "async_pool": self._pool_snapshot(self.async_client),
+            **counters
+        }
+
+    def close(self):
+        """关闭同步连接池"""
+        self.sync_client.close()
+
+    async def aclose(self):
+        """关闭全部连接池"""
+        self.sync_client.close()
+        await self.async_client.aclose()
@@ -0,0 +1,326 @@
+"""
+JSON解析工具 - 从LLM输出中容错提取JSON值，以及从流式输出中增量解析JSON数组
+"""
+import json
+import logging
+from typing import List, Dict, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalJSONArrayParser:
+    """
+    增量JSON数组解析器
+
+    逐块喂入LLM输出文本，顶层数组中的每个对象一闭合就立即解析返回，
+    不必等待整个响应结束。数组之前的说明文字和```json围栏会被跳过；
+    如果输出的顶层是单个对象，则在它闭合时作为唯一元素返回。
+    """
+
+    def __init__(self):
+        self._buffer: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self._root = ""
+        self._element_start = -1
+        self._position = 0
+        self.closed = False
+        self.errors = 0
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """
+        喂入一段文本
+
+        Args:
+            chunk: 新到达的文本片段
+
+        Returns:
+            本次新闭合的对象列表
+        """
+        completed = []
+        if self.closed or not chunk:
+            return completed
+
+        self._buffer.append(chunk)
+        for char in chunk:
+            index = self._position
+            self._position += 1
+
+            if not self._started:
+                if char in "[{":
+                    self._started = True
+                    self._root = char
+                    self._depth = 1
+                    if char == "{":
+                        self._element_start = index
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "[{":
+                self._depth += 1
+                if char == "{" and self._depth == 2 and self._root == "[":
+                    self._element_start = index
+            elif char in "]}":
+                self._depth -= 1
+                element_closed = (
+                    (self._root == "[" and self._depth == 1 and char == "}")
+                    or (self._root == "{" and self._depth == 0)
+                )
+                if element_closed and self._element_start >= 0:
+                    element = self._parse_element(self._element_start, index + 1)
+                    if element is not None:
+                        completed.append(element)
+                    self._element_start = -1
+                if self._depth == 0:
+                    self.closed = True
+                    break
+
+        return completed
+
+    def _parse_element(self, start: int, end: int):
+        text = "".join(self._buffer)
+        # 合并已读取的片段，避免缓冲区列表无限增长
+        self._buffer = [text]
+        try:
+            return json.loads(text[start:end])
+        except json.JSONDecodeError as e:
+            self.errors += 1
+            logger.error(f"流式JSON元素解析失败: {e}")
+            return None
+
+    @property
+    def text(self) -> str:
+        """已喂入的全部文本"""
+        return "".join(self._buffer)
+
+
+# 字符串之外出现时视为引号的中文弯引号
+SMART_QUOTES = "“”"
+# 字符串内需要转义的控制字符
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+
+class JSONExtraction:
+    """
+    从LLM输出中提取出的JSON值
+
+    Attributes:
+        values: 按出现顺序排列的顶层JSON值
+        repaired: 是否对原文做过修复（尾逗号、弯引号、未闭合等）
+        dropped: 因无法解析而丢弃的数组元素数
+    """
+
+    def __init__(self):
+        self.values: List[Any] = []
+        self.repaired = False
+        self.dropped = 0
+
+    def merged(self) -> Any:
+        """
+        合并所有提取到的值
+
+        只有一个值时原样返回；有多个值（例如多个代码块）时，
+        把其中的对象和对象数组合并成一个列表。
+        """
+        if len(self.values) == 1:
+            return self.values[0]
+        candidates = [
+            value for value in self.values
+            if isinstance(value, dict) or (isinstance(value, list) and any(isinstance(item, dict) for item in value))
+        ] or self.values
+        merged: List[Any] = []
+        for value in candidates:
+            if isinstance(value, list):
+                merged.extend(value)
+            else:
+                merged.append(value)
+        return merged
+
+
+def _closes_string(text: str, index: int) -> bool:
+    """引号之后（忽略空白）是结构字符或文本结尾时，才把它当作字符串的结束"""
+    length = len(text)
+    while index < length and text[index] in " \t\r\n":
+        index += 1
+    return index >= length or text[index] in ",:}]"
+
+
+def _strip_trailing_comma(out: List[str]):
+    """删除输出末尾（忽略空白）的逗号"""
+    index = len(out) - 1
+    while index >= 0 and out[index] in " \t\r\n":
+        index -= 1
+    if index >= 0 and out[index] == ",":
+        del out[index]
+
+
+def _repair_value(text: str, start: int) -> Tuple[str, int, List[Tuple[int, int]], bool]:
+    """
+    从start处的'['或'{'开始单遍扫描一个JSON值并修复常见缺陷
+
+    修复内容：尾逗号、字符串外的中文弯引号、字符串中未转义的引号和裸换行、
+    输出被截断（丢弃最后一个不完整的元素并补齐括号）。遇到字符串外的```视为截断。
+
+    Returns:
+        (修复后的文本, 原文中的结束位置, 顶层数组各元素在修复后文本中的区间, 是否被截断)
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    elements: List[Tuple[int, int]] = []
+    element_start = -1
+    in_string = False
+    smart_string = False
+    escape = False
+    last_complete = -1  # 顶层数组中最后一个完整元素结束后的输出位置
+    index = start
+    length = len(text)
+
+    while index < length:
+        char = text[index]
+        index += 1
+
+        if in_string:
+            if escape:
+                out.append(char)
+                escape = False
+            elif char == "\\":
+                out.append(char)
+                escape = True
+            elif (char == '"' or (smart_string and char == "”")) and _closes_string(text, index):
+                out.append('"')
+                in_string = False
+            elif char == '"':
+                # 字符串内未转义的引号
+                out.append('\\"')
+            elif char in _CONTROL_ESCAPES:
+                out.append(_CONTROL_ESCAPES[char])
+            else:
+                out.append(char)
+            continue
+
+        if char == '"' or char in SMART_QUOTES:
+            in_string = True
+            smart_string = char != '"'
+            out.append('"')
+        elif char in "[{":
+            if len(stack) == 1 and stack[0] == "[" and element_start < 0:
+                element_start = len(out)
+            stack.append(char)
+            out.append(char)
+        elif char in "]}":
+            _strip_trailing_comma(out)
+            opener = stack.pop()
+            out.append("]" if opener == "[" else "}")
+            if not stack:
+                break
+            if len(stack) == 1 and stack[0] == "[":
+                elements.append((element_start, len(out)))
+                element_start = -1
+                last_complete = len(out)
+        elif char == ",":
+            if len(stack) == 1 and stack[0] == "[":
+                if element_start >= 0:
+                    # 标量元素
+                    elements.append((element_start, len(out)))
+                    last_complete = len(out)
+                element_start = -1
+            out.append(char)
+        elif char == "`" and text.startswith("```", index - 1):
+            # 代码块在值闭合之前结束，说明输出被截断
+            index -= 1
+            break
+        else:
+            if len(stack) == 1 and stack[0] == "[" and element_start < 0 and not char.isspace():
+                element_start = len(out)
+            out.append(char)
+
+    truncated = bool(stack)
+    if truncated:
+        if stack[0] == "[" and last_complete >= 0:
+            # 顶层数组：保留所有完整元素
+            del out[last_complete:]
+            stack = ["["]
+        elif in_string:
+            out.append('"')
+        _strip_trailing_comma(out)
+        while out and out[-1] in " \t\r\n:":
+            out.pop()
+        _strip_trailing_comma(out)
+        out.extend("]" if opener == "[" else "}" for opener in reversed(stack))
+    return "".join(out), index, elements, truncated
+
+
+def extract_json(text: str) -> JSONExtraction:
+    """
+    单遍扫描LLM输出，提取其中所有平衡的JSON对象和数组
+
+    合法的值直接用json的C解码器读取；解码失败的值经过修复后再解析，
+    修复后仍失败的顶层数组逐个元素解析，保留所有完好的元素。
+    说明文字、```代码块标记和多个代码块都会被正确跳过。
+
+    Args:
+        text: LLM输出文本
+
+    Returns:
+        提取结果
+    """
+    decoder = json.JSONDecoder()
+    result = JSONExtraction()
+    index = 0
+    length = len(text)
+
+    while index < length:
+        bracket = text.find("[", index)
+        brace = text.find("{", index)
+        if bracket < 0 and brace < 0:
+            break
+        start = min(position for position in (bracket, brace) if position >= 0)
+
+        # 快速路径：合法JSON直接解码
+        try:
+            value, end = decoder.raw_decode(text, start)
+            result.values.append(value)
+            index = end
+            continue
+        except json.JSONDecodeError:
+            pass
+
+        repaired, end, elements, truncated = _repair_value(text, start)
+        try:
+            result.values.append(json.loads(repaired))
+            result.repaired = True
+            index = end
+            continue
+        except json.JSONDecodeError:
+            pass
+
+        salvaged = []
+        for element_start, element_end in elements:
+            try:
+                salvaged.append(json.loads(repaired[element_start:element_end]))
+            except json.JSONDecodeError:
+                result.dropped += 1
+        if salvaged:
+            result.values.append(salvaged)
+            result.repaired = True
+            index = end
+        elif not truncated:
+            # 括号平衡但不是JSON（例如说明文字中的方括号），整体跳过，不再从内部提取嵌套值
+            index = end
+        else:
+            # 未闭合的括号可能只是说明文字，从下一个字符继续查找
+            index = start + 1
+
+    return result
@@ -0,0 +1,214 @@
+"""
+LLM响应缓存模块 - 内存LRU + SQLite磁盘两级缓存
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class LLMResponseCache:
+    """
+    按内容寻址的LLM响应缓存
+
+    键为(提供商, 模型, temperature, max_tokens, prompt)的哈希值。
+    内存层是一个有上限的LRU，磁盘层为SQLite，两层都按条目数和存活时间淘汰。
+    """
+
+    def __init__(
+        self,
+        path: Optional[str],
+        memory_entries: int = 256,
+        max_entries: int = 10000,
+        ttl_seconds: Optional[float] = None
+    ):
+        self.path = path
+        self.memory_entries = max(0, memory_entries)
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds if ttl_seconds and ttl_seconds > 0 else None
+
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._disk_count = 0
+
+        self.stats: Dict[str, int] = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "evictions": 0
+        }
+
+        if path:
+            self._open_disk(path)
+
+    def _open_disk(self, path: str):
+        """打开SQLite磁盘缓存，失败时只使用内存缓存"""
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY,"
+                " response TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache(last_access)")
+            conn.commit()
+            self._conn = conn
+            self._disk_count = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            self._prune_disk()
+        except sqlite3.Error as e:
+            logger.error(f"磁盘缓存打开失败，仅使用内存缓存: {e}")
+            self._conn = None
+
+    @staticmethod
+    def make_key(provider: str, model: str, temperature: float, max_tokens: int, prompt: str) -> str:
+        """根据请求参数计算缓存键"""
+        payload = json.dumps(
+            [provider, model, temperature, max_tokens, prompt],
+            ensure_ascii=False,
+            separators=(",", ":")
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，未命中或已过期时返回None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                response, created_at = entry
+                if not self._expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return response
+                del self._memory[key]
+                self.stats["evictions"] += 1
+
+            if self._conn is not None:
+                try:
+                    row = self._conn.execute(
+                        "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None:
+                        response, created_at = row
+                        if not self._expired(created_at, now):
+                            self._conn.execute(
+                                "UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key)
+                            )
+                            self._conn.commit()
+                            self._remember(key, response, created_at)
+                            self.stats["disk_hits"] += 1
+                            return response
+                        self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                        self._conn.commit()
+                        self._disk_count -= 1
+                        self.stats["evictions"] += 1
+                except sqlite3.Error as e:
+                    logger.error(f"读取磁盘缓存失败: {e}")
+
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, key: str, response: str):
+        """写入缓存"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, response, now)
+            self.stats["writes"] += 1
+
+            if self._conn is not None:
+                try:
+                    # 覆盖已有条目（强制刷新）时条目数不变
+                    exists = self._conn.execute(
+                        "SELECT 1 FROM llm_cache WHERE key = ?", (key,)
+                    ).fetchone() is not None
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO llm_cache (key, response, created_at, last_access) "
+                        "VALUES (?, ?, ?, ?)",
+                        (key, response, now, now)
+                    )
+                    self._conn.commit()
+                    if not exists:
+                        self._disk_count += 1
+                    # 超出上限10%后再批量淘汰，避免每次写入都做排序删除
+                    if self._disk_count > self.max_entries * 1.1:
+                        self._prune_disk()
+                except sqlite3.Error as e:
+                    logger.error(f"写入磁盘缓存失败: {e}")
+
+    def _remember(self, key: str, response: str, created_at: float):
+        """写入内存LRU层"""
+        if self.memory_entries == 0:
+            return
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _prune_disk(self):
+        """按存活时间和条目数淘汰磁盘缓存"""
+        if self._conn is None:
+            return
+        removed = 0
+        if self.ttl_seconds is not None:
+            removed += self._conn.execute(
+                "DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+        count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        if count > self.max_entries:
+            removed += self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                " SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)",
+                (count - self.max_entries,)
+            ).rowcount
+        self._conn.commit()
+        self._disk_count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        self.stats["evictions"] += removed
+
+    def clear(self):
+        """清空所有缓存"""
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM llm_cache")
+                self._conn.commit()
+                self._disk_count = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._lock:
+            hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+            lookups = hits + self.stats["misses"]
+            return {
+                **self.stats,
+                "hits": hits,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_size": len(self._memory),
+                "disk_size": self._disk_count
+            }
+
+    def close(self):
+        """关闭磁盘连接"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
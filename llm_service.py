@@ -4,9 +4,15 @@ LLM服务模块 - 封装通义千问和OpenAI的调用
 import os
 import sys
 import json
+import time
+import asyncio
+import threading
+import contextlib
+import functools
 import logging
 import warnings
-from typing import Optional, Dict, Any, List
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator, Iterator
 
 try:
     from langchain_core.language_models import BaseLanguageModel
@@ -17,6 +23,24 @@ except ImportError:
         from langchain.schema.language_model import BaseLanguageModel
 
 from config import get_settings
+from llm_cache import LLMResponseCache
+from circuit_breaker import CircuitBreaker, CircuitState
+from hedging import RequestHedger
+from rate_limiter import ProviderRateLimiter, AdaptiveConcurrencyLimiter
+from fake_llm import FakeChatModel
+from cassette import Cassette, CassetteChatModel
+from json_utils import extract_json
+from http_clients import SharedHTTPClients
+from usage_tracking import LLMCallRecord, record_llm_call, estimate_cost
+from tracing import trace_span, record_span, annotate
+from output_budget import OutputBudget, OutputRequest
+from single_flight import SingleFlight
+from routing import WeightedRouter
+from stage_profiles import StageProfiles
+from retry_policy import (
+    RetryPolicy, ErrorKind, DeadlineExceededError, classify_error, is_overload_error,
+    is_provider_fatal, remaining_seconds
+)
 
 # 取消warning显示
 warnings.filterwarnings("ignore")
@@ -25,6 +49,52 @@ warnings.filterwarnings("ignore")
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.ERROR)
 
+# 调用阶段到阶段分组的映射，分组用于共享对冲等配置
+STAGE_GROUPS = {
+    "analysis": "analysis",
+    "multiple_choice": "generation",
+    "fill_in_the_blank": "generation",
+    "matching": "generation"
+}
+
+# 当前调用的阶段和尝试序号，用于用量记录；对冲和超时控制创建的子任务会继承
+_call_stage: ContextVar[str] = ContextVar("llm_call_stage", default="default")
+_call_attempt: ContextVar[int] = ContextVar("llm_call_attempt", default=1)
+# 当前调用的输出约束（max_tokens、stop序列和预计输出单位数）
+_call_output: ContextVar[Optional[OutputRequest]] = ContextVar("llm_call_output", default=None)
+
+
+class LLMProvider:
+    """LLM提供商 - 实例、模型名称、熔断器、限流器和结构化输出方式"""
+    
+    def __init__(
+        self,
+        name: str,
+        label: str,
+        model: str,
+        llm: BaseLanguageModel,
+        breaker: CircuitBreaker,
+        limiter: Optional[ProviderRateLimiter] = None,
+        structured_mode: Optional[str] = None,
+        weight: float = 1.0,
+        kind: Optional[str] = None
+    ):
+        self.name = name
+        self.label = label
+        self.model = model
+        self.llm = llm
+        self.breaker = breaker
+        self.limiter = limiter
+        # 结构化输出方式: tool（函数调用）、json_mode（JSON对象响应格式）或None（文本）
+        self.structured_mode = structured_mode
+        self.weight = weight  # 加权路由时的配置权重
+        self.kind = kind or name  # 提供商类型（dashscope、openai、fake），决定分阶段模型配置中使用哪个模型
+    
+    @property
+    def healthy(self) -> bool:
+        """熔断器未打开即视为健康"""
+        return self.breaker.state != CircuitState.OPEN
+
 
 class LLMService:
     """LLM服务类，支持通义千问和OpenAI"""
@@ -33,40 +103,331 @@ class LLMService:
         self.settings = get_settings()
         self._primary_llm = None
         self._backup_llm = None
+        self._providers: List[LLMProvider] = []
+        self._cache = self._create_cache()
+        self._hedger = self._create_hedger()
+        self._http = self._create_http_clients()
+        self._retry_policy = RetryPolicy(
+            max_attempts=self.settings.llm_retry_max_attempts,
+            base_delay=self.settings.llm_retry_base_delay,
+            max_delay=self.settings.llm_retry_max_delay,
+            max_retry_after=self.settings.llm_retry_max_retry_after
+        )
+        self._output_budget = self._create_output_budget()
+        self._stage_profiles = StageProfiles(self.settings.llm_stage_settings, STAGE_GROUPS)
+        self._single_flight = SingleFlight() if self.settings.llm_single_flight_enabled else None
+        self._router: Optional[WeightedRouter] = None
+        self._health_probe_thread: Optional[threading.Thread] = None
+        self._cassette_mode = (self.settings.llm_cassette_mode or "off").lower()
+        self._cassette = self._create_cassette()
         self._initialize_llms()
     
+    def _create_cache(self) -> Optional[LLMResponseCache]:
+        """根据配置创建LLM响应缓存"""
+        if not self.settings.llm_cache_enabled:
+            return None
+        return LLMResponseCache(
+            path=self.settings.llm_cache_path or None,
+            memory_entries=self.settings.llm_cache_memory_entries,
+            max_entries=self.settings.llm_cache_max_entries,
+            ttl_seconds=self.settings.llm_cache_ttl_seconds
+        )
+    
+    def _create_cassette(self) -> Optional[Cassette]:
+        """按配置打开录制文件，回放模式下读取已有记录"""
+        if self._cassette_mode not in ("record", "replay"):
+            return None
+        cassette = Cassette(self.settings.llm_cassette_path)
+        if self._cassette_mode == "replay":
+            count = cassette.load()
+            print(f"📼 回放录制文件 {cassette.path}（{count} 条记录）")
+        else:
+            print(f"📼 录制LLM请求到 {cassette.path}")
+        return cassette
+    
+    def _create_hedger(self) -> Optional[RequestHedger]:
+        """根据配置创建请求对冲器"""
+        if not self.settings.llm_hedge_enabled:
+            return None
+        return RequestHedger(
+            percentiles=self.settings.llm_hedge_percentiles,
+            stage_groups=STAGE_GROUPS,
+            min_delay=self.settings.llm_hedge_min_delay,
+            max_ratio=self.settings.llm_hedge_max_ratio,
+            min_samples=self.settings.llm_hedge_min_samples
+        )
+    
+    def _create_output_budget(self) -> Optional[OutputBudget]:
+        """根据配置创建按阶段自适应的输出token预算"""
+        if not self.settings.llm_adaptive_max_tokens:
+            return None
+        return OutputBudget(
+            max_tokens=self.settings.max_tokens,
+            min_tokens=self.settings.llm_output_budget_min_tokens,
+            headroom=self.settings.llm_output_budget_headroom,
+            quantum=self.settings.llm_output_budget_quantum
+        )
+    
+    def _create_http_clients(self) -> Optional[SharedHTTPClients]:
+        """创建所有LLM实例共享的HTTP连接池，离线假LLM不需要"""
+        if (self.settings.llm_backend or "auto").lower() == "fake":
+            return None
+        return SharedHTTPClients(
+            max_connections=self.settings.http_max_connections,
+            max_keepalive_connections=self.settings.http_max_keepalive_connections,
+            keepalive_expiry=self.settings.http_keepalive_expiry,
+            connect_timeout=self.settings.http_connect_timeout,
+            read_timeout=self.settings.http_read_timeout,
+            http2=self.settings.http_http2
+        )
+    
+    def _create_breaker(self, name: str) -> CircuitBreaker:
+        """根据配置为提供商创建熔断器"""
+        return CircuitBreaker(
+            name=name,
+            failure_rate_threshold=self.settings.circuit_failure_rate_threshold,
+            slow_call_seconds=self.settings.circuit_slow_call_seconds,
+            slow_call_rate_threshold=self.settings.circuit_slow_call_rate_threshold,
+            window_size=self.settings.circuit_window_size,
+            min_calls=self.settings.circuit_min_calls,
+            consecutive_failures=self.settings.llm_unhealthy_after_failures,
+            open_seconds=self.settings.circuit_open_seconds,
+            half_open_max_calls=self.settings.circuit_half_open_max_calls
+        )
+    
+    def _create_limiter(
+        self,
+        name: str,
+        limits: Optional[Dict[str, float]] = None,
+        max_concurrency: Optional[int] = None
+    ) -> Optional[ProviderRateLimiter]:
+        """
+        根据配置为提供商创建限流器
+        
+        Args:
+            name: 提供商名称，未给出limits时按名称读取llm_rate_limits
+            limits: {"qps", "tpm"}
+            max_concurrency: 该提供商的并发上限，默认使用llm_concurrency_max
+        """
+        if not self.settings.llm_rate_limit_enabled:
+            return None
+        if limits is None:
+            limits = self.settings.llm_rate_limits.get(name, {})
+        maximum = max_concurrency or self.settings.llm_concurrency_max
+        return ProviderRateLimiter(
+            name=name,
+            qps=limits.get("qps", 0),
+            tpm=limits.get("tpm", 0),
+            concurrency=AdaptiveConcurrencyLimiter(
+                initial=min(self.settings.llm_concurrency_initial, maximum),
+                minimum=self.settings.llm_concurrency_min,
+                maximum=maximum,
+                latency_tolerance=self.settings.llm_concurrency_latency_tolerance
+            )
+        )
+    
+    def _create_router(self) -> Optional[WeightedRouter]:
+        """按配置创建加权路由器并登记所有提供商"""
+        if (self.settings.llm_routing or "priority").lower() != "weighted" or len(self._providers) < 2:
+            return None
+        router = WeightedRouter(alpha=self.settings.llm_routing_ewma_alpha)
+        for provider in self._providers:
+            router.register(provider.name, provider.weight)
+        return router
+    
     def _initialize_llms(self):
-        """初始化LLM实例"""
+        """初始化LLM实例，主备提供商都在启动时创建，备选提供商处于热备状态"""
+        if self._cassette_mode == "replay":
+            self._initialize_replay_llm()
+            return
+        
+        if (self.settings.llm_backend or "auto").lower() == "fake":
+            self._initialize_fake_llm()
+            return
+        
+        if self.settings.llm_endpoints:
+            self._initialize_endpoints()
+            self._start_health_check()
+            return
+        
         # 检查并尝试初始化通义千问
         ali_api_key = self.settings.dashscope_api_key
 
         if ali_api_key and ali_api_key.strip():
             try:
                 self._primary_llm = self._create_dashscope_llm()
+                self._providers.append(LLMProvider(
+                    "dashscope", "通义千问", self.settings.default_model,
+                    self._primary_llm, self._create_breaker("dashscope"),
+                    self._create_limiter("dashscope"),
+                    self._structured_mode_for(self._primary_llm)
+                ))
                 print("✅ 通义千问LLM初始化成功")
-                # 不要直接return，需要测试API连接
             except Exception as e:
                 print(f"⚠️  通义千问初始化失败: {e}")
         else:
             print("⚠️  未设置ALI_API_KEY环境变量")
         
-        # 尝试初始化OpenAI作为备选（只有通义千问没有初始化成功时才尝试）
-        if not self._primary_llm:
-            openai_api_key = self.settings.openai_api_key  
-            if openai_api_key and openai_api_key.strip():
-                try:
-                    self._backup_llm = self._create_openai_llm()
-                    print("✅ OpenAI LLM初始化成功(备选方案)")
-                except Exception as e:
-                    print(f"⚠️  OpenAI初始化失败: {e}")
-            else:
-                print("⚠️  未设置OPENAI_API_KEY环境变量")
+        # 同时初始化OpenAI作为热备，主提供商熔断时无需等待即可切换
+        openai_api_key = self.settings.openai_api_key  
+        if openai_api_key and openai_api_key.strip():
+            try:
+                self._backup_llm = self._create_openai_llm()
+                self._providers.append(LLMProvider(
+                    "openai", "OpenAI", self.settings.backup_model,
+                    self._backup_llm, self._create_breaker("openai"),
+                    self._create_limiter("openai"),
+                    self._structured_mode_for(self._backup_llm)
+                ))
+                print("✅ OpenAI LLM初始化成功(备选方案)")
+            except Exception as e:
+                print(f"⚠️  OpenAI初始化失败: {e}")
+        elif not self._primary_llm:
+            print("⚠️  未设置OPENAI_API_KEY环境变量")
         
         if not self._primary_llm and not self._backup_llm:
             raise ValueError("❌ 无法初始化任何LLM，请设置ALI_API_KEY或OPENAI_API_KEY环境变量")
         
-        # 🔍 重要：总是测试API连接
-        self._test_api_connection()
+        self._router = self._create_router()
+        self._start_health_check()
+    
+    def _initialize_endpoints(self):
+        """按llm_endpoints创建多个端点，每个端点有独立的熔断器和限流器"""
+        for index, endpoint in enumerate(self.settings.llm_endpoints):
+            name = endpoint.get("name") or f"endpoint-{index + 1}"
+            kind = (endpoint.get("type") or "openai").lower()
+            api_key = endpoint.get("api_key") or os.environ.get(endpoint.get("api_key_env") or "")
+            if not api_key:
+                print(f"⚠️  端点{name}没有API密钥，已跳过")
+                continue
+            try:
+                if kind == "dashscope":
+                    model = endpoint.get("model") or self.settings.default_model
+                    llm = self._create_dashscope_llm(api_key, model, endpoint.get("base_url"))
+                else:
+                    model = endpoint.get("model") or self.settings.backup_model
+                    llm = self._create_chat_openai(api_key, endpoint.get("base_url") or self.settings.openai_base_url, model)
+            except Exception as e:
+                print(f"⚠️  端点{name}初始化失败: {e}")
+                continue
+            
+            limits = {
+                key: endpoint[key] for key in ("qps", "tpm") if key in endpoint
+            } or self.settings.llm_rate_limits.get(kind, {})
+            self._providers.append(LLMProvider(
+                name, name, model, llm, self._create_breaker(name),
+                self._create_limiter(name, limits, endpoint.get("max_concurrency")),
+                self._structured_mode_for(llm),
+                weight=float(endpoint.get("weight", 1.0)),
+                kind=kind
+            ))
+            print(f"✅ 端点{name}初始化成功（{kind}/{model}）")
+        
+        if not self._providers:
+            raise ValueError("❌ llm_endpoints中没有可用的端点，请检查API密钥配置")
+        self._primary_llm = self._providers[0].llm
+        self._backup_llm = self._providers[1].llm if len(self._providers) > 1 else None
+        self._router = self._create_router()
+        if self._router:
+            print(f"🧭 加权路由: {len(self._providers)} 个端点")
+    
+    def _start_health_check(self):
+        """健康检查默认是被动的，不在启动路径上发起LLM调用"""
+        mode = (self.settings.llm_health_check or "lazy").lower()
+        if mode == "startup":
+            self._test_api_connection()
+        elif mode == "background":
+            self.start_health_probe()
+    
+    def _structured_mode_for(self, llm: BaseLanguageModel) -> Optional[str]:
+        """根据配置和LLM的能力确定结构化输出方式"""
+        mode = (self.settings.llm_structured_output or "off").lower()
+        if mode in ("auto", "tool") and hasattr(llm, "bind_tools"):
+            return "tool"
+        if mode == "json_mode" and hasattr(llm, "bind"):
+            return "json_mode"
+        return None
+    
+    def _initialize_fake_llm(self):
+        """初始化离线假LLM，不需要API密钥和网络"""
+        self._primary_llm = FakeChatModel(
+            latency_ms=self.settings.fake_llm_latency_ms,
+            latency_jitter_ms=self.settings.fake_llm_latency_jitter_ms,
+            latency_distribution=self.settings.fake_llm_latency_distribution,
+            error_rate=self.settings.fake_llm_error_rate,
+            explanation_chars=self.settings.fake_llm_explanation_chars,
+            seed=self.settings.fake_llm_seed
+        )
+        self._providers.append(LLMProvider(
+            "fake", "离线假LLM", self._primary_llm.model_name,
+            self._primary_llm, self._create_breaker("fake"),
+            self._create_limiter("fake")
+        ))
+        print("🧪 使用离线假LLM（llm_backend=fake）")
+    
+    def _initialize_replay_llm(self):
+        """初始化回放录制文件的LLM，不需要API密钥和网络"""
+        self._primary_llm = CassetteChatModel(
+            self._cassette,
+            replay_latency=self.settings.llm_cassette_replay_latency,
+            latency_scale=self.settings.llm_cassette_latency_scale
+        )
+        self._providers.append(LLMProvider(
+            "replay", "录制回放", self._primary_llm.model_name,
+            self._primary_llm, self._create_breaker("replay"),
+            self._create_limiter("replay")
+        ))
+    
+    def _get_provider(self, name: str) -> Optional[LLMProvider]:
+        """按名称查找提供商"""
+        for provider in self._providers:
+            if provider.name == name:
+                return provider
+        return None
+    
+    def _disable_provider(self, name: str):
+        """移除不可用的提供商"""
+        self._providers = [provider for provider in self._providers if provider.name != name]
+        if name == "dashscope":
+            self._primary_llm = None
+        elif name == "openai":
+            self._backup_llm = None
+    
+    def is_healthy(self, provider: str) -> bool:
+        """提供商当前是否健康（熔断器未打开）"""
+        found = self._get_provider(provider)
+        return bool(found and found.healthy)
+    
+    def get_health_status(self) -> Dict[str, Dict[str, Any]]:
+        """获取所有已初始化提供商的熔断器状态"""
+        return {provider.name: provider.breaker.get_stats() for provider in self._providers}
+    
+    def start_health_probe(self) -> threading.Thread:
+        """在后台线程中探测所有提供商，不阻塞调用方"""
+        if self._health_probe_thread and self._health_probe_thread.is_alive():
+            return self._health_probe_thread
+        self._health_probe_thread = threading.Thread(
+            target=self._probe_providers,
+            name="llm-health-probe",
+            daemon=True
+        )
+        self._health_probe_thread.start()
+        return self._health_probe_thread
+    
+    def _probe_providers(self):
+        """向每个提供商发送一次探测请求并更新熔断器"""
+        test_prompt = "滴滴滴，请问能收到我这边的信息吗？收到的话请回复收到收到。"
+        for provider in list(self._providers):
+            started = time.monotonic()
+            try:
+                response = provider.llm.invoke(test_prompt)
+                if not response:
+                    raise ValueError("返回空响应")
+                provider.breaker.record_success(time.monotonic() - started)
+            except Exception as e:
+                # 探测失败直接熔断，真实调用会直接走其他提供商
+                provider.breaker.trip(e)
+                print(f"⚠️  后台健康检查: {provider.label}不可用: {e}")
     
     def _test_api_connection(self):
         """测试API连接是否正常"""
@@ -89,7 +450,7 @@ class LLMService:
                     print("⚠️  通义千问返回空响应")
             except Exception as e:
                 print(f"❌ 通义千问API连接失败: {e}")
-                self._primary_llm = None  # 标记为不可用
+                self._disable_provider("dashscope")  # 标记为不可用
         
         # 如果主LLM失败，测试备选LLM
         if self._backup_llm:
@@ -106,7 +467,7 @@ class LLMService:
                     print("⚠️  OpenAI返回空响应")
             except Exception as e:
                 print(f"❌ OpenAI API连接失败: {e}")
-                self._backup_llm = None  # 标记为不可用
+                self._disable_provider("openai")  # 标记为不可用
         
         # 如果所有API都失败
         if not self._primary_llm and not self._backup_llm:
@@ -121,23 +482,45 @@ class LLMService:
             print("   3. 检查网络连接")
             raise ValueError("❌ 所有API连接测试失败，请检查API密钥和网络连接")
     
-    def _create_dashscope_llm(self) -> BaseLanguageModel:
-        """创建通义千问LLM实例"""
-        # 直接使用ChatTongyi，简化实现
+    def _create_dashscope_llm(
+        self,
+        api_key: Optional[str] = None,
+        model: Optional[str] = None,
+        base_url: Optional[str] = None
+    ) -> BaseLanguageModel:
+        """创建通义千问LLM实例，参数默认取主提供商的配置"""
+        api_key = api_key or self.settings.dashscope_api_key
+        model = model or self.settings.default_model
+        if (self.settings.dashscope_transport or "").lower() == "openai_compatible":
+            # 走OpenAI兼容接口，与OpenAI提供商共享连接池
+            return self._create_chat_openai(
+                api_key=api_key,
+                base_url=base_url or self.settings.dashscope_base_url,
+                model=model
+            )
+        
+        # 使用dashscope SDK，连接由SDK自行管理
         from langchain_community.chat_models.tongyi import ChatTongyi
         
         return ChatTongyi(
-            dashscope_api_key=self.settings.dashscope_api_key,
-            model_name=self.settings.default_model,
+            dashscope_api_key=api_key,
+            model_name=model,
             temperature=self.settings.temperature,
             max_tokens=self.settings.max_tokens,
-            streaming=False
+            streaming=False,
+            max_retries=1  # 重试由LLMService的重试策略统一负责
         )
     
-
-    
     def _create_openai_llm(self) -> BaseLanguageModel:
         """创建OpenAI LLM实例"""
+        return self._create_chat_openai(
+            api_key=self.settings.openai_api_key,
+            base_url=self.settings.openai_base_url,
+            model=self.settings.backup_model
+        )
+    
+    def _create_chat_openai(self, api_key: str, base_url: str, model: str) -> BaseLanguageModel:
+        """创建OpenAI协议的聊天模型，新版本langchain_openai使用共享连接池"""
         try:
             # 尝试新版本的导入
             try:
@@ -148,13 +531,26 @@ class LLMService:
                     from langchain.chat_models import ChatOpenAI
                 except ImportError:
                     from langchain.llms import OpenAI as ChatOpenAI
+                return ChatOpenAI(
+                    openai_api_key=api_key,
+                    openai_api_base=base_url,
+                    model_name=model,
+                    temperature=self.settings.temperature,
+                    max_tokens=self.settings.max_tokens,
+                    max_retries=0
+                )
             
+            # SDK内置重试关闭，重试由LLMService的重试策略统一负责
             return ChatOpenAI(
-                openai_api_key=self.settings.openai_api_key,
-                openai_api_base=self.settings.openai_base_url,
-                model_name=self.settings.backup_model,
+                openai_api_key=api_key,
+                openai_api_base=base_url,
+                model_name=model,
                 temperature=self.settings.temperature,
-                max_tokens=self.settings.max_tokens
+                max_tokens=self.settings.max_tokens,
+                max_retries=0,
+                request_timeout=self._http.timeout,
+                http_client=self._http.sync_client,
+                http_async_client=self._http.async_client
             )
         except ImportError as e:
             logger.error(f"OpenAI模块导入失败: {e}")
@@ -164,59 +560,841 @@ class LLMService:
         """获取LLM实例"""
         if prefer_backup and self._backup_llm:
             return self._backup_llm
-        elif self._primary_llm:
+        for provider in self._providers:
+            if provider.healthy:
+                return provider.llm
+        if self._primary_llm:
             return self._primary_llm
         elif self._backup_llm:
             return self._backup_llm
         else:
             raise ValueError("没有可用的LLM实例")
     
-    async def invoke_with_fallback(self, prompt: str, **kwargs) -> str:
-        """带降级的LLM调用"""
-        last_error = None
+    async def _ainvoke_llm(self, llm: BaseLanguageModel, prompt: str, **kwargs) -> str:
+        """以非阻塞方式调用单个LLM，返回响应文本"""
+        response = await self._ainvoke_message(llm, prompt, **kwargs)
+        return response if isinstance(response, str) else response.content
+    
+    async def _ainvoke_message(self, llm: BaseLanguageModel, prompt: str, **kwargs) -> Any:
+        """
+        以非阻塞方式调用单个LLM，返回完整的响应消息（含用量元数据）
+
+        优先使用LLM自带的异步接口ainvoke；没有异步实现的LLM放到线程池中执行，
+        保证网络等待期间事件循环可以继续调度其他任务。
+        kwargs（max_tokens、stop等）随本次请求发送。
+        """
+        ainvoke = getattr(llm, "ainvoke", None)
+        if ainvoke is not None:
+            return await ainvoke(prompt, **kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(llm.invoke, prompt, **kwargs))
+    
+    def _cache_key(self, provider: LLMProvider, stage: str, prompt: str) -> str:
+        """计算请求的缓存键（按阶段的模型、temperature和max_tokens上限计算，自适应预算不影响命中）"""
+        profile = self._stage_profiles.get(stage)
+        return LLMResponseCache.make_key(
+            provider.name,
+            self._stage_model(provider, stage),
+            profile.temperature if profile.temperature is not None else self.settings.temperature,
+            profile.max_tokens or self.settings.max_tokens,
+            prompt
+        )
+    
+    def _stage_model(self, provider: LLMProvider, stage: str) -> str:
+        """阶段在该提供商上实际使用的模型"""
+        return self._stage_profiles.get(stage).model_for(provider.name, provider.kind) or provider.model
+    
+    def _stage_call_kwargs(self, provider: LLMProvider, stage: str) -> Dict[str, Any]:
+        """阶段配置覆盖的模型和temperature，随本次请求发送"""
+        profile = self._stage_profiles.get(stage)
+        kwargs: Dict[str, Any] = {}
+        model = self._stage_model(provider, stage)
+        if model != provider.model:
+            kwargs["model"] = model
+        if profile.temperature is not None:
+            kwargs["temperature"] = profile.temperature
+        return kwargs
+    
+    def get_stage_settings(self) -> Dict[str, Dict[str, Any]]:
+        """各阶段在每个提供商上使用的模型、temperature和max_tokens上限"""
+        stages = dict.fromkeys(list(STAGE_GROUPS) + list(self._stage_profiles.configured_stages()))
+        result = {}
+        for stage in stages:
+            profile = self._stage_profiles.get(stage)
+            result[stage] = {
+                "models": {provider.name: self._stage_model(provider, stage) for provider in self._providers},
+                "temperature": profile.temperature if profile.temperature is not None else self.settings.temperature,
+                "max_tokens": profile.max_tokens or self.settings.max_tokens
+            }
+        return result
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """获取缓存命中统计"""
+        if not self._cache:
+            return {"enabled": False}
+        return {"enabled": True, **self._cache.get_stats()}
+    
+    def get_limiter_stats(self) -> Dict[str, Dict[str, Any]]:
+        """获取各提供商当前的限流上限和排队延迟"""
+        return {
+            provider.name: provider.limiter.get_stats()
+            for provider in self._providers
+            if provider.limiter
+        }
+    
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """获取共享HTTP连接池的配置、连接数和请求统计"""
+        if not self._http:
+            return {"enabled": False}
+        return {"enabled": True, **self._http.get_stats()}
+    
+    def get_output_budget_stats(self) -> Dict[str, Any]:
+        """获取各阶段的输出token估计、最近一次预算和截断次数"""
+        if not self._output_budget:
+            return {"enabled": False}
+        return {"enabled": True, "stages": self._output_budget.get_stats()}
+    
+    def _output_request(self, stage: str, expected_items: Optional[int], stop: Optional[List[str]]) -> OutputRequest:
+        """计算本次调用的输出约束"""
+        items = expected_items or 1
+        limit = self._stage_profiles.get(stage).max_tokens
+        max_tokens = self._output_budget.budget(stage, items, limit) if self._output_budget else limit
+        return OutputRequest(items, max_tokens, stop if self.settings.llm_early_stop else None)
+    
+    def get_single_flight_stats(self) -> Dict[str, Any]:
+        """获取请求合并统计（上游请求数、合并的调用数）"""
+        if not self._single_flight:
+            return {"enabled": False}
+        return {"enabled": True, **self._single_flight.get_stats()}
+    
+    def get_routing_stats(self) -> Dict[str, Any]:
+        """获取加权路由下各端点的延迟、错误率和首选次数"""
+        if not self._router:
+            return {"enabled": False}
+        return {"enabled": True, "endpoints": self._router.get_stats()}
+    
+    def _ordered_providers(self) -> List[LLMProvider]:
+        """本次请求的提供商尝试顺序：加权路由时按得分抽样，否则按配置顺序"""
+        if self._router:
+            return self._router.order(self._providers)
+        return list(self._providers)
+    
+    def _route(
+        self,
+        providers: Optional[List[LLMProvider]] = None,
+        deadline: Optional[float] = None
+    ) -> Iterator[Tuple[LLMProvider, bool]]:
+        """
+        按优先级依次给出本次请求可以调用的提供商
         
-        # 首先尝试主LLM
-        if self._primary_llm:
+        熔断中的提供商先跳过；前面的提供商都失败或被跳过后，不直接失败，
+        而是兜底调用最快恢复的熔断提供商（认证失败、额度耗尽等主动熔断的除外）。
+        
+        Yields:
+            (提供商, 是否为绕过熔断器的兜底调用)
+        """
+        skipped = []
+        for provider in list(providers if providers is not None else self._ordered_providers()):
+            self._check_deadline(deadline)
+            if provider.breaker.allow_request():
+                yield provider, False
+            else:
+                skipped.append(provider)
+        
+        candidates = [provider for provider in skipped if not provider.breaker.tripped]
+        if candidates:
+            self._check_deadline(deadline)
+            fallback = min(candidates, key=lambda provider: provider.breaker.open_remaining())
+            print(f"🩹 {fallback.label}处于熔断状态，没有其他可用的提供商，仍然尝试调用")
+            yield fallback, True
+    
+    def _should_switch(self, provider: LLMProvider, failed_at: float) -> bool:
+        """
+        退避结束后判断是否放弃剩余重试、改用其他提供商
+        
+        进行中的重试不因熔断器打开而中止（熔断可能正是由本次失败触发的）；
+        只有退避期间其他请求打开了熔断器、且还有其他健康的提供商时才切换。
+        """
+        if not provider.breaker.opened_since(failed_at):
+            return False
+        return any(other is not provider and other.healthy for other in self._providers)
+    
+    def _record_routing(self, provider: LLMProvider, latency: float, error: bool = False):
+        """把调用结果反馈给加权路由"""
+        if self._router:
+            self._router.record(provider.name, latency, error)
+    
+    def get_cassette_stats(self) -> Dict[str, Any]:
+        """获取录制或回放的记录数和未命中次数"""
+        if not self._cassette:
+            return {"enabled": False}
+        return {"enabled": True, "mode": self._cassette_mode, **self._cassette.get_stats()}
+    
+    def _record_cassette(
+        self,
+        provider: LLMProvider,
+        stage: str,
+        prompt: str,
+        content: str,
+        latency: float,
+        message: Any = None,
+        if_missing: bool = False
+    ):
+        """录制模式下把一次成功调用写入录制文件"""
+        if self._cassette is None or self._cassette_mode != "record" or not content:
+            return
+        usage = self._usage_from_message(message) if message is not None else None
+        prompt_tokens, completion_tokens = usage or (self._estimate_tokens(prompt), self._estimate_tokens(content))
+        self._cassette.record(
+            prompt, content, latency, stage=stage, provider=provider.name,
+            model=self._stage_model(provider, stage), prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens, finish_reason=self._finish_reason(message),
+            if_missing=if_missing
+        )
+    
+    def get_hedge_stats(self) -> Dict[str, Any]:
+        """获取各阶段对冲触发和胜出统计"""
+        if not self._hedger:
+            return {"enabled": False}
+        return {"enabled": True, "stages": self._hedger.get_stats()}
+    
+    async def invoke_with_fallback(
+        self,
+        prompt: str,
+        stage: str = "default",
+        use_cache: bool = True,
+        refresh_cache: bool = False,
+        deadline: Optional[float] = None,
+        schema: Optional[Dict[str, Any]] = None,
+        expected_items: Optional[int] = None,
+        stop: Optional[List[str]] = None,
+        **kwargs
+    ) -> str:
+        """
+        带降级、重试和缓存的LLM调用
+        
+        Args:
+            prompt: 提示词
+            stage: 调用阶段（analysis、multiple_choice等），用于对冲预算和统计
+            use_cache: 为False时完全绕过缓存
+            refresh_cache: 为True时忽略已有缓存，调用LLM后覆盖旧结果
+                （进行中的相同请求仍会被合并）
+            deadline: 截止时间（time.time()时间戳），重试和等待不会超过该时间
+            schema: 结构化输出的函数定义（见schemas.question_output_tool），
+                提供商支持时按该Schema返回题目，不支持时使用文本模式
+            expected_items: 预计输出单位数（知识点数），用于估算max_tokens
+            stop: 停止序列，文本模式下输出到达该序列即结束
+            
+        Returns:
+            LLM响应文本；结构化输出时为题目数组的JSON文本
+        """
+        # 一次逻辑调用（含缓存、请求合并、对冲和重试），每次实际请求是它的子span
+        with trace_span("llm.invoke", "llm", stage=stage, prompt_chars=len(prompt), structured=bool(schema)):
+            cache = self._cache if use_cache else None
+            refresh = refresh_cache or self.settings.llm_cache_refresh
+            
+            # 先查缓存，任一提供商的历史响应都可以直接复用
+            if cache and not refresh:
+                for provider in self._providers:
+                    cached = cache.get(self._cache_key(provider, stage, prompt))
+                    if cached is not None:
+                        record_llm_call(LLMCallRecord(stage, provider.name, self._stage_model(provider, stage), cache_hit=True))
+                        # 缓存命中的响应也要录制，否则回放时（缓存未命中）找不到该请求
+                        self._record_cassette(provider, stage, prompt, cached, 0.0, if_missing=True)
+                        annotate(cache_hit=True, response_chars=len(cached))
+                        return cached
+            
+            stage_token = _call_stage.set(stage)
+            output_token = _call_output.set(self._output_request(stage, expected_items, stop))
             try:
-                response = self._primary_llm.invoke(prompt)
-                return response if isinstance(response, str) else response.content
-            except Exception as e:
-                last_error = e
-                print(f"⚠️  通义千问调用失败: {e}")
+                if self._single_flight:
+                    provider, content, coalesced = await self._invoke_single_flight(prompt, stage, deadline, schema, stop)
+                    if coalesced:
+                        # 结果来自其他调用发出的请求，由发起方负责写缓存
+                        record_llm_call(LLMCallRecord(stage, provider.name, self._stage_model(provider, stage), coalesced=True))
+                        annotate(coalesced=True, response_chars=len(content or ""))
+                        return content
+                else:
+                    provider, content = await self._invoke_upstream(prompt, stage, deadline, schema)
+            finally:
+                _call_output.reset(output_token)
+                _call_stage.reset(stage_token)
+            
+            annotate(provider=provider.name, response_chars=len(content or ""))
+            if cache and content:
+                cache.set(self._cache_key(provider, stage, prompt), content)
+            return content
+    
+    async def _invoke_upstream(
+        self,
+        prompt: str,
+        stage: str,
+        deadline: Optional[float] = None,
+        schema: Optional[Dict[str, Any]] = None
+    ) -> Tuple[LLMProvider, str]:
+        """向提供商发出请求（按配置使用对冲）"""
+        if self._hedger:
+            return await self._invoke_hedged(prompt, stage, deadline, schema)
+        return await self._invoke_providers(prompt, deadline=deadline, schema=schema)
+    
+    async def _invoke_single_flight(
+        self,
+        prompt: str,
+        stage: str,
+        deadline: Optional[float],
+        schema: Optional[Dict[str, Any]],
+        stop: Optional[List[str]]
+    ) -> Tuple[LLMProvider, str, bool]:
+        """
+        合并进行中的相同请求
         
-        # 如果主LLM失败，尝试备选LLM
-        if self._backup_llm:
+        上游请求按第一个调用的截止时间执行；每个调用只按自己的截止时间等待。
+        
+        Returns:
+            (响应的提供商, 响应文本, 是否为合并的调用)
+        """
+        self._check_deadline(deadline)
+        key = SingleFlight.make_key(
+            prompt, self.settings.temperature, self._stage_profiles.get(stage).to_dict(),
+            schema["name"] if schema else None, stop
+        )
+        try:
+            (provider, content), coalesced = await self._single_flight.run(
+                key,
+                lambda: self._invoke_upstream(prompt, stage, deadline, schema),
+                remaining_seconds(deadline)
+            )
+        except DeadlineExceededError:
+            raise
+        except asyncio.TimeoutError as e:
+            if deadline is not None and remaining_seconds(deadline) <= 0:
+                raise DeadlineExceededError("文档处理超过时间预算") from e
+            raise
+        return provider, content, coalesced
+    
+    async def _invoke_providers(
+        self,
+        prompt: str,
+        providers: Optional[List[LLMProvider]] = None,
+        deadline: Optional[float] = None,
+        schema: Optional[Dict[str, Any]] = None
+    ) -> Tuple[LLMProvider, str]:
+        """按优先级尝试各提供商，返回(实际响应的提供商, 响应文本)"""
+        last_error = None
+        
+        # 熔断中的提供商先跳过，不再为它等待超时；没有其他可用提供商时才兜底调用
+        for provider, forced in self._route(providers, deadline):
             try:
-                response = self._backup_llm.invoke(prompt)
-                return response if isinstance(response, str) else response.content
+                return provider, await self._invoke_with_retry(provider, prompt, deadline, schema, forced)
+            except DeadlineExceededError:
+                raise
             except Exception as e:
                 last_error = e
-                print(f"⚠️  OpenAI调用失败: {e}")
+                print(f"⚠️  {provider.label}调用失败: {e}")
+        
+        if last_error:
+            error_msg = f"所有LLM都不可用: {last_error}"
+        elif self._providers:
+            error_msg = "所有LLM都因认证失败或额度耗尽被熔断，请检查配置后重试"
+        else:
+            error_msg = "没有可用的LLM实例"
+        raise ValueError(error_msg)
+    
+    async def _invoke_hedged(
+        self,
+        prompt: str,
+        stage: str,
+        deadline: Optional[float] = None,
+        schema: Optional[Dict[str, Any]] = None
+    ) -> Tuple[LLMProvider, str]:
+        """
+        对冲调用：原请求超过阶段延迟分位数仍未返回时发出副本，先成功者胜出，另一个被取消
+        """
+        hedger = self._hedger
+        started = time.monotonic()
+        delay = hedger.hedge_delay(stage)
+        primary = asyncio.ensure_future(self._invoke_providers(prompt, deadline=deadline, schema=schema))
+        tasks = [primary]
+        
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait({primary}, timeout=delay)
+                if not done:
+                    # 副本优先发往下一个提供商，只有一个提供商时发往同一个
+                    hedge_order = self._providers[1:] + self._providers[:1]
+                    tasks.append(asyncio.ensure_future(self._invoke_providers(prompt, hedge_order, deadline, schema)))
+                    hedger.record_fired(stage)
+            
+            pending = set(tasks)
+            last_error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        continue
+                    if task is not primary:
+                        hedger.record_won(stage)
+                    hedger.record_latency(stage, time.monotonic() - started)
+                    return task.result()
+            raise last_error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
+    async def astream_with_fallback(
+        self,
+        prompt: str,
+        stage: str = "default",
+        use_cache: bool = True,
+        refresh_cache: bool = False,
+        deadline: Optional[float] = None,
+        expected_items: Optional[int] = None,
+        stop: Optional[List[str]] = None
+    ) -> AsyncIterator[str]:
+        """
+        带降级和缓存的流式LLM调用，逐块产出响应文本
+        
+        只有在第一个文本块到达之前失败时才会重试或切换到下一个提供商，
+        已经输出部分内容后的失败直接抛出。流式调用不参与请求对冲。
+        输出中出现停止序列时立即结束并关闭连接，即使提供商没有执行stop参数。
+        
+        Args:
+            prompt: 提示词
+            stage: 调用阶段
+            use_cache: 为False时完全绕过缓存
+            refresh_cache: 为True时忽略已有缓存，调用LLM后覆盖旧结果
+            deadline: 截止时间（time.time()时间戳）
+            expected_items: 预计输出单位数（知识点数），用于估算max_tokens
+            stop: 停止序列
+            
+        Yields:
+            响应文本片段；命中缓存时一次性产出完整响应
+        """
+        cache = self._cache if use_cache else None
+        refresh = refresh_cache or self.settings.llm_cache_refresh
+        
+        if cache and not refresh:
+            for provider in self._providers:
+                cached = cache.get(self._cache_key(provider, stage, prompt))
+                if cached is not None:
+                    record_llm_call(LLMCallRecord(stage, provider.name, self._stage_model(provider, stage), cache_hit=True))
+                    # 缓存命中的响应也要录制，否则回放时（缓存未命中）找不到该请求
+                    self._record_cassette(provider, stage, prompt, cached, 0.0, if_missing=True)
+                    yield cached
+                    return
+        
+        output = self._output_request(stage, expected_items, stop)
+        last_error = None
+        for provider, forced in self._route(deadline=deadline):
+            attempt = 0
+            while True:
+                attempt += 1
+                
+                chunks: List[str] = []
+                started = time.monotonic()
+                slot_context = (
+                    provider.limiter.slot(self._estimate_tokens(prompt))
+                    if provider.limiter else contextlib.nullcontext()
+                )
+                stream = self._astream_llm(
+                    provider.llm, prompt, **output.call_kwargs(), **self._stage_call_kwargs(provider, stage)
+                )
+                try:
+                    async with slot_context as slot:
+                        try:
+                            async for chunk in stream:
+                                chunk, stopped = self._cut_at_stop(chunks, chunk, output.stop)
+                                if chunk:
+                                    chunks.append(chunk)
+                                    yield chunk
+                                if stopped:
+                                    break
+                                self._check_deadline(deadline)
+                        except DeadlineExceededError:
+                            raise
+                        except Exception as e:
+                            if slot is not None:
+                                slot.overloaded = is_overload_error(e)
+                            raise
+                except (asyncio.CancelledError, GeneratorExit, DeadlineExceededError) as e:
+                    provider.breaker.release()
+                    self._record_usage(
+                        provider, prompt, time.monotonic() - started, stage=stage, attempt=attempt,
+                        content="".join(chunks), error_class="cancelled", error_type=type(e).__name__
+                    )
+                    raise
+                except Exception as e:
+                    last_error = e
+                    self._record_provider_failure(provider, e, time.monotonic() - started)
+                    self._record_routing(provider, time.monotonic() - started, error=True)
+                    self._record_usage(
+                        provider, prompt, time.monotonic() - started, stage=stage, attempt=attempt,
+                        content="".join(chunks), error=e
+                    )
+                    print(f"⚠️  {provider.label}流式调用失败: {e}")
+                    if chunks:
+                        raise
+                    delay = self._retry_delay(provider, attempt, e, deadline)
+                    if delay is None:
+                        break
+                    failed_at = time.monotonic()
+                    await asyncio.sleep(delay)
+                    self._check_deadline(deadline)
+                    if not forced and self._should_switch(provider, failed_at):
+                        break
+                    continue
+                finally:
+                    # 提前结束时关闭底层流，释放HTTP连接
+                    await stream.aclose()
+                
+                provider.breaker.record_success(time.monotonic() - started)
+                self._record_routing(provider, time.monotonic() - started)
+                content = "".join(chunks)
+                self._record_cassette(provider, stage, prompt, content, time.monotonic() - started)
+                completion_tokens = self._record_usage(
+                    provider, prompt, time.monotonic() - started, stage=stage, attempt=attempt, content=content
+                )
+                if self._output_budget and completion_tokens:
+                    self._output_budget.observe(stage, output.items, completion_tokens)
+                if provider.limiter:
+                    provider.limiter.charge_tokens(self._estimate_tokens(content))
+                if cache and content:
+                    cache.set(self._cache_key(provider, stage, prompt), content)
+                return
         
         error_msg = f"所有LLM都不可用: {last_error}" if last_error else "没有可用的LLM实例"
         raise ValueError(error_msg)
     
-    def parse_json_response(self, response: str) -> Dict[str, Any]:
-        """解析LLM返回的JSON响应"""
+    async def _astream_llm(self, llm: BaseLanguageModel, prompt: str, **kwargs) -> AsyncIterator[str]:
+        """流式调用单个LLM；不支持流式的LLM退化为一次性返回"""
+        if getattr(llm, "astream", None) is None:
+            yield await self._ainvoke_llm(llm, prompt, **kwargs)
+            return
+        async for chunk in llm.astream(prompt, **kwargs):
+            yield chunk if isinstance(chunk, str) else chunk.content
+    
+    @staticmethod
+    def _cut_at_stop(chunks: List[str], chunk: str, stop: Optional[List[str]]) -> Tuple[str, bool]:
+        """
+        在流式输出中查找停止序列
+        
+        Args:
+            chunks: 已输出的片段
+            chunk: 新到达的片段
+            stop: 停止序列
+            
+        Returns:
+            (应输出的部分, 是否遇到停止序列)；停止序列跨片段时已输出的前缀不再收回
+        """
+        if not stop or not chunk:
+            return chunk, False
+        longest = max(len(sequence) for sequence in stop)
+        # 已输出的片段都不为空，取最后longest-1个片段足以覆盖跨片段的前缀
+        tail = "".join(chunks[-(longest - 1):])[-(longest - 1):] if longest > 1 else ""
+        window = tail + chunk
+        positions = [window.find(sequence) for sequence in stop if sequence in window]
+        if not positions:
+            return chunk, False
+        return chunk[:max(0, min(positions) - len(tail))], True
+    
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        """粗略估算token数，中文约每1.5个字符一个token"""
+        return max(1, int(len(text) / 1.5))
+    
+    @staticmethod
+    def _check_deadline(deadline: Optional[float]):
+        """截止时间已过时抛出DeadlineExceededError"""
+        remaining = remaining_seconds(deadline)
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceededError("文档处理超过时间预算")
+    
+    def _retry_delay(
+        self,
+        provider: LLMProvider,
+        attempt: int,
+        error: Exception,
+        deadline: Optional[float]
+    ) -> Optional[float]:
+        """
+        根据错误类型决定是否重试同一提供商
+        
+        Returns:
+            重试前的等待秒数；不重试时返回None
+        """
+        if is_provider_fatal(error):
+            # 密钥无效或额度耗尽时直接熔断，后续请求不再浪费在该提供商上
+            if provider.healthy:
+                provider.breaker.trip(error)
+                print(f"⚡ {provider.label}认证或额度错误，已熔断")
+            return None
+        delay = self._retry_policy.next_delay(attempt, error, deadline)
+        if delay is not None:
+            print(f"🔁 {provider.label}调用失败（{classify_error(error).value}），"
+                  f"{delay:.1f}秒后进行第{attempt + 1}次尝试")
+        return delay
+    
+    async def _invoke_with_retry(
+        self,
+        provider: LLMProvider,
+        prompt: str,
+        deadline: Optional[float] = None,
+        schema: Optional[Dict[str, Any]] = None,
+        forced: bool = False
+    ) -> str:
+        """按重试策略调用单个提供商，每次尝试都不会超过截止时间；forced表示绕过熔断器的兜底调用"""
+        attempt = 0
+        while True:
+            attempt += 1
+            timeout = remaining_seconds(deadline)
+            # 只在本次尝试期间生效，之后的用量记录和追踪不会沿用过期的尝试次数
+            attempt_token = _call_attempt.set(attempt)
+            try:
+                if timeout is None:
+                    return await self._invoke_provider(provider, prompt, schema)
+                if timeout <= 0:
+                    provider.breaker.release()
+                    raise DeadlineExceededError("文档处理超过时间预算")
+                return await asyncio.wait_for(self._invoke_provider(provider, prompt, schema), timeout)
+            except DeadlineExceededError:
+                raise
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError) and deadline is not None and remaining_seconds(deadline) <= 0:
+                    raise DeadlineExceededError("文档处理超过时间预算") from e
+                delay = self._retry_delay(provider, attempt, e, deadline)
+                if delay is None:
+                    raise
+                failed_at = time.monotonic()
+                with trace_span("llm.backoff", "llm", provider=provider.name, attempt=attempt, delay=round(delay, 3)):
+                    await asyncio.sleep(delay)
+                self._check_deadline(deadline)
+                if not forced and self._should_switch(provider, failed_at):
+                    raise
+            finally:
+                _call_attempt.reset(attempt_token)
+    
+    async def _invoke_provider(
+        self,
+        provider: LLMProvider,
+        prompt: str,
+        schema: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """经过限流器调用单个提供商，并把结果和耗时记录到它的熔断器"""
+        with trace_span("llm.call", "llm", provider=provider.name, attempt=_call_attempt.get()):
+            try:
+                if provider.limiter is None:
+                    return await self._call_provider(provider, prompt, schema)
+                
+                async with provider.limiter.slot(self._estimate_tokens(prompt)) as slot:
+                    if slot.queue_delay > 0.001:
+                        now = time.time()
+                        record_span("llm.queue", "llm", now - slot.queue_delay, now, provider=provider.name)
+                    try:
+                        content = await self._call_provider(provider, prompt, schema)
+                    except Exception as e:
+                        slot.overloaded = is_overload_error(e)
+                        raise
+            except asyncio.CancelledError:
+                # 排队或调用中被取消（例如对冲失败方），归还熔断器的试探名额
+                provider.breaker.release()
+                raise
+            provider.limiter.charge_tokens(self._estimate_tokens(content or ""))
+            return content
+    
+    async def _call_provider(
+        self,
+        provider: LLMProvider,
+        prompt: str,
+        schema: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """调用单个提供商，记录熔断器状态和用量"""
+        started = time.monotonic()
+        message = None
+        output = _call_output.get()
+        stage_options = self._stage_call_kwargs(provider, _call_stage.get())
         try:
-            # 提取JSON部分
-            if "```json" in response:
-                start = response.find("```json") + 7
-                end = response.find("```", start)
-                json_str = response[start:end].strip()
-            elif "```" in response:
-                start = response.find("```") + 3
-                end = response.find("```", start)
-                json_str = response[start:end].strip()
+            if schema and provider.structured_mode:
+                # 函数调用和JSON模式的输出不包含代码块，stop序列不适用
+                options = output.call_kwargs(include_stop=False) if output else {}
+                content, message = await self._ainvoke_structured(provider, prompt, schema, **options, **stage_options)
             else:
-                json_str = response.strip()
+                options = {**(output.call_kwargs() if output else {}), **stage_options}
+                message = await self._ainvoke_message(provider.llm, prompt, **options)
+                content = message if isinstance(message, str) else message.content
+        except asyncio.CancelledError:
+            # 被取消的调用（对冲失败方、超时）可能已经产生费用，按估算记录
+            self._record_usage(provider, prompt, time.monotonic() - started, error_class="cancelled",
+                               error_type="CancelledError")
+            raise
+        except Exception as e:
+            self._record_provider_failure(provider, e, time.monotonic() - started)
+            self._record_routing(provider, time.monotonic() - started, error=True)
+            self._record_usage(provider, prompt, time.monotonic() - started, error=e)
+            raise
+        provider.breaker.record_success(time.monotonic() - started)
+        self._record_routing(provider, time.monotonic() - started)
+        self._record_cassette(provider, _call_stage.get(), prompt, content, time.monotonic() - started, message)
+        completion_tokens = self._record_usage(
+            provider, prompt, time.monotonic() - started, message=message, content=content
+        )
+        self._observe_output(provider, output, completion_tokens, self._finish_reason(message))
+        return content
+    
+    @staticmethod
+    def _finish_reason(message: Any) -> Optional[str]:
+        """读取响应的结束原因（stop、length、tool_calls等）"""
+        metadata = getattr(message, "response_metadata", None) or {}
+        return metadata.get("finish_reason") or metadata.get("stop_reason")
+    
+    def _observe_output(
+        self,
+        provider: LLMProvider,
+        output: Optional[OutputRequest],
+        completion_tokens: int,
+        finish_reason: Optional[str]
+    ):
+        """把实际输出量反馈给输出预算，达到max_tokens被截断时给出提示"""
+        truncated = finish_reason in ("length", "max_tokens")
+        if truncated:
+            limit = output.max_tokens if output and output.max_tokens else self.settings.max_tokens
+            print(f"✂️  {provider.label}输出达到max_tokens（{limit}）被截断，将提高{_call_stage.get()}阶段的预算")
+        if self._output_budget and output and completion_tokens:
+            self._output_budget.observe(_call_stage.get(), output.items, completion_tokens, truncated)
+    
+    @staticmethod
+    def _usage_from_message(message: Any) -> Optional[Tuple[int, int]]:
+        """从响应消息中读取(输入token, 输出token)，提供商未返回时为None"""
+        usage = getattr(message, "usage_metadata", None)
+        if usage:
+            return int(usage.get("input_tokens", 0)), int(usage.get("output_tokens", 0))
+        metadata = getattr(message, "response_metadata", None) or {}
+        token_usage = metadata.get("token_usage") or metadata.get("usage") or {}
+        if token_usage:
+            return (
+                int(token_usage.get("prompt_tokens", token_usage.get("input_tokens", 0)) or 0),
+                int(token_usage.get("completion_tokens", token_usage.get("output_tokens", 0)) or 0)
+            )
+        return None
+    
+    def _record_usage(
+        self,
+        provider: LLMProvider,
+        prompt: str,
+        latency: float,
+        message: Any = None,
+        content: str = "",
+        error: Optional[Exception] = None,
+        error_class: Optional[str] = None,
+        error_type: Optional[str] = None,
+        stage: Optional[str] = None,
+        attempt: Optional[int] = None
+    ) -> int:
+        """记录一次LLM调用的token和耗时，返回输出token数"""
+        usage = self._usage_from_message(message) if message is not None else None
+        estimated = usage is None
+        if usage is not None:
+            prompt_tokens, completion_tokens = usage
+        elif error is not None:
+            # 请求被拒绝时通常不计费
+            prompt_tokens, completion_tokens = 0, 0
+        else:
+            prompt_tokens = self._estimate_tokens(prompt)
+            completion_tokens = self._estimate_tokens(content) if content else 0
+        if error is not None:
+            error_class = classify_error(error).value
+            error_type = type(error).__name__
+        stage = stage or _call_stage.get()
+        model = self._stage_model(provider, stage)
+        annotate(
+            model=model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+            estimated_tokens=estimated, finish_reason=self._finish_reason(message), error_class=error_class
+        )
+        record_llm_call(LLMCallRecord(
+            stage=stage,
+            provider=provider.name,
+            model=model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            latency=latency,
+            attempt=attempt or _call_attempt.get(),
+            error_class=error_class,
+            error_type=error_type,
+            estimated_tokens=estimated,
+            cost=estimate_cost(model, prompt_tokens, completion_tokens, self.settings.llm_model_prices)
+        ))
+        return completion_tokens
+    
+    async def _ainvoke_structured(
+        self,
+        provider: LLMProvider,
+        prompt: str,
+        schema: Dict[str, Any],
+        **kwargs
+    ) -> Tuple[str, Any]:
+        """
+        以结构化输出方式调用，返回(题目数组的JSON文本, 响应消息)
+        
+        提供商拒绝结构化参数（4xx请求错误）时关闭该提供商的结构化输出并立即改用文本模式；
+        模型没有按Schema返回时使用它的文本内容。
+        """
+        try:
+            if provider.structured_mode == "tool":
+                llm = provider.llm.bind_tools(
+                    [{"type": "function", "function": schema}],
+                    tool_choice=schema["name"]
+                )
+                response = await llm.ainvoke(prompt, **kwargs)
+                tool_calls = getattr(response, "tool_calls", None) or []
+                if tool_calls:
+                    args = tool_calls[0].get("args") or {}
+                    return json.dumps(args.get("questions", args), ensure_ascii=False), response
+                return response.content, response
             
-            # 尝试解析JSON
-            return json.loads(json_str)
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON解析失败: {e}")
+            llm = provider.llm.bind(response_format={"type": "json_object"})
+            response = await llm.ainvoke(f"{prompt}\n\n请以JSON对象输出，题目数组放在questions字段中。", **kwargs)
+            extraction = extract_json(response.content)
+            value = extraction.merged() if extraction.values else None
+            if isinstance(value, dict) and isinstance(value.get("questions"), list):
+                return json.dumps(value["questions"], ensure_ascii=False), response
+            return response.content, response
+        except Exception as e:
+            if classify_error(e) != ErrorKind.FATAL or is_provider_fatal(e):
+                raise
+            print(f"⚠️  {provider.label}不支持结构化输出（{e}），改用文本模式")
+            provider.structured_mode = None
+            response = await self._ainvoke_message(provider.llm, prompt, **kwargs)
+            return (response if isinstance(response, str) else response.content), response
+    
+    def _record_provider_failure(self, provider: LLMProvider, error: Exception, latency: float):
+        """记录一次失败调用，熔断器因此打开时给出提示"""
+        if classify_error(error) == ErrorKind.RATE_LIMITED:
+            # 限流是流量控制信号，由退避和自适应并发处理，不计入熔断
+            provider.breaker.release()
+            return
+        was_healthy = provider.healthy
+        provider.breaker.record_failure(error, latency)
+        if was_healthy and not provider.healthy:
+            print(f"⚡ {provider.label}已熔断，{self.settings.circuit_open_seconds:.0f}秒内请求将直接发往其他提供商")
+    
+    def parse_json_response(self, response: str) -> Any:
+        """
+        解析LLM返回的JSON响应
+        
+        容忍说明文字、多个代码块、尾逗号、中文弯引号和被截断的输出；
+        顶层数组中个别元素损坏时只丢弃这些元素。
+        
+        Returns:
+            解析出的JSON值；多个代码块中的对象会合并为一个列表
+        """
+        extraction = extract_json(response)
+        if not extraction.values:
             logger.error(f"原始响应: {response}")
-            raise ValueError(f"无法解析LLM返回的JSON: {e}")
+            raise ValueError("无法解析LLM返回的JSON: 响应中没有完整的JSON对象或数组")
+        if extraction.repaired:
+            logger.warning(f"LLM返回的JSON经过修复，丢弃了{extraction.dropped}个无法解析的元素")
+        return extraction.merged()
 
 
 # 全局LLM服务实例
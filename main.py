@@ -15,7 +15,11 @@ from pathlib import Path
 from schemas import GraphState, DocumentContent
 from nodes import DocumentProcessorNode
 from question_generator_graph import QuestionGeneratorGraph
+from graph_events import (
+    DOCUMENT_PROCESSED, ANALYSIS_READY, QUESTIONS_READY, GENERATION_FAILED, OUTPUT_READY, FINISHED
+)
 from config import get_settings
+from usage_tracking import export_prometheus
 
 # 取消所有warning显示
 warnings.filterwarnings("ignore")
@@ -38,6 +42,12 @@ logging.getLogger("httpx").setLevel(logging.ERROR)
 logging.getLogger("httpcore").setLevel(logging.ERROR)
 logger = logging.getLogger(__name__)
 
+QUESTION_TYPE_NAMES = {
+    "multiple_choice": "选择题",
+    "fill_in_the_blank": "填空题",
+    "matching": "连线题"
+}
+
 
 class QuestionGeneratorApp:
     """题目生成应用主类"""
@@ -47,7 +57,7 @@ class QuestionGeneratorApp:
         # 检查API密钥
         self._check_api_keys()
         
-        # 初始化LLM服务并测试连接
+        # 初始化LLM服务（健康检查按配置惰性或在后台进行）
         try:
             from llm_service import get_llm_service
             self.llm_service = get_llm_service()
@@ -59,10 +69,16 @@ class QuestionGeneratorApp:
         
         self.graph = QuestionGeneratorGraph()
         self.document_processor = DocumentProcessorNode()
+        self.show_progress = True  # 每个节点完成时打印进度
+        self.events_path = None  # 设置后把每个事件追加写入该JSON Lines文件
+        self.last_trace_file = None  # 最近一次运行的追踪文件（启用追踪时）
     
     def _check_api_keys(self):
         """检查API密钥设置"""
         import os
+        if self.settings.llm_backend.lower() == "fake" or self.settings.llm_cassette_mode.lower() == "replay":
+            return
+        
         ali_key = os.environ.get("ALI_API_KEY")
         openai_key = os.environ.get("OPENAI_API_KEY")
         
@@ -81,13 +97,89 @@ class QuestionGeneratorApp:
         elif openai_key:
             print(f"✅ 检测到OPENAI_API_KEY: {openai_key[:10]}...")
     
-    async def generate_from_file(self, file_path: str, output_path: str = None) -> dict:
+    async def _consume_events(self, events) -> GraphState:
+        """
+        消费工作流事件流：每个节点完成时打印进度，并按需把事件写入文件
+        
+        Returns:
+            finished事件中的最终状态
+        """
+        events_file = None
+        if self.events_path:
+            events_file = open(self.events_path, "a", encoding="utf-8")
+        try:
+            final_state = None
+            async for event in events:
+                if events_file:
+                    events_file.write(json.dumps(event.to_dict(), ensure_ascii=False, default=str) + "\n")
+                    events_file.flush()
+                if self.show_progress:
+                    self._print_event(event)
+                if event.type == FINISHED:
+                    final_state = event.state
+                    self.last_trace_file = event.data.get("trace_file")
+            return final_state
+        finally:
+            if events_file:
+                events_file.close()
+    
+    def _print_event(self, event):
+        """打印一条进度"""
+        data = event.data
+        if event.type == DOCUMENT_PROCESSED:
+            print(f"📄 文档处理完成: {data['title']}（{data['content_length']} 字）")
+        elif event.type == ANALYSIS_READY:
+            reused = "，复用近似重复文档的分析" if data.get("reused_from") else ""
+            print(f"🔍 文档分析完成: 主题 {len(data['topics'])} 个，关键点 {len(data['key_points'])} 个{reused}（{event.elapsed:.2f}s）")
+        elif event.type == QUESTIONS_READY:
+            name = QUESTION_TYPE_NAMES.get(data["question_type"], data["question_type"])
+            print(f"📝 {name}已生成 {len(data['questions'])} 道（{event.elapsed:.2f}s）")
+        elif event.type == GENERATION_FAILED:
+            print(f"⚠️  {data['error']}")
+        elif event.type == OUTPUT_READY:
+            print(f"📊 输出格式化完成（{event.elapsed:.2f}s）")
+        # 失败原因在运行结束后统一打印
+    
+    def _build_result(self, result_state: GraphState, output_path: str = None) -> dict:
+        """
+        处理工作流的最终状态：成功时获取格式化输出并保存到文件
+        
+        结果中带有运行ID，失败或部分题型失败时可以用它续跑。
+        """
+        if result_state.current_step == "completed":
+            logger.info("题目生成成功完成")
+            
+            # 获取格式化输出
+            output = self.graph.output_formatter.get_formatted_output(result_state)
+            
+            # 保存到文件
+            if output_path:
+                success = self.graph.output_formatter.save_to_file(result_state, output_path)
+                if success:
+                    logger.info(f"结果已保存到: {output_path}")
+            
+            return {
+                "success": True,
+                "output": output,
+                "file_path": output_path,
+                "run_id": result_state.run_id
+            }
+        else:
+            logger.error(f"题目生成失败: {result_state.error_message}")
+            return {
+                "success": False,
+                "error": result_state.error_message,
+                "run_id": result_state.run_id
+            }
+    
+    async def generate_from_file(self, file_path: str, output_path: str = None, run_id: str = None) -> dict:
         """
         从文件生成题目
         
         Args:
             file_path: 输入文档文件路径
             output_path: 输出文件路径（可选）
+            run_id: 运行ID（可选），用于失败后续跑
             
         Returns:
             生成结果字典
@@ -105,32 +197,9 @@ class QuestionGeneratorApp:
             )
             
             # 运行工作流
-            result_state = await self.graph.run(initial_state)
+            result_state = await self._consume_events(self.graph.astream_run(initial_state, run_id=run_id))
             
-            # 处理结果
-            if result_state.current_step == "completed":
-                logger.info("题目生成成功完成")
-                
-                # 获取格式化输出
-                output = self.graph.output_formatter.get_formatted_output(result_state)
-                
-                # 保存到文件
-                if output_path:
-                    success = self.graph.output_formatter.save_to_file(result_state, output_path)
-                    if success:
-                        logger.info(f"结果已保存到: {output_path}")
-                
-                return {
-                    "success": True,
-                    "output": output,
-                    "file_path": output_path
-                }
-            else:
-                logger.error(f"题目生成失败: {result_state.error_message}")
-                return {
-                    "success": False,
-                    "error": result_state.error_message
-                }
+            return self._build_result(result_state, output_path)
                 
         except Exception as e:
             error_msg = f"处理文件时发生错误: {str(e)}"
@@ -140,7 +209,7 @@ class QuestionGeneratorApp:
                 "error": error_msg
             }
     
-    async def generate_from_text(self, title: str, content: str, output_path: str = None) -> dict:
+    async def generate_from_text(self, title: str, content: str, output_path: str = None, run_id: str = None) -> dict:
         """
         从文本生成题目
         
@@ -148,6 +217,7 @@ class QuestionGeneratorApp:
             title: 文档标题
             content: 文档内容
             output_path: 输出文件路径（可选）
+            run_id: 运行ID（可选），用于失败后续跑
             
         Returns:
             生成结果字典
@@ -165,32 +235,9 @@ class QuestionGeneratorApp:
             )
             
             # 运行工作流
-            result_state = await self.graph.run(initial_state)
+            result_state = await self._consume_events(self.graph.astream_run(initial_state, run_id=run_id))
             
-            # 处理结果
-            if result_state.current_step == "completed":
-                logger.info("题目生成成功完成")
-                
-                # 获取格式化输出
-                output = self.graph.output_formatter.get_formatted_output(result_state)
-                
-                # 保存到文件
-                if output_path:
-                    success = self.graph.output_formatter.save_to_file(result_state, output_path)
-                    if success:
-                        logger.info(f"结果已保存到: {output_path}")
-                
-                return {
-                    "success": True,
-                    "output": output,
-                    "file_path": output_path
-                }
-            else:
-                logger.error(f"题目生成失败: {result_state.error_message}")
-                return {
-                    "success": False,
-                    "error": result_state.error_message
-                }
+            return self._build_result(result_state, output_path)
                 
         except Exception as e:
             error_msg = f"处理文本时发生错误: {str(e)}"
@@ -200,6 +247,37 @@ class QuestionGeneratorApp:
                 "error": error_msg
             }
     
+    async def resume(self, run_id: str, output_path: str = None) -> dict:
+        """
+        从检查点继续一次失败或中断的运行
+        
+        Args:
+            run_id: 运行ID
+            output_path: 输出文件路径（可选）
+            
+        Returns:
+            生成结果字典
+        """
+        try:
+            logger.info(f"继续运行: {run_id}")
+            result_state = await self._consume_events(self.graph.astream_resume(run_id))
+            return self._build_result(result_state, output_path)
+        except ValueError as e:
+            # 没有检查点或无法续跑，不再提示该运行ID
+            logger.error(f"无法继续运行: {e}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
+        except Exception as e:
+            error_msg = f"继续运行时发生错误: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "success": False,
+                "error": error_msg,
+                "run_id": run_id
+            }
+    
     def print_graph_info(self):
         """打印工作流信息"""
         print("\n=== AI教育题目生成系统 ===")
@@ -210,6 +288,10 @@ class QuestionGeneratorApp:
         print("1. 选择题 (Multiple Choice)")
         print("2. 填空题 (Fill-in-the-Blank)")
         print("3. 连线题 (Matching)")
+        print("\n🎛️  各阶段模型:")
+        for stage, stage_settings in self.llm_service.get_stage_settings().items():
+            models = "，".join(f"{name}: {model}" for name, model in stage_settings["models"].items())
+            print(f"  {stage}: {models}（temperature {stage_settings['temperature']}，max_tokens {stage_settings['max_tokens']}）")
         print("\n📊 图结构可视化功能:")
         print("  --graph              显示详细的图结构信息（ASCII + Mermaid）")
         print("  --save-graph ./imgs  保存图结构可视化文件到指定目录")
@@ -294,9 +376,42 @@ async def main():
 
     parser.add_argument('--graph', action='store_true', help='显示图结构信息（ASCII和Mermaid）')
     parser.add_argument('--save-graph', type=str, metavar='DIR', help='保存图结构可视化文件到指定目录')
+    parser.add_argument('--no-cache', action='store_true', help='不使用LLM响应缓存')
+    parser.add_argument('--refresh-cache', action='store_true', help='忽略已有LLM缓存并重新生成')
+    parser.add_argument('--metrics-file', type=str, metavar='PATH', help='运行结束后把LLM用量指标写入Prometheus文本文件')
+    parser.add_argument('--record', type=str, metavar='PATH', help='把LLM请求、响应和耗时录制到文件')
+    parser.add_argument('--replay', type=str, metavar='PATH', help='回放录制文件中的LLM响应，不访问网络')
+    parser.add_argument('--replay-latency', action='store_true', help='回放时按录制的耗时等待')
+    parser.add_argument('--run-id', type=str, metavar='ID', help='指定运行ID（默认自动生成），失败后可用--resume续跑')
+    parser.add_argument('--resume', type=str, metavar='RUN_ID', help='从检查点继续一次失败或中断的运行，只执行未完成的节点')
+    parser.add_argument('--events-file', type=str, metavar='PATH', help='把每个节点完成时的事件逐条写入JSON Lines文件')
+    parser.add_argument('--quiet', '-q', action='store_true', help='不打印每个节点的进度')
+    parser.add_argument('--trace', type=str, nargs='?', const='traces', metavar='DIR',
+                        help='把每次运行的节点、LLM调用和解析校验时间线写入目录（默认traces）')
+    parser.add_argument('--trace-format', choices=['chrome', 'otlp'],
+                        help='追踪文件格式：chrome（chrome://tracing、Perfetto）或otlp（OTLP/JSON）')
     
     args = parser.parse_args()
     
+    # 缓存开关需要在LLM服务创建之前设置
+    settings = get_settings()
+    if args.no_cache:
+        settings.llm_cache_enabled = False
+    if args.refresh_cache:
+        settings.llm_cache_refresh = True
+    if args.record:
+        settings.llm_cassette_mode = "record"
+        settings.llm_cassette_path = args.record
+    elif args.replay:
+        settings.llm_cassette_mode = "replay"
+        settings.llm_cassette_path = args.replay
+    if args.replay_latency:
+        settings.llm_cassette_replay_latency = True
+    if args.trace:
+        settings.trace_dir = args.trace
+    if args.trace_format:
+        settings.trace_format = args.trace_format
+    
     # 创建应用实例，如果失败则退出
     try:
         app = QuestionGeneratorApp()
@@ -308,6 +423,9 @@ async def main():
         print("3. 查看图结构：python main.py --graph")
         return
     
+    app.show_progress = not args.quiet
+    app.events_path = args.events_file
+    
     # 显示系统信息
     if args.info:
         app.print_graph_info()
@@ -348,14 +466,17 @@ async def main():
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         args.output = f"generated_questions_{timestamp}.json"
     
-    # 处理文件输入
-    if args.file:
-        if not Path(args.file).exists():
+    # 处理文件输入或续跑
+    if args.file or args.resume:
+        if args.resume:
+            print(f"正在继续运行: {args.resume}")
+            result = await app.resume(args.resume, args.output)
+        elif not Path(args.file).exists():
             print(f"错误: 文件不存在 - {args.file}")
             return
-        
-        print(f"正在处理文件: {args.file}")
-        result = await app.generate_from_file(args.file, args.output)
+        else:
+            print(f"正在处理文件: {args.file}")
+            result = await app.generate_from_file(args.file, args.output, run_id=args.run_id)
         
         if result["success"]:
             print(f"\n✅ 题目生成成功!")
@@ -370,13 +491,71 @@ async def main():
                 print(f"   选择题: {stats['multiple_choice_count']}")
                 print(f"   填空题: {stats['fill_in_the_blank_count']}")
                 print(f"   连线题: {stats['matching_count']}")
+            
+            generation_errors = output.get("metadata", {}).get("generation_errors")
+            if generation_errors:
+                print(f"\n⚠️  部分题型生成失败: {'，'.join(generation_errors)}")
+                print(f"🔖 运行ID: {result['run_id']}，可用 python main.py --resume {result['run_id']} 重新生成失败的题型")
+            
+            llm_usage = output.get("metadata", {}).get("llm_usage")
+            if llm_usage:
+                totals = llm_usage["totals"]
+                currency = app.settings.llm_cost_currency
+                print(f"\n🧮 LLM用量: 调用 {totals['calls']} 次，重试 {totals['retries']} 次，"
+                      f"token {totals['prompt_tokens']} + {totals['completion_tokens']}，费用约 {totals['cost']:.4f} {currency}")
+                for stage, stage_usage in llm_usage["by_stage"].items():
+                    print(f"   {stage}（{'/'.join(stage_usage['models'])}）: 调用 {stage_usage['calls']} 次，"
+                          f"token {stage_usage['total_tokens']}，平均耗时 {stage_usage['latency_avg']:.2f}s，"
+                          f"费用约 {stage_usage['cost']:.4f} {currency}")
+            
+            cache_stats = app.llm_service.get_cache_stats()
+            if cache_stats["enabled"]:
+                print(f"\n💾 LLM缓存: 命中 {cache_stats['hits']} 次，未命中 {cache_stats['misses']} 次")
+            
+            for provider_name, limiter_stats in app.llm_service.get_limiter_stats().items():
+                print(f"🚦 限流[{provider_name}]: 并发上限 {limiter_stats['concurrency_limit']}，"
+                      f"平均排队 {limiter_stats['avg_queue_delay'] * 1000:.0f}ms")
+            
+            pool_stats = app.llm_service.get_pool_stats()
+            if pool_stats["enabled"]:
+                print(f"🔌 连接池: 请求 {pool_stats['requests']} 次，"
+                      f"当前连接 {pool_stats['async_pool']['connections']} 个")
+            
+            budget_stats = app.llm_service.get_output_budget_stats()
+            if budget_stats["enabled"]:
+                for stage, stage_stats in budget_stats["stages"].items():
+                    print(f"📏 输出预算[{stage}]: max_tokens {stage_stats['last_budget']}，"
+                          f"每单位约 {stage_stats['tokens_per_item']:.0f} tokens，截断 {stage_stats['truncated']} 次")
+            
+            flight_stats = app.llm_service.get_single_flight_stats()
+            if flight_stats["enabled"] and flight_stats["coalesced"]:
+                print(f"🔗 请求合并: 上游请求 {flight_stats['leaders']} 次，合并 {flight_stats['coalesced']} 次")
+            
+            cassette_stats = app.llm_service.get_cassette_stats()
+            if cassette_stats["enabled"]:
+                print(f"📼 录制回放[{cassette_stats['mode']}]: 录制 {cassette_stats['recorded']} 条，"
+                      f"回放 {cassette_stats['replayed']} 次，未命中 {cassette_stats['misses']} 次")
+            
+            routing_stats = app.llm_service.get_routing_stats()
+            if routing_stats["enabled"]:
+                for name, stats in routing_stats["endpoints"].items():
+                    latency = f"{stats['latency']:.2f}s" if stats["latency"] is not None else "-"
+                    print(f"🧭 路由[{name}]: 首选 {stats['selected']} 次，延迟EWMA {latency}，错误率 {stats['error_rate']:.1%}")
+            
+            hedge_stats = app.llm_service.get_hedge_stats()
+            if hedge_stats["enabled"]:
+                for stage, stage_stats in hedge_stats["stages"].items():
+                    print(f"🔀 对冲[{stage}]: 调用 {stage_stats['calls']} 次，"
+                          f"触发 {stage_stats['fired']} 次，胜出 {stage_stats['won']} 次")
         else:
             print(f"\n❌ 题目生成失败: {result['error']}")
+            if result.get("run_id") and app.graph.checkpointer is not None:
+                print(f"🔖 运行ID: {result['run_id']}，可用 python main.py --resume {result['run_id']} 从最后完成的节点继续")
     
     # 处理文本输入
     elif args.title and args.content:
         print(f"正在处理文本: {args.title}")
-        result = await app.generate_from_text(args.title, args.content, args.output)
+        result = await app.generate_from_text(args.title, args.content, args.output, run_id=args.run_id)
         
         if result["success"]:
             print(f"\n✅ 题目生成成功!")
@@ -391,9 +570,18 @@ async def main():
         print("  --info          查看系统信息")
         print("  --graph         显示图结构信息（ASCII和Mermaid）")
         print("  --save-graph    保存图结构可视化文件")
+        print("  --resume ID     从检查点继续失败或中断的运行")
         print("  --help          查看完整帮助")
         print("\n💡 可以先使用示例文档查看效果：")
         print("     python main.py --sample")
+        return
+    
+    if app.last_trace_file:
+        print(f"🧵 追踪已写入: {app.last_trace_file}")
+    
+    if args.metrics_file:
+        export_prometheus(args.metrics_file)
+        print(f"📈 LLM用量指标已写入: {args.metrics_file}")
 
 
 if __name__ == "__main__":
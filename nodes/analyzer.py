@@ -1,12 +1,16 @@
 """
 文档分析节点
 """
+import asyncio
 import logging
 import re
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from schemas import GraphState
 from prompts import DocumentAnalysisPrompt
 from llm_service import get_llm_service
+from config import get_settings
+from document_index import get_document_index, document_signature
+from tracing import trace_span, annotate
 
 logger = logging.getLogger(__name__)
 
@@ -14,9 +18,15 @@ logger = logging.getLogger(__name__)
 class DocumentAnalyzerNode:
     """文档分析节点 - 负责提取关键点和主题"""
     
+    # 调用阶段名称，对应llm_stage_settings中的分阶段模型配置
+    stage = "analysis"
+    
     def __init__(self):
         self.llm_service = get_llm_service()
+        self.settings = get_settings()
         self.analysis_prompt = DocumentAnalysisPrompt.get_prompt()
+        # 近似重复文档的指纹索引，命中时复用已有的分析结果
+        self.document_index = get_document_index() if self.settings.document_dedup_enabled else None
     
     async def process(self, state: GraphState) -> GraphState:
         """
@@ -40,6 +50,18 @@ class DocumentAnalyzerNode:
             
             document = state.document
             
+            signature = None
+            # 不使用缓存（--no-cache）时既不复用也不记录分析结果
+            if self.document_index and self.settings.llm_cache_enabled:
+                # 指纹计算是CPU密集的，放到线程池中避免阻塞其他文档的LLM调用
+                loop = asyncio.get_running_loop()
+                signature = await loop.run_in_executor(None, document_signature, document.content)
+                if self.settings.llm_cache_refresh:
+                    # 强制刷新（--refresh-cache）时重新分析，并使近似重复文档的旧结果失效
+                    self._invalidate_analysis(signature)
+                elif self._reuse_analysis(state, signature):
+                    return state
+            
             # 构建分析Prompt
             prompt = self.analysis_prompt.format(
                 title=document.title,
@@ -48,16 +70,26 @@ class DocumentAnalyzerNode:
             
             # 调用LLM进行分析
             logger.info("调用LLM进行文档分析...")
-            response = await self.llm_service.invoke_with_fallback(prompt)
+            response = await self.llm_service.invoke_with_fallback(
+                prompt, stage=self.stage, deadline=state.deadline
+            )
             
             # 解析分析结果
-            topics, key_points = self._parse_analysis_result(response)
+            with trace_span("parse.analysis", "parse", response_chars=len(response)):
+                topics, key_points, parsed = self._parse_analysis_result(response)
+                annotate(topics=len(topics), key_points=len(key_points), fallback=not parsed)
             
             # 更新状态
             state.topics = topics
             state.key_points = key_points
             state.current_step = "document_analyzed"
             
+            # 只记录完整解析的结果，备用解析得到的默认值不应被其他文档复用
+            if signature is not None and parsed:
+                self.document_index.add(signature, document.title, topics, key_points)
+            elif signature is not None:
+                logger.warning("文档分析结果未能完整解析，不写入文档指纹索引")
+            
             logger.info(f"文档分析完成，识别主题: {len(topics)}个，关键点: {len(key_points)}个")
             
         except Exception as e:
@@ -68,7 +100,42 @@ class DocumentAnalyzerNode:
         
         return state
     
-    def _parse_analysis_result(self, response: str) -> tuple[List[str], List[str]]:
+    def _reuse_analysis(self, state: GraphState, signature: Tuple[str, int]) -> bool:
+        """
+        文档与已分析的文档相同或近似重复时，直接使用其主题和知识点
+        
+        Args:
+            state: 当前状态
+            signature: 文档的(内容哈希, SimHash指纹)
+            
+        Returns:
+            是否复用了已有的分析结果
+        """
+        match, distance = self.document_index.lookup(signature)
+        if match is None:
+            return False
+        
+        state.topics = list(match.topics)
+        state.key_points = list(match.key_points)
+        state.analysis_reused_from = {
+            "title": match.title,
+            "distance": distance,
+            "exact": match.content_hash == signature[0]
+        }
+        state.current_step = "document_analyzed"
+        relation = "内容相同" if state.analysis_reused_from["exact"] else f"近似重复（指纹差异{distance}位）"
+        print(f"♻️  文档与已分析的《{match.title}》{relation}，复用其分析结果")
+        logger.info(f"复用文档分析结果，主题: {len(state.topics)}个，关键点: {len(state.key_points)}个")
+        return True
+    
+    def _invalidate_analysis(self, signature: Tuple[str, int]):
+        """删除与文档相同或近似重复的已有分析结果，新结果分析完成后重新写入"""
+        match, _ = self.document_index.lookup(signature)
+        if match is not None:
+            self.document_index.remove(match.content_hash)
+            logger.info(f"强制刷新，已删除《{match.title}》的分析结果")
+    
+    def _parse_analysis_result(self, response: str) -> Tuple[List[str], List[str], bool]:
         """
         解析LLM分析结果
         
@@ -76,10 +143,11 @@ class DocumentAnalyzerNode:
             response: LLM返回的分析结果
             
         Returns:
-            (主题列表, 关键点列表)
+            (主题列表, 关键点列表, 是否完整解析)；主题或关键点使用了备用值时为False
         """
         topics = []
         key_points = []
+        parsed = False
         
         try:
             # 按节分割响应
@@ -98,6 +166,8 @@ class DocumentAnalyzerNode:
                 elif section.startswith('关键知识点') or 'key' in section.lower() or '知识点' in section:
                     key_points = self._extract_list_items(section)
             
+            parsed = bool(topics and key_points)
+            
             # 如果解析失败，尝试备用解析方法
             if not topics and not key_points:
                 topics, key_points = self._fallback_parse(response)
@@ -116,8 +186,9 @@ class DocumentAnalyzerNode:
             # 提供默认值
             topics = ["文档主题"]
             key_points = ["文档内容概述"]
+            parsed = False
         
-        return topics, key_points
+        return topics, key_points, parsed
     
     def _extract_list_items(self, text: str) -> List[str]:
         """
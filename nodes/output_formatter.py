@@ -5,6 +5,8 @@ import json
 import logging
 from typing import Dict, Any
 from schemas import GraphState
+from usage_tracking import current_usage_summary
+from tracing import trace_span, annotate
 
 logger = logging.getLogger(__name__)
 
@@ -32,7 +34,8 @@ class OutputFormatterNode:
                 return state
             
             if not state.question_set:
-                state.error_message = "没有生成任何题目"
+                errors = "；".join(state.generation_errors.values())
+                state.error_message = f"没有生成任何题目: {errors}" if errors else "没有生成任何题目"
                 state.current_step = "error"
                 return state
             
@@ -47,16 +50,33 @@ class OutputFormatterNode:
             }
             
             # 验证题目质量
-            validation_result = self._validate_questions(question_set)
+            with trace_span("validate.questions", "parse", questions=stats["total_questions"]):
+                validation_result = self._validate_questions(question_set)
+                annotate(issues=len(validation_result["issues"]), quality_score=validation_result["quality_score"])
+            
+            metadata = {
+                "document_title": question_set.document_title,
+                "generated_at": question_set.generated_at,
+                "statistics": stats,
+                "validation": validation_result
+            }
+            if state.analysis_reused_from:
+                metadata["analysis_reused_from"] = state.analysis_reused_from
+            if state.generation_errors:
+                # 题型并行生成，个别题型失败时仍输出其他题型
+                metadata["generation_errors"] = dict(state.generation_errors)
+            if state.run_id:
+                # 有题型失败时可以按运行ID续跑，只重新生成失败的题型
+                metadata["run_id"] = state.run_id
+            
+            # 本次运行的LLM token和耗时汇总（在工作流中运行时才有）
+            llm_usage = current_usage_summary()
+            if llm_usage is not None:
+                metadata["llm_usage"] = llm_usage
             
             # 构建完整的输出结构
             formatted_output = {
-                "metadata": {
-                    "document_title": question_set.document_title,
-                    "generated_at": question_set.generated_at,
-                    "statistics": stats,
-                    "validation": validation_result
-                },
+                "metadata": metadata,
                 "questions": {
                     "multiple_choice": [q.dict() for q in question_set.multiple_choice],
                     "fill_in_the_blank": [q.dict() for q in question_set.fill_in_the_blank],
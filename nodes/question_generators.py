@@ -3,35 +3,358 @@
 """
 import logging
 import json
+import re
+import time
+import asyncio
 import uuid
+import inspect
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional, Tuple, Iterator
 from schemas import (
-    GraphState, QuestionSet, QuestionType,
-    MultipleChoiceQuestion, FillInTheBlankQuestion, MatchingQuestion, MatchingPair
+    GraphState, QuestionSet, QuestionType, BaseQuestion,
+    MultipleChoiceQuestion, FillInTheBlankQuestion, MatchingQuestion, MatchingPair,
+    question_output_tool
 )
-from prompts import MultipleChoicePrompt, FillInTheBlankPrompt, MatchingPrompt
+from prompts import MultipleChoicePrompt, FillInTheBlankPrompt, MatchingPrompt, generation_round_hint
 from llm_service import get_llm_service
+from config import get_settings
+from json_utils import IncrementalJSONArrayParser
+from output_budget import JSON_ARRAY_STOP
+from tracing import trace_span, annotate
 
 logger = logging.getLogger(__name__)
 
 
+class QuestionMerger:
+    """
+    合并分组调用的题目：按去重键丢弃重复题目，最多保留target道
+    
+    题目ID重复时（各组的模型都从mc_001开始编号）重新生成ID
+    """
+    
+    def __init__(self, target: int, key: Callable[[BaseQuestion], str], new_id: Callable[[], str]):
+        self.target = target
+        self._key = key
+        self._new_id = new_id
+        self._keys = set()
+        self._ids = set()
+        self._entries: List[Tuple[int, int, BaseQuestion]] = []
+        self.duplicates = 0
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    @property
+    def full(self) -> bool:
+        return len(self._entries) >= self.target
+    
+    def add(self, question: BaseQuestion, chunk_index: int = 0) -> bool:
+        """加入一道题目，重复或已达到目标数量时返回False"""
+        if self.full:
+            return False
+        key = self._key(question)
+        if key in self._keys:
+            self.duplicates += 1
+            return False
+        self._keys.add(key)
+        if question.question_id in self._ids:
+            question.question_id = self._new_id()
+        self._ids.add(question.question_id)
+        self._entries.append((chunk_index, len(self._entries), question))
+        return True
+    
+    def questions(self) -> List[BaseQuestion]:
+        """按分组顺序返回题目，与各组完成的先后无关"""
+        return [question for _, _, question in sorted(self._entries, key=lambda entry: entry[:2])]
+
+
 class BaseQuestionGenerator:
     """题目生成器基类"""
     
+    # 调用阶段名称（对应llm_stage_settings中的分阶段模型配置）和题目模型，由子类覆盖
+    stage = "default"
+    question_model = None
+    id_prefix = "q"
+    points_per_question = 1  # 每道题使用的知识点数
+    
     def __init__(self):
         self.llm_service = get_llm_service()
+        self.settings = get_settings()
+        self._question_listeners: List[Callable[[BaseQuestion], Any]] = []
+        # 由题目模型推导的结构化输出定义
+        self.output_tool = (
+            question_output_tool(self.question_model, f"submit_{self.stage}_questions", "提交生成的题目")
+            if self.question_model else None
+        )
     
     def _generate_question_id(self, prefix: str) -> str:
         """生成题目ID"""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         short_uuid = str(uuid.uuid4())[:8]
         return f"{prefix}_{timestamp}_{short_uuid}"
+    
+    def add_question_listener(self, listener: Callable[[BaseQuestion], Any]):
+        """注册题目监听器，每道题通过校验后立即回调（支持同步和异步函数）"""
+        self._question_listeners.append(listener)
+    
+    async def _emit_question(self, question: BaseQuestion):
+        """把一道已校验的题目通知给所有监听器"""
+        for listener in self._question_listeners:
+            try:
+                result = listener(question)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"题目监听器执行失败: {e}")
+    
+    @staticmethod
+    def _restore_array_end(response: str) -> str:
+        """补回被停止序列截掉的数组结束符"""
+        text = response.rstrip()
+        if text.endswith("}") and "[" in text:
+            return text + "\n]"
+        return response
+    
+    def _build_question(self, data: Dict[str, Any], topic: str) -> BaseQuestion:
+        """根据单个JSON对象构建并校验题目，由子类实现"""
+        raise NotImplementedError
+    
+    def _parse_response(self, response: str, topic: str, placeholder: bool = True) -> List[BaseQuestion]:
+        """解析完整的LLM响应，由子类实现；placeholder为False时解析失败抛出异常而不是返回示例题目"""
+        raise NotImplementedError
+    
+    async def _generate(
+        self,
+        prompt: str,
+        topic: str,
+        deadline: Optional[float] = None,
+        expected_items: Optional[int] = None,
+        accept: Optional[Callable[[BaseQuestion], bool]] = None,
+        placeholder: bool = True
+    ) -> List[BaseQuestion]:
+        """
+        调用LLM生成题目
+        
+        Args:
+            prompt: 题目生成Prompt
+            topic: 默认主题
+            deadline: 截止时间（Unix时间戳）
+            expected_items: Prompt中的知识点数，用于估算输出token预算
+            accept: 题目合并函数，返回False的题目（重复或超出数量）不通知监听器
+            placeholder: 响应无法解析时是否返回示例题目，为False时抛出异常
+            
+        Returns:
+            通过校验的题目列表
+        """
+        if self.settings.llm_streaming_generation:
+            # 流式生成按文本增量解析，不使用结构化输出
+            return await self._generate_streaming(prompt, topic, deadline, expected_items, accept, placeholder)
+        
+        response = await self.llm_service.invoke_with_fallback(
+            prompt, stage=self.stage, deadline=deadline, schema=self.output_tool,
+            expected_items=expected_items, stop=[JSON_ARRAY_STOP]
+        )
+        with trace_span(f"parse.{self.stage}", "parse", response_chars=len(response)):
+            questions = self._parse_response(self._restore_array_end(response), topic, placeholder)
+            annotate(questions=len(questions))
+        for question in questions:
+            if accept is None or accept(question):
+                await self._emit_question(question)
+        return questions
+    
+    async def _generate_streaming(
+        self,
+        prompt: str,
+        topic: str,
+        deadline: Optional[float] = None,
+        expected_items: Optional[int] = None,
+        accept: Optional[Callable[[BaseQuestion], bool]] = None,
+        placeholder: bool = True
+    ) -> List[BaseQuestion]:
+        """流式生成：JSON数组中的每个对象一闭合就校验并通知监听器"""
+        parser = IncrementalJSONArrayParser()
+        questions = []
+        started = time.monotonic()
+        
+        # 流式调用与增量解析交织进行，记录为一个span（首道题目耗时作为属性）
+        with trace_span("llm.stream", "llm", stage=self.stage, prompt_chars=len(prompt)):
+            async for chunk in self.llm_service.astream_with_fallback(
+                prompt, stage=self.stage, deadline=deadline,
+                expected_items=expected_items, stop=[JSON_ARRAY_STOP]
+            ):
+                for data in parser.feed(chunk):
+                    try:
+                        question = self._build_question(data, topic)
+                    except Exception:
+                        continue
+                    if not questions:
+                        logger.info(f"首道题目生成耗时 {time.monotonic() - started:.2f}s")
+                        annotate(first_question_seconds=round(time.monotonic() - started, 3))
+                    questions.append(question)
+                    if accept is None or accept(question):
+                        await self._emit_question(question)
+            annotate(response_chars=len(parser.text), questions=len(questions))
+        
+        if not questions:
+            # 增量解析没有得到任何题目时，按完整文本再解析一次
+            with trace_span(f"parse.{self.stage}", "parse", response_chars=len(parser.text)):
+                questions = self._parse_response(self._restore_array_end(parser.text), topic, placeholder)
+                annotate(questions=len(questions))
+            for question in questions:
+                if accept is None or accept(question):
+                    await self._emit_question(question)
+        
+        return questions
+    
+    def _dedupe_key(self, question: BaseQuestion) -> str:
+        """去重键：忽略空白和标点的题干"""
+        return re.sub(r"[\W_]+", "", question.question_text).lower()
+    
+    def _plan_chunks(
+        self,
+        key_points: List[str],
+        target: int,
+        start: int = 0,
+        first_round: int = 0,
+        seen: Optional[set] = None
+    ) -> Iterator[Tuple[int, List[str], int]]:
+        """
+        把目标题目数拆分为知识点分组，逐个产生(轮次, 知识点, 题目数)
+        
+        每轮先从start开始分组到末尾，再分组start之前的知识点，第一组与只调用一次时选取的知识点相同；
+        每组最多generation_chunk_size个知识点。一轮用完所有知识点仍不够时，下一轮从头再分组，
+        并在Prompt中换一个考察角度。每道题需要多个知识点的题型（连线题）每轮错开分组的起点，
+        跳过已经用过的知识点组合（记录在seen中，补充生成时传入同一个集合），起点都试过后停止；
+        知识点不多于一道题所需时只有一种组合，只调用一次。
+        """
+        count_points = len(key_points)
+        if not count_points:
+            return
+        per_question = self.points_per_question
+        per_call = max(per_question, self.settings.generation_chunk_size // per_question * per_question)
+        if per_question > 1:
+            max_rounds = first_round + count_points
+            shift = max(1, per_question // 2)
+            seen = set() if seen is None else seen
+        else:
+            max_rounds, shift = None, 0
+        remaining = target
+        round_index = first_round
+        while remaining > 0 and (max_rounds is None or round_index < max_rounds):
+            offset = (start - round_index * shift) % count_points
+            ordered = key_points[offset:] + key_points[:offset]
+            for segment in (key_points[offset:], key_points[:offset]):
+                for begin in range(0, len(segment), per_call):
+                    points = segment[begin:begin + per_call]
+                    if len(points) < per_question:
+                        # 不足一道题时用其他知识点补齐（知识点总数不足时使用全部知识点）
+                        points = points + [point for point in ordered if point not in points][:per_question - len(points)]
+                    count = min(remaining, max(1, len(points) // per_question))
+                    if len(points) > count * per_question:
+                        points = points[:count * per_question]
+                    if per_question > 1:
+                        group = frozenset(points)
+                        if group in seen:
+                            continue
+                        seen.add(group)
+                    yield round_index, points, count
+                    remaining -= count
+                    if remaining <= 0:
+                        return
+            round_index += 1
+    
+    async def _generate_batch(
+        self,
+        key_points: List[str],
+        topic: str,
+        deadline: Optional[float] = None,
+        start: int = 0,
+        target: Optional[int] = None
+    ) -> Tuple[List[BaseQuestion], Optional[str]]:
+        """
+        按知识点分组并行生成题目，去重合并到目标数量
+        
+        最多generation_max_parallel_chunks个分组同时调用LLM，分组按需生成，
+        达到目标数量后不再发起新的调用；去重或失败后仍不足时按缺口补充一轮。
+        响应无法解析的分组不使用示例题目，按失败处理；部分分组失败时保留其余分组的题目，
+        全部失败时抛出第一个错误。
+        
+        Args:
+            key_points: 知识点
+            topic: 默认主题
+            deadline: 截止时间（Unix时间戳）
+            start: 第一组开始的知识点位置
+            target: 目标题目数，默认为max_questions_per_type
+            
+        Returns:
+            (去重后的题目列表（不超过目标数量）, 分组失败导致数量不足时的错误信息)
+        """
+        target = max(1, target or self.settings.max_questions_per_type)
+        merger = QuestionMerger(target, self._dedupe_key, lambda: self._generate_question_id(self.id_prefix))
+        errors: List[Exception] = []
+        groups = set()
+        calls = 0
+        next_round = 0
+        
+        async def run_chunks(chunks: Iterator[Tuple[int, Tuple[int, List[str], int]]]):
+            async def worker():
+                nonlocal calls, next_round
+                # 所有worker共享同一个分组迭代器，分组按需生成，内存中只有正在进行的分组
+                for index, (round_index, points, count) in chunks:
+                    if merger.full:
+                        return
+                    calls += 1
+                    next_round = max(next_round, round_index + 1)
+                    prompt = self.prompt_template.format(
+                        topic=topic,
+                        key_points='\n'.join([f"- {point}" for point in points])
+                    ) + generation_round_hint(round_index)
+                    with trace_span(f"chunk.{self.stage}", "chunk", index=index, round=round_index,
+                                    key_points=len(points), expected_questions=count):
+                        try:
+                            questions = await self._generate(
+                                prompt, topic, deadline, len(points),
+                                accept=lambda question, index=index: merger.add(question, index),
+                                placeholder=False
+                            )
+                            annotate(questions=len(questions))
+                        except Exception as e:
+                            logger.warning(f"{self.stage}第{index + 1}组题目生成失败: {e}")
+                            annotate(error=str(e))
+                            errors.append(e)
+            
+            parallel = max(1, self.settings.generation_max_parallel_chunks)
+            await asyncio.gather(*(worker() for _ in range(parallel)))
+        
+        await run_chunks(enumerate(self._plan_chunks(key_points, target, start, seen=groups)))
+        
+        shortfall = target - len(merger)
+        if 0 < shortfall < target:
+            # 重复、失败或数量不足时按缺口换一个角度补充一轮，不再继续重试（知识点太少时不再分组）
+            logger.info(f"{self.stage}还缺少{shortfall}道题目，补充生成")
+            await run_chunks(enumerate(self._plan_chunks(key_points, shortfall, start, next_round, groups), calls))
+        
+        questions = merger.questions()
+        if not questions and errors:
+            raise errors[0]
+        if calls > 1:
+            logger.info(
+                f"{self.stage}分{calls}组生成，合并 {len(questions)} 道题目"
+                f"（去除重复 {merger.duplicates} 道，失败 {len(errors)} 组）"
+            )
+        error = None
+        if errors and len(questions) < target:
+            error = f"{len(errors)}组生成失败，只生成了{len(questions)}/{target}道: {errors[0]}"
+        return questions, error
 
 
 class MultipleChoiceGeneratorNode(BaseQuestionGenerator):
     """选择题生成器节点"""
     
+    stage = "multiple_choice"
+    question_model = MultipleChoiceQuestion
+    id_prefix = "mc"
+    
     def __init__(self):
         super().__init__()
         self.prompt_template = MultipleChoicePrompt.get_prompt()
@@ -55,22 +378,12 @@ class MultipleChoiceGeneratorNode(BaseQuestionGenerator):
             if not state.key_points:
                 return state
             
-            # 选择适合的关键点（前5个）
-            selected_points = state.key_points[:5]
+            # 关键点按原顺序使用（前面的通常较基础）
             topic = state.topics[0] if state.topics else state.document.title
             
-            # 构建Prompt
-            prompt = self.prompt_template.format(
-                topic=topic,
-                key_points='\n'.join([f"- {point}" for point in selected_points])
-            )
-            
-            # 调用LLM生成题目
+            # 按知识点分组调用LLM生成题目
             logger.info("调用LLM生成选择题...")
-            response = await self.llm_service.invoke_with_fallback(prompt)
-            
-            # 解析响应
-            questions = self._parse_multiple_choice_response(response, topic)
+            questions, error = await self._generate_batch(state.key_points, topic, state.deadline)
             
             # 初始化QuestionSet如果还没有
             if not state.question_set:
@@ -81,6 +394,9 @@ class MultipleChoiceGeneratorNode(BaseQuestionGenerator):
             
             # 添加选择题
             state.question_set.multiple_choice = questions
+            if error:
+                # 部分分组失败：保留已生成的题目，失败信息写入输出
+                state.generation_errors = {**state.generation_errors, self.stage: f"选择题部分生成失败: {error}"}
             
             logger.info(f"成功生成 {len(questions)} 道选择题")
             
@@ -92,7 +408,23 @@ class MultipleChoiceGeneratorNode(BaseQuestionGenerator):
         
         return state
     
-    def _parse_multiple_choice_response(self, response: str, topic: str) -> List[MultipleChoiceQuestion]:
+    def _parse_response(self, response: str, topic: str, placeholder: bool = True) -> List[MultipleChoiceQuestion]:
+        """解析完整的LLM响应"""
+        return self._parse_multiple_choice_response(response, topic, placeholder)
+    
+    def _build_question(self, data: Dict[str, Any], topic: str) -> MultipleChoiceQuestion:
+        """构建并校验一道选择题"""
+        return MultipleChoiceQuestion(
+            question_id=data.get('question_id', self._generate_question_id("mc")),
+            question_text=data['question_text'],
+            options=data['options'],
+            correct_answer=data['correct_answer'],
+            topic=data.get('topic', topic),
+            difficulty=data.get('difficulty', 'medium'),
+            explanation=data.get('explanation', '')
+        )
+    
+    def _parse_multiple_choice_response(self, response: str, topic: str, placeholder: bool = True) -> List[MultipleChoiceQuestion]:
         """解析选择题响应"""
         questions = []
         
@@ -107,21 +439,14 @@ class MultipleChoiceGeneratorNode(BaseQuestionGenerator):
             
             for i, data in enumerate(question_data_list):
                 try:
-                    question = MultipleChoiceQuestion(
-                        question_id=data.get('question_id', self._generate_question_id("mc")),
-                        question_text=data['question_text'],
-                        options=data['options'],
-                        correct_answer=data['correct_answer'],
-                        topic=data.get('topic', topic),
-                        difficulty=data.get('difficulty', 'medium'),
-                        explanation=data.get('explanation', '')
-                    )
-                    questions.append(question)
+                    questions.append(self._build_question(data, topic))
                 except Exception as e:
                     continue
             
         except Exception as e:
             logger.error(f"选择题JSON解析失败: {e}")
+            if not placeholder:
+                raise ValueError(f"选择题JSON解析失败: {e}")
             # 创建一个默认题目
             questions.append(self._create_fallback_multiple_choice(topic))
         
@@ -143,6 +468,10 @@ class MultipleChoiceGeneratorNode(BaseQuestionGenerator):
 class FillInTheBlankGeneratorNode(BaseQuestionGenerator):
     """填空题生成器节点"""
     
+    stage = "fill_in_the_blank"
+    question_model = FillInTheBlankQuestion
+    id_prefix = "fb"
+    
     def __init__(self):
         super().__init__()
         self.prompt_template = FillInTheBlankPrompt.get_prompt()
@@ -166,23 +495,13 @@ class FillInTheBlankGeneratorNode(BaseQuestionGenerator):
             if not state.key_points:
                 return state
             
-            # 选择适合的关键点（中间部分）
+            # 关键点从中间部分开始使用
             start_idx = min(3, len(state.key_points) // 3)
-            selected_points = state.key_points[start_idx:start_idx+5]
             topic = state.topics[0] if state.topics else state.document.title
             
-            # 构建Prompt
-            prompt = self.prompt_template.format(
-                topic=topic,
-                key_points='\n'.join([f"- {point}" for point in selected_points])
-            )
-            
-            # 调用LLM生成题目
+            # 按知识点分组调用LLM生成题目
             logger.info("调用LLM生成填空题...")
-            response = await self.llm_service.invoke_with_fallback(prompt)
-            
-            # 解析响应
-            questions = self._parse_fill_blank_response(response, topic)
+            questions, error = await self._generate_batch(state.key_points, topic, state.deadline, start_idx)
             
             # 确保QuestionSet存在
             if not state.question_set:
@@ -193,6 +512,9 @@ class FillInTheBlankGeneratorNode(BaseQuestionGenerator):
             
             # 添加填空题
             state.question_set.fill_in_the_blank = questions
+            if error:
+                # 部分分组失败：保留已生成的题目，失败信息写入输出
+                state.generation_errors = {**state.generation_errors, self.stage: f"填空题部分生成失败: {error}"}
             
             logger.info(f"成功生成 {len(questions)} 道填空题")
             
@@ -204,7 +526,22 @@ class FillInTheBlankGeneratorNode(BaseQuestionGenerator):
         
         return state
     
-    def _parse_fill_blank_response(self, response: str, topic: str) -> List[FillInTheBlankQuestion]:
+    def _parse_response(self, response: str, topic: str, placeholder: bool = True) -> List[FillInTheBlankQuestion]:
+        """解析完整的LLM响应"""
+        return self._parse_fill_blank_response(response, topic, placeholder)
+    
+    def _build_question(self, data: Dict[str, Any], topic: str) -> FillInTheBlankQuestion:
+        """构建并校验一道填空题"""
+        return FillInTheBlankQuestion(
+            question_id=data.get('question_id', self._generate_question_id("fb")),
+            question_text=data['question_text'],
+            blanks=data['blanks'],
+            topic=data.get('topic', topic),
+            difficulty=data.get('difficulty', 'medium'),
+            explanation=data.get('explanation', '')
+        )
+    
+    def _parse_fill_blank_response(self, response: str, topic: str, placeholder: bool = True) -> List[FillInTheBlankQuestion]:
         """解析填空题响应"""
         questions = []
         
@@ -219,20 +556,14 @@ class FillInTheBlankGeneratorNode(BaseQuestionGenerator):
             
             for i, data in enumerate(question_data_list):
                 try:
-                    question = FillInTheBlankQuestion(
-                        question_id=data.get('question_id', self._generate_question_id("fb")),
-                        question_text=data['question_text'],
-                        blanks=data['blanks'],
-                        topic=data.get('topic', topic),
-                        difficulty=data.get('difficulty', 'medium'),
-                        explanation=data.get('explanation', '')
-                    )
-                    questions.append(question)
+                    questions.append(self._build_question(data, topic))
                 except Exception as e:
                     continue
             
         except Exception as e:
             logger.error(f"填空题JSON解析失败: {e}")
+            if not placeholder:
+                raise ValueError(f"填空题JSON解析失败: {e}")
             # 创建一个默认题目
             questions.append(self._create_fallback_fill_blank(topic))
         
@@ -256,6 +587,11 @@ class FillInTheBlankGeneratorNode(BaseQuestionGenerator):
 class MatchingGeneratorNode(BaseQuestionGenerator):
     """连线题生成器节点"""
     
+    stage = "matching"
+    question_model = MatchingQuestion
+    id_prefix = "mt"
+    points_per_question = 6  # 每道连线题4-6对匹配项
+    
     def __init__(self):
         super().__init__()
         self.prompt_template = MatchingPrompt.get_prompt()
@@ -279,23 +615,13 @@ class MatchingGeneratorNode(BaseQuestionGenerator):
             if not state.key_points:
                 return state
             
-            # 选择适合的关键点（后面部分，通常更复杂）
-            start_idx = max(0, len(state.key_points) - 6)
-            selected_points = state.key_points[start_idx:]
+            # 关键点从后面部分开始使用（通常更复杂）
+            start_idx = max(0, len(state.key_points) - self.points_per_question)
             topic = state.topics[0] if state.topics else state.document.title
             
-            # 构建Prompt
-            prompt = self.prompt_template.format(
-                topic=topic,
-                key_points='\n'.join([f"- {point}" for point in selected_points])
-            )
-            
-            # 调用LLM生成题目
+            # 按知识点分组调用LLM生成题目
             logger.info("调用LLM生成连线题...")
-            response = await self.llm_service.invoke_with_fallback(prompt)
-            
-            # 解析响应
-            questions = self._parse_matching_response(response, topic)
+            questions, error = await self._generate_batch(state.key_points, topic, state.deadline, start_idx)
             
             # 确保QuestionSet存在
             if not state.question_set:
@@ -306,6 +632,9 @@ class MatchingGeneratorNode(BaseQuestionGenerator):
             
             # 添加连线题
             state.question_set.matching = questions
+            if error:
+                # 部分分组失败：保留已生成的题目，失败信息写入输出
+                state.generation_errors = {**state.generation_errors, self.stage: f"连线题部分生成失败: {error}"}
             
             logger.info(f"成功生成 {len(questions)} 道连线题")
             
@@ -317,7 +646,37 @@ class MatchingGeneratorNode(BaseQuestionGenerator):
         
         return state
     
-    def _parse_matching_response(self, response: str, topic: str) -> List[MatchingQuestion]:
+    def _parse_response(self, response: str, topic: str, placeholder: bool = True) -> List[MatchingQuestion]:
+        """解析完整的LLM响应"""
+        return self._parse_matching_response(response, topic, placeholder)
+    
+    def _dedupe_key(self, question: MatchingQuestion) -> str:
+        """连线题的题干通常相同，按匹配项去重"""
+        return "|".join(sorted(re.sub(r"[\W_]+", "", item).lower() for item in question.left_items))
+    
+    def _build_question(self, data: Dict[str, Any], topic: str) -> MatchingQuestion:
+        """构建并校验一道连线题"""
+        # 构建MatchingPair对象
+        pairs = []
+        for pair_data in data['correct_pairs']:
+            pair = MatchingPair(
+                left_item=pair_data['left_item'],
+                right_item=pair_data['right_item']
+            )
+            pairs.append(pair)
+        
+        return MatchingQuestion(
+            question_id=data.get('question_id', self._generate_question_id("mt")),
+            question_text=data['question_text'],
+            left_items=data['left_items'],
+            right_items=data['right_items'],
+            correct_pairs=pairs,
+            topic=data.get('topic', topic),
+            difficulty=data.get('difficulty', 'hard'),
+            explanation=data.get('explanation', '')
+        )
+    
+    def _parse_matching_response(self, response: str, topic: str, placeholder: bool = True) -> List[MatchingQuestion]:
         """解析连线题响应"""
         questions = []
         
@@ -332,31 +691,14 @@ class MatchingGeneratorNode(BaseQuestionGenerator):
             
             for i, data in enumerate(question_data_list):
                 try:
-                    # 构建MatchingPair对象
-                    pairs = []
-                    for pair_data in data['correct_pairs']:
-                        pair = MatchingPair(
-                            left_item=pair_data['left_item'],
-                            right_item=pair_data['right_item']
-                        )
-                        pairs.append(pair)
-                    
-                    question = MatchingQuestion(
-                        question_id=data.get('question_id', self._generate_question_id("mt")),
-                        question_text=data['question_text'],
-                        left_items=data['left_items'],
-                        right_items=data['right_items'],
-                        correct_pairs=pairs,
-                        topic=data.get('topic', topic),
-                        difficulty=data.get('difficulty', 'hard'),
-                        explanation=data.get('explanation', '')
-                    )
-                    questions.append(question)
+                    questions.append(self._build_question(data, topic))
                 except Exception as e:
                     continue
             
         except Exception as e:
             logger.error(f"连线题JSON解析失败: {e}")
+            if not placeholder:
+                raise ValueError(f"连线题JSON解析失败: {e}")
             # 创建一个默认题目
             questions.append(self._create_fallback_matching(topic))
         
@@ -0,0 +1,128 @@
+"""
+输出预算模块 - 按阶段估算每次调用的max_tokens，并为题目生成提供提前结束的stop序列
+"""
+import math
+import threading
+from typing import Dict, Any, List, Optional
+
+# 各阶段每个输出单位（生成阶段为知识点，分析阶段为整次调用）的初始token估计
+DEFAULT_TOKENS_PER_ITEM = {
+    "analysis": 1500.0,
+    "multiple_choice": 300.0,
+    "fill_in_the_blank": 250.0,
+    "matching": 200.0,
+}
+FALLBACK_TOKENS_PER_ITEM = 300.0
+
+# 题目数组结束后紧跟代码块结束标记，遇到时停止生成（stop序列本身不会出现在输出中）
+JSON_ARRAY_STOP = "]\n```"
+
+
+class OutputRequest:
+    """一次调用的输出约束"""
+
+    def __init__(self, items: int = 1, max_tokens: Optional[int] = None, stop: Optional[List[str]] = None):
+        self.items = max(1, items)
+        self.max_tokens = max_tokens
+        self.stop = list(stop) if stop else None
+
+    def call_kwargs(self, include_stop: bool = True) -> Dict[str, Any]:
+        """传给LLM调用的参数"""
+        kwargs: Dict[str, Any] = {}
+        if self.max_tokens:
+            kwargs["max_tokens"] = self.max_tokens
+        if include_stop and self.stop:
+            kwargs["stop"] = list(self.stop)
+        return kwargs
+
+
+class OutputBudget:
+    """
+    按阶段自适应的输出token预算
+
+    每个阶段维护"每个输出单位消耗多少token"的指数加权平均，预算 = 估计值 × 单位数 × 余量，
+    并向上取整到固定粒度，避免预算随每次观测抖动。输出因达到上限被截断时估计值立即放大。
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 10000,
+        min_tokens: int = 512,
+        headroom: float = 1.5,
+        quantum: int = 512,
+        alpha: float = 0.2,
+        overhead_tokens: int = 128,
+        truncation_growth: float = 2.0,
+        defaults: Optional[Dict[str, float]] = None
+    ):
+        self.max_tokens = max_tokens
+        self.min_tokens = min(min_tokens, max_tokens)
+        self.headroom = headroom
+        self.quantum = max(1, quantum)
+        self.alpha = alpha
+        self.overhead_tokens = overhead_tokens
+        self.truncation_growth = truncation_growth
+        self._lock = threading.Lock()
+        self._estimates: Dict[str, float] = dict(defaults or DEFAULT_TOKENS_PER_ITEM)
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _stage_stats(self, stage: str) -> Dict[str, int]:
+        return self._stats.setdefault(stage, {"calls": 0, "truncated": 0, "last_budget": 0})
+
+    def estimate(self, stage: str) -> float:
+        """当前每个输出单位的token估计"""
+        with self._lock:
+            return self._estimates.get(stage, FALLBACK_TOKENS_PER_ITEM)
+
+    def budget(self, stage: str, items: int = 1, limit: Optional[int] = None) -> int:
+        """
+        计算一次调用的max_tokens
+
+        Args:
+            stage: 调用阶段
+            items: 预计输出单位数（知识点数）
+            limit: 该阶段的max_tokens上限，为None时使用全局上限
+
+        Returns:
+            按粒度取整并限制在[min_tokens, 上限]内的token数
+        """
+        upper = limit or self.max_tokens
+        expected = self.estimate(stage) * max(1, items) * self.headroom + self.overhead_tokens
+        tokens = int(math.ceil(expected / self.quantum) * self.quantum)
+        tokens = max(min(self.min_tokens, upper), min(upper, tokens))
+        with self._lock:
+            self._stage_stats(stage)["last_budget"] = tokens
+        return tokens
+
+    def observe(self, stage: str, items: int, completion_tokens: int, truncated: bool = False):
+        """
+        记录一次成功调用的实际输出量
+
+        Args:
+            stage: 调用阶段
+            items: 请求的输出单位数
+            completion_tokens: 实际输出token数
+            truncated: 是否因达到max_tokens而截断
+        """
+        per_item = completion_tokens / max(1, items)
+        with self._lock:
+            stats = self._stage_stats(stage)
+            stats["calls"] += 1
+            current = self._estimates.get(stage, FALLBACK_TOKENS_PER_ITEM)
+            if truncated:
+                # 截断时观测值只是下限，直接放大估计
+                stats["truncated"] += 1
+                self._estimates[stage] = max(current, per_item) * self.truncation_growth
+            elif per_item > 0:
+                self._estimates[stage] = current + self.alpha * (per_item - current)
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """各阶段的估计值、最近一次预算和截断次数"""
+        with self._lock:
+            return {
+                stage: {
+                    **stats,
+                    "tokens_per_item": round(self._estimates.get(stage, FALLBACK_TOKENS_PER_ITEM), 1)
+                }
+                for stage, stats in self._stats.items()
+            }
@@ -5,12 +5,14 @@ from .question_prompts import (
     DocumentAnalysisPrompt,
     MultipleChoicePrompt,
     FillInTheBlankPrompt,
-    MatchingPrompt
+    MatchingPrompt,
+    generation_round_hint
 )
 
 __all__ = [
     "DocumentAnalysisPrompt",
     "MultipleChoicePrompt", 
     "FillInTheBlankPrompt",
-    "MatchingPrompt"
+    "MatchingPrompt",
+    "generation_round_hint"
 ] 
\ No newline at end of file
@@ -12,6 +12,30 @@ except ImportError:
         from langchain.prompts.base import BasePromptTemplate
 
 
+# 同一批知识点需要多轮出题时，第2轮起依次使用的考察角度
+GENERATION_ANGLES = ["实际应用", "对比辨析", "因果关系", "常见误区", "细节理解", "综合运用"]
+
+# 追加在题目生成Prompt末尾的多轮出题提示（第1轮不追加，保持Prompt与缓存不变）
+GENERATION_ROUND_HINT = """
+出题角度: {angle}
+这些知识点此前已经出过题，请围绕上述角度重新设计题目，题干和考察点不要与常规题目重复。
+"""
+
+
+def generation_round_hint(round_index: int) -> str:
+    """
+    第round_index轮（从0开始）出题的Prompt补充，第0轮为空
+
+    角度用完后追加轮次，保证每一轮的Prompt不同
+    """
+    if round_index <= 0:
+        return ""
+    angle = GENERATION_ANGLES[(round_index - 1) % len(GENERATION_ANGLES)]
+    if round_index > len(GENERATION_ANGLES):
+        angle = f"{angle}（第{round_index + 1}轮）"
+    return GENERATION_ROUND_HINT.format(angle=angle)
+
+
 class DocumentAnalysisPrompt:
     """文档分析Prompt"""
     
@@ -1,11 +1,20 @@
 """
 题目生成LangGraph工作流
 """
+import time
+import uuid
 import logging
-from typing import Dict, Any
+import contextlib
+from typing import AsyncIterator, Dict, Any, List, Optional, Union
 from langgraph.graph import StateGraph, END
 
 from schemas import GraphState
+from schemas.question_models import merge_question_sets
+from config import get_settings
+from usage_tracking import collect_usage
+from checkpointing import get_checkpointer
+from graph_events import GraphEvent, events_from_update, ERROR, FINISHED
+from tracing import collect_trace, trace_span, annotate, trace_file_path
 from nodes import (
     DocumentProcessorNode,
     DocumentAnalyzerNode,
@@ -17,12 +26,20 @@ from nodes import (
 
 logger = logging.getLogger(__name__)
 
+# 题目生成节点的路由名称及其写入的题型字段
+GENERATOR_ROUTES = {
+    "multiple_choice": "multiple_choice",
+    "fill_blank": "fill_in_the_blank",
+    "matching": "matching"
+}
+
 
 class QuestionGeneratorGraph:
     """题目生成工作流图"""
     
     def __init__(self):
         self.graph = None
+        self.checkpointer = None
         self._initialize_nodes()
         self._build_graph()
     
@@ -63,18 +80,22 @@ class QuestionGeneratorGraph:
             }
         )
         
+        # 分析成功后三个题目生成节点并行执行（它们只读取关键点和主题，写入题目集合的不同字段）
         workflow.add_conditional_edges(
             "document_analyzer", 
             self._route_after_analysis,
             {
-                "generate_questions": "generate_multiple_choice",
+                "multiple_choice": "generate_multiple_choice",
+                "fill_blank": "generate_fill_blank",
+                "matching": "generate_matching",
+                "format": "format_output",
                 "error": "error_handler"
             }
         )
         
-        # 题目生成节点之间的顺序连接
-        workflow.add_edge("generate_multiple_choice", "generate_fill_blank")
-        workflow.add_edge("generate_fill_blank", "generate_matching")
+        # 同一步中的生成节点都完成后再格式化输出（断点续跑时只运行缺少的题型）
+        workflow.add_edge("generate_multiple_choice", "format_output")
+        workflow.add_edge("generate_fill_blank", "format_output")
         workflow.add_edge("generate_matching", "format_output")
         
         # 输出节点到结束
@@ -90,39 +111,82 @@ class QuestionGeneratorGraph:
         # 错误处理节点到结束
         workflow.add_edge("error_handler", END)
         
-        # 编译图
-        self.graph = workflow.compile()
+        # 编译图：启用检查点时每个节点完成后保存状态，按运行ID（thread_id）续跑
+        self.checkpointer = get_checkpointer()
+        self.graph = workflow.compile(checkpointer=self.checkpointer)
     
     # 节点处理函数
     async def _process_document(self, state: GraphState) -> GraphState:
         """文档处理节点"""
         logger.info("执行文档处理节点...")
-        return await self.document_processor.process(state)
+        with trace_span("document_processor", "node", input_chars=len(state.document.content) if state.document else 0):
+            result = await self.document_processor.process(state)
+            annotate(
+                current_step=result.current_step,
+                output_chars=len(result.document.content) if result.document else 0
+            )
+        return result
     
     async def _analyze_document(self, state: GraphState) -> GraphState:
         """文档分析节点"""
         logger.info("执行文档分析节点...")
-        return await self.document_analyzer.process(state)
+        with trace_span("document_analyzer", "node"):
+            result = await self.document_analyzer.process(state)
+            annotate(
+                current_step=result.current_step,
+                topics=len(result.topics),
+                key_points=len(result.key_points),
+                reused=bool(result.analysis_reused_from)
+            )
+        return result
     
-    async def _generate_multiple_choice(self, state: GraphState) -> GraphState:
+    async def _generate_multiple_choice(self, state: GraphState) -> Dict[str, Any]:
         """选择题生成节点"""
         logger.info("执行选择题生成节点...")
-        return await self.mc_generator.process(state)
+        return await self._run_generator("generate_multiple_choice", self.mc_generator, state)
     
-    async def _generate_fill_blank(self, state: GraphState) -> GraphState:
+    async def _generate_fill_blank(self, state: GraphState) -> Dict[str, Any]:
         """填空题生成节点"""
         logger.info("执行填空题生成节点...")
-        return await self.fib_generator.process(state)
+        return await self._run_generator("generate_fill_blank", self.fib_generator, state)
     
-    async def _generate_matching(self, state: GraphState) -> GraphState:
+    async def _generate_matching(self, state: GraphState) -> Dict[str, Any]:
         """连线题生成节点"""
         logger.info("执行连线题生成节点...")
-        return await self.matching_generator.process(state)
+        return await self._run_generator("generate_matching", self.matching_generator, state)
+    
+    async def _run_generator(self, node: str, generator, state: GraphState) -> Dict[str, Any]:
+        """
+        在状态副本上运行一个题目生成器，只返回它负责的更新
+        
+        三个生成器并行执行，不能同时写入current_step等字段；
+        题目集合和失败信息由GraphState中的归并函数合并。
+        """
+        with trace_span(node, "node", stage=generator.stage):
+            branch = state.copy(update={"question_set": None})
+            result = await generator.process(branch)
+            if result.current_step == "error":
+                annotate(error=result.error_message)
+                return {"generation_errors": {generator.stage: result.error_message or "未知错误"}}
+            annotate(questions=result.question_set.total_questions() if result.question_set else 0)
+            update = {}
+            if result.question_set:
+                update["question_set"] = result.question_set
+            if result.generation_errors.get(generator.stage):
+                # 部分分组失败时同时返回题目和失败信息
+                update["generation_errors"] = {generator.stage: result.generation_errors[generator.stage]}
+            return update
     
     async def _format_output(self, state: GraphState) -> GraphState:
         """输出格式化节点"""
         logger.info("执行输出格式化节点...")
-        return await self.output_formatter.process(state)
+        with trace_span("format_output", "node"):
+            result = await self.output_formatter.process(state)
+            annotate(
+                current_step=result.current_step,
+                questions=result.question_set.total_questions() if result.question_set else 0
+            )
+        return result
     
     async def _handle_error(self, state: GraphState) -> GraphState:
         """错误处理节点"""
@@ -140,12 +204,17 @@ class QuestionGeneratorGraph:
         else:
             return "error"
     
-    def _route_after_analysis(self, state: GraphState) -> str:
-        """文档分析后的路由"""
+    def _route_after_analysis(self, state: GraphState) -> Union[str, List[str]]:
+        """文档分析后的路由，成功时同时进入还没有题目的题目生成节点（首次运行时为全部三个）"""
         if state.current_step == "error":
             return "error"
         elif state.current_step == "document_analyzed":
-            return "generate_questions"
+            question_set = state.question_set
+            missing = [
+                route for route, field in GENERATOR_ROUTES.items()
+                if question_set is None or not getattr(question_set, field)
+            ]
+            return missing or "format"
         else:
             return "error"
     
@@ -158,60 +227,203 @@ class QuestionGeneratorGraph:
         else:
             return "error"
     
-    async def run(self, initial_state: GraphState) -> GraphState:
+    async def run(self, initial_state: GraphState, run_id: Optional[str] = None) -> GraphState:
         """
         运行题目生成工作流
         
+        本次运行中的LLM调用记录会被收集，输出格式化节点把汇总写入metadata.llm_usage。
+        启用检查点时每个节点完成后保存状态，失败或进程中断后可以用resume(run_id)继续；
+        全部题型生成成功的运行结束后删除检查点。
+        
         Args:
             initial_state: 初始状态，包含文档信息
+            run_id: 运行ID（可选），不指定时自动生成
             
         Returns:
             最终状态，包含生成的题目
         """
-        try:
-            logger.info("开始运行题目生成工作流...")
-            
-            # 运行图 - 兼容不同版本的API
-            try:
-                # 新版本API
-                result = await self.graph.ainvoke(initial_state)
-                # 确保返回的是GraphState对象
-                if isinstance(result, dict):
-                    final_state = GraphState(**result)
-                else:
-                    final_state = result
-            except AttributeError:
-                # 如果没有ainvoke方法，尝试其他方式
-                try:
-                    # 一些版本使用invoke
-                    result = self.graph.invoke(initial_state)
-                    if isinstance(result, dict):
-                        final_state = GraphState(**result)
-                    else:
-                        final_state = result
-                except AttributeError:
-                    # 使用流式处理
-                    final_state = initial_state
-                    async for state in self.graph.astream(initial_state):
-                        if isinstance(state, dict):
-                            final_state = GraphState(**state)
-                        else:
-                            final_state = state
+        return await self._final_state(self.astream_run(initial_state, run_id=run_id))
+    
+    async def astream_run(self, initial_state: GraphState, run_id: Optional[str] = None) -> AsyncIterator[GraphEvent]:
+        """
+        流式运行题目生成工作流，每个节点完成后立即产生事件
+        
+        事件依次为document_processed、analysis_ready、每个题型的questions_ready（或generation_failed，
+        按完成先后）、output_ready，失败时为error；最后一个事件总是finished，带有最终状态。
+        
+        Args:
+            initial_state: 初始状态，包含文档信息
+            run_id: 运行ID（可选），不指定时自动生成
             
-            if final_state.current_step == "completed":
-                pass  # 成功完成，静默处理
-            elif final_state.current_step in ["error", "error_handled"]:
-                logger.error(f"题目生成工作流失败: {final_state.error_message}")
-            else:
-                pass  # 未知状态，静默处理
+        Yields:
+            GraphEvent
+        """
+        if initial_state.run_id is None:
+            initial_state.run_id = run_id or uuid.uuid4().hex
+        self._set_deadline(initial_state)
+        config = self._run_config(initial_state.run_id)
+        with collect_usage():
+            async for event in self._stream_graph(initial_state, config, initial_state):
+                yield event
+    
+    async def resume(self, run_id: str) -> GraphState:
+        """
+        从检查点继续一次未完成的运行
+        
+        已完成的节点不会重新执行：文档分析完成后中断的运行只重新生成缺少的题型，
+        已生成的题目（包括中断前同一步中已完成的生成节点）直接保留。
+        
+        Args:
+            run_id: 要继续的运行ID
             
-            return final_state
+        Returns:
+            最终状态
             
+        Raises:
+            ValueError: 未启用检查点或没有该运行的检查点
+        """
+        return await self._final_state(self.astream_resume(run_id))
+    
+    async def astream_resume(self, run_id: str) -> AsyncIterator[GraphEvent]:
+        """
+        流式地从检查点继续一次未完成的运行，事件与astream_run相同（已完成的节点不再产生事件）
+        
+        Raises:
+            ValueError: 未启用检查点或没有该运行的检查点
+        """
+        if self.checkpointer is None:
+            raise ValueError("未启用工作流检查点，无法继续运行")
+        config = self._run_config(run_id)
+        snapshot = await self.graph.aget_state(config)
+        if not snapshot.values:
+            raise ValueError(f"没有找到运行 {run_id} 的检查点")
+        
+        state = GraphState(**snapshot.values)
+        if not snapshot.next and state.current_step == "completed" and not state.generation_errors:
+            logger.info(f"运行 {run_id} 已经完成")
+            yield GraphEvent(FINISHED, run_id=run_id, state=state)
+            return
+        
+        # 中断前同一步中已完成的生成节点的结果保存在检查点的待写入记录中
+        question_set = state.question_set
+        for task in snapshot.tasks:
+            if isinstance(task.result, dict) and task.result.get("question_set"):
+                question_set = merge_question_sets(question_set, task.result["question_set"])
+        
+        self._set_deadline(state, refresh=True)
+        updates = {
+            "deadline": state.deadline,
+            "error_message": None,
+            "run_id": run_id,
+            "question_set": question_set,
+            "generation_errors": {stage: None for stage in state.generation_errors}
+        }
+        if state.key_points:
+            # 分析已完成：从文档分析之后继续，只生成缺少的题型
+            updates["current_step"] = "document_analyzed"
+            as_node = "document_analyzer"
+        elif state.document is not None and state.document.metadata.get("processed"):
+            updates["current_step"] = "document_processed"
+            as_node = "document_processor"
+        else:
+            raise ValueError(f"运行 {run_id} 在文档处理阶段失败（{state.error_message}），请检查输入文档后重新运行")
+        
+        logger.info(f"从 {as_node} 之后继续运行 {run_id}...")
+        await self.graph.aupdate_state(config, updates, as_node=as_node)
+        with collect_usage():
+            async for event in self._stream_graph(None, config, state):
+                yield event
+    
+    async def _final_state(self, events: AsyncIterator[GraphEvent]) -> GraphState:
+        """消费事件流，返回finished事件中的最终状态"""
+        final_state = None
+        async for event in events:
+            if event.type == FINISHED:
+                final_state = event.state
+        return final_state
+    
+    def _run_config(self, run_id: str) -> Dict[str, Any]:
+        return {"configurable": {"thread_id": run_id}}
+    
+    def _set_deadline(self, state: GraphState, refresh: bool = False):
+        """为文档设置时间预算，LLM重试和退避不会超过该截止时间；续跑时重新计算"""
+        budget = get_settings().document_deadline_seconds
+        if (state.deadline is None or refresh) and budget and budget > 0:
+            state.deadline = time.time() + budget
+    
+    async def _finish_run(self, final_state: GraphState):
+        """全部题型都生成成功的运行删除检查点，失败或部分失败的运行保留以便续跑（按运行数上限和存活时间清理）"""
+        if self.checkpointer is None or not final_state.run_id:
+            return
+        try:
+            if final_state.current_step == "completed" and not final_state.generation_errors:
+                await self.checkpointer.adelete_thread(final_state.run_id)
+            else:
+                settings = get_settings()
+                await self.checkpointer.aprune(settings.graph_checkpoint_max_runs, settings.graph_checkpoint_ttl_seconds)
         except Exception as e:
-            logger.error(f"工作流运行异常: {e}")
-            initial_state.error_message = str(e)
-            initial_state.current_step = "error"
-            return initial_state
+            logger.warning(f"清理运行 {final_state.run_id} 的检查点失败: {e}")
+    
+    async def _stream_graph(
+        self,
+        initial_state: Optional[GraphState],
+        config: Dict[str, Any],
+        fallback_state: GraphState
+    ) -> AsyncIterator[GraphEvent]:
+        """
+        流式运行工作流图，把节点的状态更新转换为事件
+        
+        同时订阅updates（每个节点完成时的写入）和values（每一步之后的完整状态），
+        后者的最后一个值就是最终状态。initial_state为None时从config指定运行的检查点继续。
+        """
+        run_id = fallback_state.run_id
+        started = time.time()
+        final_state = fallback_state
+        settings = get_settings()
+        # 启用追踪时收集本次运行的节点、LLM调用和解析校验span
+        trace_context = (
+            collect_trace("resume" if initial_state is None else "run", run_id=run_id)
+            if settings.trace_dir else contextlib.nullcontext()
+        )
+        with trace_context as trace:
+            try:
+                logger.info("开始运行题目生成工作流...")
+                
+                async for mode, chunk in self.graph.astream(initial_state, config, stream_mode=["updates", "values"]):
+                    if mode == "values":
+                        final_state = GraphState(**chunk) if isinstance(chunk, dict) else chunk
+                        continue
+                    for node, update in chunk.items():
+                        for event_type, data in events_from_update(node, update):
+                            yield GraphEvent(event_type, node=node, data=data, run_id=run_id, elapsed=time.time() - started)
+                
+                if final_state.current_step in ["error", "error_handled"]:
+                    logger.error(f"题目生成工作流失败: {final_state.error_message}")
+                
+            except Exception as e:
+                logger.error(f"工作流运行异常: {e}")
+                final_state.error_message = str(e)
+                final_state.current_step = "error"
+                yield GraphEvent(ERROR, data={"error": str(e)}, run_id=run_id, elapsed=time.time() - started)
+            annotate(current_step=final_state.current_step)
+        
+        data = {}
+        if trace is not None:
+            # 续跑的追踪单独保存，不覆盖首次运行的追踪
+            name = run_id if initial_state is not None else f"{run_id}-resume-{int(started)}"
+            data["trace_file"] = self._write_trace(trace, name)
+        await self._finish_run(final_state)
+        yield GraphEvent(FINISHED, data=data, run_id=run_id, elapsed=time.time() - started, state=final_state)
+    
+    def _write_trace(self, trace, name: str) -> Optional[str]:
+        """把本次运行的追踪写入trace_dir，返回文件路径"""
+        settings = get_settings()
+        path = trace_file_path(settings.trace_dir, name, settings.trace_format)
+        try:
+            return trace.write(path, settings.trace_format)
+        except OSError as e:
+            logger.error(f"追踪文件写入失败: {e}")
+            return None
     
     def get_graph_visualization(self) -> str:
         """
@@ -228,11 +440,13 @@ graph TD
     
     C --> D{Analysis OK?}
     D -->|Yes| E[Generate Multiple Choice]
+    D -->|Yes| F[Generate Fill-in-the-Blank]
+    D -->|Yes| G[Generate Matching]
     D -->|No| H
     
-    E --> F[Generate Fill-in-the-Blank]
-    F --> G[Generate Matching]
-    G --> I[Format Output]
+    E --> I[Format Output]
+    F --> I
+    G --> I
     
     I --> J{Formatting OK?}
     J -->|Yes| K[End]
@@ -286,6 +500,16 @@ graph TD
             if state.question_set.matching:
                 status["generate_matching"] = "completed"
         
+        # 并行生成时单个题型失败不影响其他题型
+        generator_nodes = {
+            "multiple_choice": "generate_multiple_choice",
+            "fill_in_the_blank": "generate_fill_blank",
+            "matching": "generate_matching"
+        }
+        for stage in state.generation_errors:
+            if stage in generator_nodes:
+                status[generator_nodes[stage]] = "error"
+        
         if current_step == "completed":
             status["format_output"] = "completed"
         
@@ -424,7 +648,8 @@ graph TD
         print("-" * 40)
         conditions = [
             ("document_processor", "处理成功? → 文档分析器 | 错误处理器"),
-            ("document_analyzer", "分析成功? → 选择题生成器 | 错误处理器"), 
+            ("document_analyzer", "分析成功? → 选择题/填空题/连线题生成器（并行） | 错误处理器"),
+            ("三个生成器", "全部完成后 → 输出格式化器（断点续跑时只运行缺少题目的生成器）"),
             ("format_output", "格式化成功? → 结束 | 错误处理器")
         ]
         
@@ -0,0 +1,246 @@
+"""
+限流模块 - 令牌桶限速 + AIMD自适应并发
+"""
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Dict, Any, Optional
+
+
+class TokenBucket:
+    """令牌桶，rate为每秒补充的令牌数，capacity为桶容量（允许的突发量）"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _try_take(self, amount: float) -> float:
+        """尝试取出令牌，成功返回0，否则返回还需等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0.0
+            return (amount - self._tokens) / self.rate
+
+    async def acquire(self, amount: float = 1.0) -> float:
+        """取出令牌，令牌不足时异步等待；返回等待的总秒数"""
+        if self.rate <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            wait = self._try_take(amount)
+            if wait <= 0:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def charge(self, amount: float):
+        """事后扣除令牌（例如调用完成后才知道的输出token数），允许透支"""
+        if self.rate <= 0 or amount <= 0:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+
+    @property
+    def available(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD自适应并发限制
+
+    调用遇到限流或超时时并发上限乘性减小；延迟保持在基线的latency_tolerance倍以内时
+    每完成约一轮调用上限加一。基线为观察到的最低延迟的平滑值。
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        minimum: int = 1,
+        maximum: int = 32,
+        backoff_ratio: float = 0.5,
+        latency_tolerance: float = 2.0
+    ):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(self.maximum, max(self.minimum, initial)))
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+
+        self.in_flight = 0
+        self._waiters: deque = deque()
+        self._baseline: Optional[float] = None
+        self._ewma: Optional[float] = None
+
+    async def acquire(self):
+        """获取一个并发名额，达到上限时排队等待"""
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # 已被唤醒却被取消时把名额传给下一个等待者
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+
+    def release(self, latency: Optional[float] = None, overloaded: bool = False):
+        """归还名额并根据本次调用结果调整并发上限"""
+        self.in_flight = max(0, self.in_flight - 1)
+        if overloaded:
+            self.limit = max(self.minimum, self.limit * self.backoff_ratio)
+        elif latency is not None:
+            self._observe(latency)
+            if self._ewma <= self._baseline * self.latency_tolerance:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+        self._wake()
+
+    def _observe(self, latency: float):
+        self._ewma = latency if self._ewma is None else 0.8 * self._ewma + 0.2 * latency
+        if self._baseline is None or latency < self._baseline:
+            self._baseline = latency
+        else:
+            # 基线缓慢上浮，避免一次极低延迟永久压低基线
+            self._baseline = 0.99 * self._baseline + 0.01 * latency
+
+    def _wake(self):
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+
+class ProviderRateLimiter:
+    """
+    单个提供商的限流器
+
+    请求依次经过QPS令牌桶、TPM令牌桶和自适应并发限制；记录排队延迟供批量规模调优。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        qps: float = 0,
+        tpm: float = 0,
+        concurrency: Optional[AdaptiveConcurrencyLimiter] = None
+    ):
+        self.name = name
+        self.request_bucket = TokenBucket(qps, capacity=max(1.0, qps)) if qps > 0 else None
+        self.token_bucket = TokenBucket(tpm / 60.0, capacity=tpm) if tpm > 0 else None
+        self.concurrency = concurrency or AdaptiveConcurrencyLimiter()
+        # 正在等待并发名额或令牌的调用数
+        self.waiting = 0
+
+        self.stats: Dict[str, float] = {
+            "requests": 0,
+            "throttled": 0,
+            "overloaded": 0,
+            "total_queue_delay": 0.0,
+            "max_queue_delay": 0.0
+        }
+
+    def slot(self, tokens: float = 0) -> "RateLimitSlot":
+        """获取调用名额的异步上下文管理器"""
+        return RateLimitSlot(self, tokens)
+
+    def saturated(self) -> bool:
+        """新请求是否需要排队：已有调用在等待、并发已满或QPS令牌已用完"""
+        if self.waiting > 0 or self.concurrency.in_flight >= int(self.concurrency.limit):
+            return True
+        return bool(self.request_bucket) and self.request_bucket.available < 1
+
+    def charge_tokens(self, tokens: float):
+        """调用完成后补扣输出token"""
+        if self.token_bucket:
+            self.token_bucket.charge(tokens)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取当前限制和排队情况"""
+        requests = self.stats["requests"]
+        return {
+            "concurrency_limit": int(self.concurrency.limit),
+            "in_flight": self.concurrency.in_flight,
+            "queued": self.concurrency.queued,
+            "qps_limit": self.request_bucket.rate if self.request_bucket else None,
+            "tpm_limit": self.token_bucket.capacity if self.token_bucket else None,
+            "avg_queue_delay": self.stats["total_queue_delay"] / requests if requests else 0.0,
+            **self.stats
+        }
+
+
+class RateLimitSlot:
+    """一次调用占用的限流名额，调用失败属于限流或超时时应设置overloaded"""
+
+    def __init__(self, limiter: ProviderRateLimiter, tokens: float):
+        self.limiter = limiter
+        self.tokens = tokens
+        self.overloaded = False
+        self.queue_delay = 0.0
+        self._started = 0.0
+
+    async def __aenter__(self) -> "RateLimitSlot":
+        limiter = self.limiter
+        queued_at = time.monotonic()
+        limiter.waiting += 1
+        try:
+            await limiter.concurrency.acquire()
+            try:
+                if limiter.request_bucket:
+                    await limiter.request_bucket.acquire(1)
+                if limiter.token_bucket and self.tokens > 0:
+                    await limiter.token_bucket.acquire(self.tokens)
+            except BaseException:
+                limiter.concurrency.release()
+                raise
+        finally:
+            limiter.waiting -= 1
+        self._started = time.monotonic()
+        self.queue_delay = self._started - queued_at
+
+        stats = limiter.stats
+        stats["requests"] += 1
+        stats["total_queue_delay"] += self.queue_delay
+        stats["max_queue_delay"] = max(stats["max_queue_delay"], self.queue_delay)
+        if self.queue_delay > 0.001:
+            stats["throttled"] += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is asyncio.CancelledError:
+            self.limiter.concurrency.release()
+            return False
+        if self.overloaded:
+            self.limiter.stats["overloaded"] += 1
+            self.limiter.concurrency.release(overloaded=True)
+        elif exc_type is not None:
+            # 普通错误不代表容量不足，不参与并发调整
+            self.limiter.concurrency.release()
+        else:
+            self.limiter.concurrency.release(latency=time.monotonic() - self._started)
+        return False
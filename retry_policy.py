@@ -0,0 +1,206 @@
+"""
+重试策略模块 - 错误分类、带抖动的指数退避、Retry-After和截止时间
+"""
+import re
+import time
+import random
+import asyncio
+from enum import Enum
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+
+class ErrorKind(str, Enum):
+    """LLM调用错误分类"""
+    RETRYABLE = "retryable"  # 超时、连接错误、5xx，可以退避后重试
+    RATE_LIMITED = "rate_limited"  # 429限流，优先按Retry-After等待后重试
+    FATAL = "fatal"  # 认证失败、请求无效等，重试同一提供商没有意义
+
+
+class DeadlineExceededError(asyncio.TimeoutError):
+    """文档的时间预算已用完"""
+
+
+# 不可重试的HTTP状态码
+FATAL_STATUS_CODES = {400, 401, 403, 404, 405, 409, 413, 422}
+# 表示提供商本身不可用（密钥无效、无权限）的状态码，遇到时直接熔断
+PROVIDER_FATAL_STATUS_CODES = {401, 403}
+
+RATE_LIMIT_MARKERS = ("rate limit", "ratelimit", "too many requests", "throttl")
+# 额度耗尽虽然也返回429，但等待并不能恢复
+QUOTA_MARKERS = ("insufficient_quota", "exceeded your current quota", "arrearage")
+TIMEOUT_MARKERS = ("timeout", "timed out")
+FATAL_MARKERS = (
+    "invalid api key", "incorrect api key", "invalid_api_key", "authentication",
+    "unauthorized", "permission denied", "invalidapikey", "access denied"
+)
+
+
+def error_status_code(error: Exception) -> Optional[int]:
+    """从异常或其HTTP响应中读取状态码"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is None:
+        # dashscope SDK把状态码放在status_code以外的属性中
+        status = getattr(error, "code", None)
+    try:
+        return int(status)
+    except (TypeError, ValueError):
+        pass
+    # 部分SDK只在消息中给出状态码，例如"Error code: 429 - ..."
+    match = re.search(r"error code:?\s*(\d{3})", str(error), re.IGNORECASE)
+    return int(match.group(1)) if match else None
+
+
+def is_timeout_error(error: Exception) -> bool:
+    """判断错误是否为超时"""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)) and not isinstance(error, DeadlineExceededError):
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in TIMEOUT_MARKERS)
+
+
+def classify_error(error: Exception) -> ErrorKind:
+    """
+    对LLM调用错误分类
+
+    Args:
+        error: 调用抛出的异常
+
+    Returns:
+        错误类型，未能识别的错误按可重试处理
+    """
+    if isinstance(error, DeadlineExceededError):
+        return ErrorKind.FATAL
+
+    status = error_status_code(error)
+    text = f"{type(error).__name__} {error}".lower()
+
+    if any(marker in text for marker in QUOTA_MARKERS):
+        return ErrorKind.FATAL
+    if status == 429 or any(marker in text for marker in RATE_LIMIT_MARKERS):
+        return ErrorKind.RATE_LIMITED
+    if status in FATAL_STATUS_CODES:
+        return ErrorKind.FATAL
+    if status is not None and status >= 500:
+        return ErrorKind.RETRYABLE
+    if any(marker in text for marker in FATAL_MARKERS):
+        return ErrorKind.FATAL
+    return ErrorKind.RETRYABLE
+
+
+def is_provider_fatal(error: Exception) -> bool:
+    """错误是否说明提供商本身不可用（而不只是本次请求无效）"""
+    status = error_status_code(error)
+    if status in PROVIDER_FATAL_STATUS_CODES:
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in FATAL_MARKERS + QUOTA_MARKERS)
+
+
+def is_overload_error(error: Exception) -> bool:
+    """判断错误是否表示提供商过载（限流或超时），用于自适应并发调整"""
+    return classify_error(error) == ErrorKind.RATE_LIMITED or is_timeout_error(error)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """读取错误响应中的Retry-After（支持秒数、HTTP日期和retry-after-ms）"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers is None:
+        headers = getattr(error, "headers", None)
+    if not headers:
+        return None
+
+    try:
+        value = headers.get("retry-after-ms")
+        if value is not None:
+            return max(0.0, float(value) / 1000.0)
+        value = headers.get("retry-after")
+    except AttributeError:
+        return None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def remaining_seconds(deadline: Optional[float]) -> Optional[float]:
+    """距离截止时间（time.time()时间戳）的剩余秒数，没有截止时间时返回None"""
+    if deadline is None:
+        return None
+    return deadline - time.time()
+
+
+class RetryPolicy:
+    """
+    重试策略
+
+    可重试错误按指数退避加全抖动等待；限流错误优先使用服务端给出的Retry-After。
+    退避时间超过剩余预算时不再重试。
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 20.0,
+        multiplier: float = 2.0,
+        max_retry_after: float = 60.0,
+        rng: Optional[random.Random] = None
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.max_retry_after = max_retry_after
+        self._rng = rng or random.Random()
+
+    def backoff(self, attempt: int, error: Optional[Exception] = None) -> float:
+        """
+        计算第attempt次失败（从1开始）之后的等待时间
+
+        Args:
+            attempt: 已失败的次数
+            error: 本次失败的异常
+
+        Returns:
+            等待秒数
+        """
+        ceiling = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        delay = self._rng.uniform(0, ceiling)
+        if error is not None and classify_error(error) == ErrorKind.RATE_LIMITED:
+            retry_after = retry_after_seconds(error)
+            if retry_after is not None:
+                # 服务端明确要求的等待时间优先，附加少量抖动避免同时重试
+                delay = min(retry_after, self.max_retry_after) + self._rng.uniform(0, self.base_delay)
+            else:
+                # 限流没有给出Retry-After时至少等待一个完整的退避上限
+                delay = ceiling + delay
+        return delay
+
+    def next_delay(self, attempt: int, error: Exception, deadline: Optional[float] = None) -> Optional[float]:
+        """
+        决定是否重试
+
+        Args:
+            attempt: 已失败的次数
+            error: 本次失败的异常
+            deadline: 截止时间戳
+
+        Returns:
+            重试前的等待秒数；不应重试时返回None
+        """
+        if attempt >= self.max_attempts or classify_error(error) == ErrorKind.FATAL:
+            return None
+        delay = self.backoff(attempt, error)
+        remaining = remaining_seconds(deadline)
+        if remaining is not None and delay >= remaining:
+            return None
+        return delay
@@ -0,0 +1,126 @@
+"""
+端点路由模块 - 按权重、实时延迟和错误率在多个LLM端点之间分配请求
+"""
+import random
+import threading
+from typing import Dict, Any, List, Optional, Sequence
+
+# 错误率对得分的惩罚指数：错误率50%时得分降为1/4
+ERROR_PENALTY_EXPONENT = 2.0
+# 错误率按不超过该值计算，持续失败的端点仍保留少量流量，恢复后可以重新积累得分
+MAX_ERROR_RATE = 0.9
+# 需要排队（并发已满或QPS令牌用完）的端点仍可作为后备，但得分按该系数折减
+SATURATED_FACTOR = 0.1
+
+
+class EndpointStats:
+    """单个端点的延迟和错误率指数加权平均"""
+
+    def __init__(self, weight: float = 1.0):
+        self.weight = max(0.0, weight)
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.selected = 0
+
+
+class WeightedRouter:
+    """
+    加权路由
+
+    端点得分 = 配置权重 / 延迟EWMA × (1 - 错误率EWMA)^2，需要排队的端点再折减。
+    每次请求按得分做不放回的加权随机抽样得到尝试顺序：第一个端点承担请求，
+    其余端点作为失败时的后备。尚无延迟样本的端点按已知端点的平均延迟计算，保证新端点能分到流量。
+    """
+
+    def __init__(self, alpha: float = 0.2, rng: Optional[random.Random] = None):
+        self.alpha = alpha
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._endpoints: Dict[str, EndpointStats] = {}
+
+    def register(self, name: str, weight: float = 1.0):
+        """登记端点及其配置权重"""
+        with self._lock:
+            self._endpoints[name] = EndpointStats(weight)
+
+    def record(self, name: str, latency: float, error: bool = False):
+        """
+        记录一次调用结果
+
+        Args:
+            name: 端点名称
+            latency: 调用耗时（秒）
+            error: 是否失败；失败调用的耗时不计入延迟
+        """
+        with self._lock:
+            stats = self._endpoints.get(name)
+            if stats is None:
+                return
+            stats.calls += 1
+            stats.error_rate += self.alpha * ((1.0 if error else 0.0) - stats.error_rate)
+            if error:
+                stats.errors += 1
+            elif stats.latency is None:
+                stats.latency = latency
+            else:
+                stats.latency += self.alpha * (latency - stats.latency)
+
+    def _score(self, stats: EndpointStats, default_latency: float, saturated: bool) -> float:
+        latency = max(stats.latency if stats.latency is not None else default_latency, 1e-3)
+        score = stats.weight / latency * (1.0 - min(stats.error_rate, MAX_ERROR_RATE)) ** ERROR_PENALTY_EXPONENT
+        return score * SATURATED_FACTOR if saturated else score
+
+    def order(self, providers: Sequence[Any]) -> List[Any]:
+        """
+        计算本次请求的端点尝试顺序
+
+        Args:
+            providers: LLMProvider列表（使用name属性，limiter用于判断是否需要排队）
+
+        Returns:
+            按加权随机抽样排列的提供商列表；未登记的提供商排在最后
+        """
+        with self._lock:
+            known = [stats.latency for stats in self._endpoints.values() if stats.latency is not None]
+            default_latency = sum(known) / len(known) if known else 1.0
+            candidates = []
+            others = []
+            for provider in providers:
+                stats = self._endpoints.get(provider.name)
+                if stats is None or stats.weight <= 0:
+                    others.append(provider)
+                    continue
+                limiter = getattr(provider, "limiter", None)
+                saturated = bool(limiter) and limiter.saturated()
+                candidates.append([provider, self._score(stats, default_latency, saturated)])
+
+            ordered = []
+            while candidates:
+                total = sum(score for _, score in candidates)
+                pick = self._rng.uniform(0, total) if total > 0 else 0.0
+                index = 0
+                for index, (_, score) in enumerate(candidates):
+                    pick -= score
+                    if pick <= 0:
+                        break
+                ordered.append(candidates.pop(index)[0])
+            if ordered:
+                self._endpoints[ordered[0].name].selected += 1
+            return ordered + others
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """各端点的权重、延迟、错误率和被选为首选的次数"""
+        with self._lock:
+            return {
+                name: {
+                    "weight": stats.weight,
+                    "latency": round(stats.latency, 3) if stats.latency is not None else None,
+                    "error_rate": round(stats.error_rate, 3),
+                    "calls": stats.calls,
+                    "errors": stats.errors,
+                    "selected": stats.selected
+                }
+                for name, stats in self._endpoints.items()
+            }
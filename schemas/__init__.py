@@ -12,6 +12,7 @@ from .question_models import (
     DocumentContent,
     GraphState
 )
+from .output_schemas import question_item_schema, question_output_tool
 
 __all__ = [
     "QuestionType",
@@ -22,5 +23,7 @@ __all__ = [
     "MatchingPair",
     "QuestionSet",
     "DocumentContent",
-    "GraphState"
+    "GraphState",
+    "question_item_schema",
+    "question_output_tool"
 ] 
\ No newline at end of file
@@ -0,0 +1,106 @@
+"""
+结构化输出Schema - 由题目模型推导LLM输出的JSON Schema，用于JSON模式和函数调用
+"""
+import copy
+from typing import Dict, Any, Type
+
+from .question_models import BaseQuestion, FillInTheBlankQuestion
+
+# 由系统填写、不需要LLM输出的字段
+SYSTEM_FIELDS = ("question_id", "question_type")
+
+# 模型中类型过于宽泛的字段，补充具体结构
+FIELD_OVERRIDES: Dict[Type[BaseQuestion], Dict[str, Dict[str, Any]]] = {
+    FillInTheBlankQuestion: {
+        "blanks": {
+            "type": "array",
+            "description": "空白处信息",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "position": {"type": "integer", "description": "空白序号，从1开始"},
+                    "correct_answer": {"type": "string", "description": "正确答案"},
+                    "hint": {"type": "string", "description": "提示"}
+                },
+                "required": ["position", "correct_answer"]
+            }
+        }
+    }
+}
+
+
+def _model_schema(model: Type[BaseQuestion]) -> Dict[str, Any]:
+    """兼容Pydantic v1/v2获取模型的JSON Schema"""
+    if hasattr(model, "model_json_schema"):
+        return model.model_json_schema()
+    return model.schema()
+
+
+def _inline_refs(node: Any, definitions: Dict[str, Any]) -> Any:
+    """展开$ref引用并去掉title，部分提供商的函数调用不支持$defs"""
+    if isinstance(node, list):
+        return [_inline_refs(item, definitions) for item in node]
+    if not isinstance(node, dict):
+        return node
+    ref = node.get("$ref")
+    if ref:
+        name = ref.rsplit("/", 1)[-1]
+        return _inline_refs(copy.deepcopy(definitions.get(name, {})), definitions)
+    return {
+        key: _inline_refs(value, definitions)
+        for key, value in node.items()
+        if key not in ("title", "$defs", "definitions")
+    }
+
+
+def question_item_schema(model: Type[BaseQuestion]) -> Dict[str, Any]:
+    """
+    单道题目的输出Schema
+
+    Args:
+        model: 题目模型类
+
+    Returns:
+        去掉系统字段、展开引用后的JSON Schema
+    """
+    schema = _model_schema(model)
+    definitions = {**schema.get("definitions", {}), **schema.get("$defs", {})}
+    properties = {
+        name: _inline_refs(value, definitions)
+        for name, value in schema.get("properties", {}).items()
+        if name not in SYSTEM_FIELDS
+    }
+    properties.update(copy.deepcopy(FIELD_OVERRIDES.get(model, {})))
+    required = [name for name in schema.get("required", []) if name in properties]
+    return {"type": "object", "properties": properties, "required": required}
+
+
+def question_output_tool(model: Type[BaseQuestion], name: str, description: str) -> Dict[str, Any]:
+    """
+    题目生成的函数调用定义（OpenAI function格式）
+
+    JSON模式要求顶层为对象，因此题目列表统一包装在questions字段中。
+
+    Args:
+        model: 题目模型类
+        name: 函数名称
+        description: 函数描述
+
+    Returns:
+        {"name", "description", "parameters"}
+    """
+    return {
+        "name": name,
+        "description": description,
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "questions": {
+                    "type": "array",
+                    "description": "生成的题目列表",
+                    "items": question_item_schema(model)
+                }
+            },
+            "required": ["questions"]
+        }
+    }
@@ -2,7 +2,7 @@
 题目数据模型定义
 """
 from enum import Enum
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Union, Annotated
 from pydantic import BaseModel, Field, validator
 
 
@@ -114,14 +114,46 @@ class QuestionSet(BaseModel):
         }
 
 
+def merge_question_sets(left: Optional[QuestionSet], right: Optional[QuestionSet]) -> Optional[QuestionSet]:
+    """
+    合并并行生成器写入的题目集合
+
+    每个生成器只填写自己的题型，合并时保留双方非空的题目列表，生成时间取较早的一个。
+    """
+    if left is None:
+        return right
+    if right is None or right is left:
+        return left
+    return QuestionSet(
+        document_title=left.document_title,
+        multiple_choice=right.multiple_choice or left.multiple_choice,
+        fill_in_the_blank=right.fill_in_the_blank or left.fill_in_the_blank,
+        matching=right.matching or left.matching,
+        generated_at=min(left.generated_at, right.generated_at)
+    )
+
+
+def merge_generation_errors(left: Optional[Dict[str, str]], right: Optional[Dict[str, str]]) -> Dict[str, str]:
+    """合并并行生成器的错误信息（题型 -> 错误），值为None表示清除该题型的错误（断点续跑时重新生成）"""
+    merged = {**(left or {}), **(right or {})}
+    return {stage: error for stage, error in merged.items() if error is not None}
+
+
 class GraphState(BaseModel):
     """LangGraph状态模型"""
     document: Optional[DocumentContent] = Field(None, description="输入文档")
     key_points: List[str] = Field(default_factory=list, description="提取的关键点")
     topics: List[str] = Field(default_factory=list, description="文档主题")
-    question_set: Optional[QuestionSet] = Field(None, description="生成的题目集合")
+    # 三个题目生成器并行写入，由归并函数合并各自的结果
+    question_set: Annotated[Optional[QuestionSet], merge_question_sets] = Field(None, description="生成的题目集合")
+    generation_errors: Annotated[Dict[str, str], merge_generation_errors] = Field(
+        default_factory=dict, description="生成失败的题型及错误信息"
+    )
     current_step: str = Field(default="start", description="当前处理步骤")
     error_message: Optional[str] = Field(None, description="错误信息")
+    deadline: Optional[float] = Field(None, description="处理截止时间（Unix时间戳），LLM重试不会超过该时间")
+    analysis_reused_from: Optional[Dict[str, Any]] = Field(None, description="复用的近似重复文档分析（标题、指纹差异位数）")
+    run_id: Optional[str] = Field(None, description="运行ID，检查点按该ID保存，用于断点续跑")
     
     class Config:
         arbitrary_types_allowed = True 
\ No newline at end of file
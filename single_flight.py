@@ -0,0 +1,91 @@
+"""
+请求合并模块 - 相同的LLM请求正在进行时，后到的调用等待同一个上游请求的结果
+"""
+import asyncio
+import hashlib
+import json
+import threading
+from typing import Dict, Any, Awaitable, Callable, Optional, Tuple
+
+
+class _Flight:
+    """一个进行中的上游请求及其等待者数量"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    按请求键合并并发的相同调用
+
+    第一个调用（leader）以独立任务发出上游请求，之后相同键的调用直接等待该任务。
+    某个等待者被取消或超时只影响它自己；所有等待者都离开后上游请求才会被取消。
+    请求完成后立即从表中移除，已完成的响应由缓存负责。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Tuple[int, str], _Flight] = {}
+        self._stats = {"leaders": 0, "coalesced": 0}
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """根据请求参数计算合并键"""
+        payload = json.dumps(parts, ensure_ascii=False, separators=(",", ":"), sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def run(
+        self,
+        key: str,
+        factory: Callable[[], Awaitable[Any]],
+        timeout: Optional[float] = None
+    ) -> Tuple[Any, bool]:
+        """
+        执行或加入一个请求
+
+        Args:
+            key: 合并键
+            factory: 发出上游请求的协程工厂，只有leader会调用
+            timeout: 本次调用最多等待的秒数
+
+        Returns:
+            (请求结果, 是否为合并的调用)
+        """
+        loop = asyncio.get_running_loop()
+        # 任务只能在创建它的事件循环中等待
+        flight_key = (id(loop), key)
+        with self._lock:
+            flight = self._flights.get(flight_key)
+            coalesced = flight is not None
+            if flight is None:
+                flight = _Flight(asyncio.ensure_future(factory()))
+                self._flights[flight_key] = flight
+                flight.task.add_done_callback(lambda _: self._forget(flight_key, flight))
+                self._stats["leaders"] += 1
+            else:
+                self._stats["coalesced"] += 1
+            flight.waiters += 1
+
+        try:
+            waiter = asyncio.shield(flight.task)
+            result = await (asyncio.wait_for(waiter, timeout) if timeout is not None else waiter)
+            return result, coalesced
+        finally:
+            with self._lock:
+                flight.waiters -= 1
+                if flight.waiters == 0 and not flight.task.done():
+                    # 没有调用再等待结果，取消上游请求；先移出表，之后的相同调用重新发起
+                    self._flights.pop(flight_key, None)
+                    flight.task.cancel()
+
+    def _forget(self, flight_key: Tuple[int, str], flight: _Flight):
+        with self._lock:
+            if self._flights.get(flight_key) is flight:
+                del self._flights[flight_key]
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取上游请求数、合并次数和当前进行中的请求数"""
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._flights)}
@@ -0,0 +1,82 @@
+"""
+分阶段模型配置模块 - 为文档分析和各类题目生成分别指定模型、temperature和max_tokens
+"""
+from typing import Dict, Any, Optional
+
+
+class StageProfile:
+    """一个调用阶段的模型和参数覆盖，未设置的项使用全局配置"""
+
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        backup_model: Optional[str] = None,
+        models: Optional[Dict[str, str]] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None
+    ):
+        self.model = model  # 通义千问类提供商（及离线假LLM）使用的模型
+        self.backup_model = backup_model  # OpenAI类提供商使用的模型
+        self.models = dict(models or {})  # 按提供商名称指定的模型，优先级最高
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "StageProfile":
+        temperature = data.get("temperature")
+        max_tokens = data.get("max_tokens")
+        return cls(
+            model=data.get("model"),
+            backup_model=data.get("backup_model"),
+            models=data.get("models"),
+            temperature=float(temperature) if temperature is not None else None,
+            max_tokens=int(max_tokens) if max_tokens else None
+        )
+
+    def model_for(self, provider_name: str, provider_kind: str) -> Optional[str]:
+        """
+        该阶段在指定提供商上使用的模型
+
+        Args:
+            provider_name: 提供商名称（dashscope、openai或llm_endpoints中的name）
+            provider_kind: 提供商类型（dashscope、openai、fake）
+
+        Returns:
+            模型名称；没有覆盖时为None，使用提供商自己的模型
+        """
+        if provider_name in self.models:
+            return self.models[provider_name]
+        if provider_kind == "openai":
+            return self.backup_model
+        return self.model
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: value for key, value in self.__dict__.items() if value not in (None, {})}
+
+
+class StageProfiles:
+    """
+    按阶段查找模型配置
+
+    配置可以写在阶段（analysis、multiple_choice等）或阶段分组（generation）上，
+    同一项两处都设置时阶段优先。
+    """
+
+    def __init__(self, settings: Optional[Dict[str, Dict[str, Any]]] = None, stage_groups: Optional[Dict[str, str]] = None):
+        self.settings = {name: dict(value or {}) for name, value in (settings or {}).items()}
+        self.stage_groups = dict(stage_groups or {})
+        self._profiles: Dict[str, StageProfile] = {}
+
+    def get(self, stage: str) -> StageProfile:
+        profile = self._profiles.get(stage)
+        if profile is None:
+            group = self.stage_groups.get(stage)
+            merged = {**self.settings.get(group, {}), **self.settings.get(stage, {})} if group else dict(self.settings.get(stage, {}))
+            profile = self._profiles[stage] = StageProfile.from_dict(merged)
+        return profile
+
+    def configured_stages(self) -> Dict[str, StageProfile]:
+        """有覆盖配置的阶段（分组展开为其中的各阶段）"""
+        stages = set(self.settings) - set(self.stage_groups.values())
+        stages.update(stage for stage, group in self.stage_groups.items() if group in self.settings)
+        return {stage: self.get(stage) for stage in sorted(stages)}
@@ -0,0 +1,352 @@
+"""
+本地OpenAI兼容桩服务 - 模拟chat completions接口（含流式），用于在本机压测LLMService的网络路径
+
+延迟、抖动、429和5xx比例可通过命令行参数或JSON脚本按时间段编排，例如:
+
+    python stub_server.py --port 8765 --latency-ms 800 --rate-429 0.05
+    python stub_server.py --script stub_script.json
+
+脚本格式（phases依次执行，最后一段持续到服务结束）:
+
+    {"phases": [
+        {"duration": 30, "latency_ms": 500, "jitter_ms": 100},
+        {"duration": 20, "latency_ms": 3000, "rate_429": 0.3, "retry_after": 2},
+        {"latency_ms": 500, "rate_5xx": 0.02}
+    ]}
+
+将Settings.openai_base_url设置为 http://127.0.0.1:8765/v1 即可让OpenAI提供商指向本服务。
+"""
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional
+
+from fake_llm import build_fake_response, apply_output_limits
+from json_utils import extract_json
+
+# 每个阶段的默认参数
+DEFAULT_PHASE = {
+    "duration": None,
+    "latency_ms": 800.0,
+    "jitter_ms": 200.0,
+    "rate_429": 0.0,
+    "rate_5xx": 0.0,
+    "retry_after": 1,
+    "chunk_chars": 16,
+    "explanation_chars": 60
+}
+
+
+class StubScript:
+    """按时间段编排的桩服务行为"""
+
+    def __init__(self, phases: List[Dict[str, Any]], seed: int = 42):
+        self.phases = [{**DEFAULT_PHASE, **phase} for phase in phases] or [dict(DEFAULT_PHASE)]
+        self.started = time.monotonic()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: str, seed: int = 42) -> "StubScript":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data.get("phases", []), seed=seed)
+
+    def current_phase(self) -> Dict[str, Any]:
+        """根据服务运行时间确定当前阶段"""
+        elapsed = time.monotonic() - self.started
+        for phase in self.phases:
+            duration = phase.get("duration")
+            if duration is None or elapsed < duration:
+                return phase
+            elapsed -= duration
+        return self.phases[-1]
+
+    def sample_latency(self, phase: Dict[str, Any]) -> float:
+        with self._lock:
+            value = self._rng.gauss(phase["latency_ms"], phase["jitter_ms"]) if phase["jitter_ms"] else phase["latency_ms"]
+        return max(0.0, value) / 1000.0
+
+    def sample_fault(self, phase: Dict[str, Any]) -> Optional[int]:
+        """按比例抽取本次请求要返回的错误状态码"""
+        with self._lock:
+            roll = self._rng.random()
+            if roll < phase["rate_429"]:
+                return 429
+            if roll < phase["rate_429"] + phase["rate_5xx"]:
+                return self._rng.choice([500, 502, 503])
+        return None
+
+
+class StubStats:
+    """桩服务的请求统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"requests": 0, "streams": 0, "ok": 0, "429": 0, "5xx": 0, "in_flight": 0, "peak_in_flight": 0}
+
+    def incr(self, key: str, amount: int = 1):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+            if key == "in_flight":
+                self.counters["peak_in_flight"] = max(self.counters["peak_in_flight"], self.counters["in_flight"])
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counters)
+
+
+def _prompt_from_messages(messages: List[Dict[str, Any]]) -> str:
+    """取最后一条用户消息作为Prompt"""
+    for message in reversed(messages or []):
+        if message.get("role") == "user":
+            content = message.get("content", "")
+            if isinstance(content, list):
+                return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+            return content
+    return ""
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """OpenAI chat completions协议处理器"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "QAGeneratorStub/1.0"
+
+    def log_message(self, format, *args):
+        # 压测时请求量很大，不输出访问日志
+        pass
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "stub-model", "object": "model"}]})
+        elif self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.server.stats.snapshot())
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "invalid json", "type": "invalid_request_error"}})
+            return
+
+        stats: StubStats = self.server.stats
+        script: StubScript = self.server.script
+        phase = script.current_phase()
+        stats.incr("requests")
+        stats.incr("in_flight")
+        try:
+            latency = script.sample_latency(phase)
+            fault = script.sample_fault(phase)
+            if fault == 429:
+                stats.incr("429")
+                time.sleep(min(latency, 0.05))
+                self._send_json(
+                    429,
+                    {"error": {"message": "Rate limit exceeded", "type": "rate_limit_exceeded", "code": "rate_limit_exceeded"}},
+                    {"Retry-After": str(phase["retry_after"])}
+                )
+                return
+            if fault:
+                stats.incr("5xx")
+                time.sleep(latency)
+                self._send_json(fault, {"error": {"message": "Upstream error", "type": "server_error"}})
+                return
+
+            prompt = _prompt_from_messages(request.get("messages", []))
+            digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+            content = build_fake_response(prompt, random.Random(int(digest[:16], 16)), phase["explanation_chars"])
+            content, finish_reason = apply_output_limits(
+                content, request.get("max_completion_tokens") or request.get("max_tokens"), request.get("stop")
+            )
+            model = request.get("model", "stub-model")
+            usage = {
+                "prompt_tokens": max(1, int(len(prompt) / 1.5)),
+                "completion_tokens": max(1, int(len(content) / 1.5))
+            }
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+            if request.get("stream"):
+                stats.incr("streams")
+                self._stream(content, model, usage, latency, phase, request, finish_reason)
+            else:
+                time.sleep(latency)
+                message, finish_reason = self._structured_message(content, request, finish_reason)
+                self._send_json(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "message": message,
+                        "finish_reason": finish_reason
+                    }],
+                    "usage": usage
+                })
+            stats.incr("ok")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端取消（例如对冲请求的失败方）
+            pass
+        finally:
+            stats.incr("in_flight", -1)
+
+    def _structured_message(self, content: str, request: Dict[str, Any], finish_reason: str = "stop"):
+        """按请求的tools或response_format返回函数调用或JSON对象，题目以外的响应保持文本"""
+        extraction = extract_json(content)
+        questions = extraction.merged() if extraction.values else None
+        if not isinstance(questions, list) or finish_reason == "length":
+            return {"role": "assistant", "content": content}, finish_reason
+        payload = json.dumps({"questions": questions}, ensure_ascii=False)
+
+        tools = request.get("tools") or []
+        if tools:
+            self.server.stats.incr("tool_calls")
+            return {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{
+                    "id": f"call_{uuid.uuid4().hex[:24]}",
+                    "type": "function",
+                    "function": {"name": tools[0]["function"]["name"], "arguments": payload}
+                }]
+            }, "tool_calls"
+        if (request.get("response_format") or {}).get("type") == "json_object":
+            self.server.stats.incr("json_mode")
+            return {"role": "assistant", "content": payload}, "stop"
+        return {"role": "assistant", "content": content}, finish_reason
+
+    def _stream(self, content: str, model: str, usage: Dict[str, int], latency: float,
+                phase: Dict[str, Any], request: Dict[str, Any], finish_reason: str = "stop"):
+        """以SSE分块返回，首个片段在20%延迟后到达"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        size = max(1, phase["chunk_chars"])
+        pieces = [content[i:i + size] for i in range(0, len(content), size)]
+        step = latency * 0.8 / max(1, len(pieces))
+        time.sleep(latency * 0.2)
+
+        def event(delta: Dict[str, Any], finish_reason=None, extra=None) -> bytes:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            payload.update(extra or {})
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        self._write_chunk(event({"role": "assistant", "content": ""}))
+        for piece in pieces:
+            self._write_chunk(event({"content": piece}))
+            if step:
+                time.sleep(step)
+        include_usage = (request.get("stream_options") or {}).get("include_usage")
+        self._write_chunk(event({}, finish_reason, {"usage": usage} if include_usage else None))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+
+class StubServer(ThreadingHTTPServer):
+    """携带脚本和统计信息的多线程HTTP服务"""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, script: StubScript):
+        super().__init__(address, StubHandler)
+        self.script = script
+        self.stats = StubStats()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, script: Optional[StubScript] = None) -> StubServer:
+    """
+    在后台线程中启动桩服务
+
+    Args:
+        host: 监听地址
+        port: 监听端口，0表示随机端口
+        script: 行为脚本，默认使用DEFAULT_PHASE
+
+    Returns:
+        已启动的服务，base_url属性可直接用作openai_base_url
+    """
+    server = StubServer((host, port), script or StubScript([]))
+    thread = threading.Thread(target=server.serve_forever, name="llm-stub-server", daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地OpenAI兼容桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--script", type=str, help="按时间段编排行为的JSON脚本")
+    parser.add_argument("--latency-ms", type=float, default=DEFAULT_PHASE["latency_ms"])
+    parser.add_argument("--jitter-ms", type=float, default=DEFAULT_PHASE["jitter_ms"])
+    parser.add_argument("--rate-429", type=float, default=0.0, help="返回429的比例")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="返回5xx的比例")
+    parser.add_argument("--retry-after", type=int, default=1, help="429响应的Retry-After秒数")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.script:
+        script = StubScript.from_file(args.script, seed=args.seed)
+    else:
+        script = StubScript([{
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "rate_429": args.rate_429,
+            "rate_5xx": args.rate_5xx,
+            "retry_after": args.retry_after
+        }], seed=args.seed)
+
+    server = StubServer((args.host, args.port), script)
+    print(f"🧪 OpenAI兼容桩服务已启动: {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n桩服务已停止")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
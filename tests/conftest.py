@@ -0,0 +1,54 @@
+"""
+测试公共配置：使用离线假LLM，关闭缓存、检查点等会跨测试保留状态的功能
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import checkpointing
+import document_index
+import llm_service as llm_service_module
+from config import get_settings
+
+# 测试期间覆盖的配置项，测试结束后由monkeypatch恢复
+TEST_SETTINGS = {
+    "llm_backend": "fake",
+    "llm_cassette_mode": "off",
+    "llm_cache_enabled": False,
+    "llm_single_flight_enabled": False,
+    "llm_hedge_enabled": False,
+    "document_dedup_enabled": False,
+    "document_index_path": "",
+    "graph_checkpoint_enabled": False,
+    "fake_llm_latency_ms": 0.0,
+    "fake_llm_latency_jitter_ms": 0.0,
+    "fake_llm_latency_distribution": "constant",
+    "fake_llm_error_rate": 0.0,
+    "llm_retry_base_delay": 0.01,
+    "llm_retry_max_delay": 0.05,
+}
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    """离线假LLM的测试配置"""
+    settings = get_settings()
+    for name, value in TEST_SETTINGS.items():
+        monkeypatch.setattr(settings, name, value)
+    return settings
+
+
+@pytest.fixture
+def fresh_services(settings, monkeypatch):
+    """清空全局单例，让LLM服务、检查点和文档索引按当前配置重新创建
+
+    LLM服务在第一次get_llm_service()时读取配置，测试需要的配置要在那之前修改。
+    """
+    monkeypatch.setattr(llm_service_module, "_llm_service", None)
+    monkeypatch.setattr(checkpointing, "_checkpointer", None)
+    monkeypatch.setattr(checkpointing, "_checkpointer_created", False)
+    monkeypatch.setattr(document_index, "_document_index", None)
+    return settings
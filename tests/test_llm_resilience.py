@@ -0,0 +1,92 @@
+"""
+熔断与重试测试
+"""
+import asyncio
+
+import pytest
+
+import llm_service as llm_service_module
+from circuit_breaker import CircuitBreaker, CircuitState
+from fake_llm import FakeLLMError
+from llm_service import get_llm_service
+
+PROMPT = "请根据以下知识点生成选择题：光合作用"
+
+
+def inject_failures(service, monkeypatch, failures: int):
+    """让前failures次调用返回500错误，返回记录调用次数的列表"""
+    calls = []
+    original = service._ainvoke_message
+
+    async def flaky(llm, prompt, **kwargs):
+        calls.append(prompt)
+        if len(calls) <= failures:
+            raise FakeLLMError("Error code: 500 - Internal server error", 500)
+        return await original(llm, prompt, **kwargs)
+
+    monkeypatch.setattr(service, "_ainvoke_message", flaky)
+    return calls
+
+
+def test_breaker_ignores_sporadic_failures():
+    breaker = CircuitBreaker("test", window_size=20, min_calls=5)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.CLOSED
+
+    for _ in range(3):
+        breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+
+
+def test_breaker_consecutive_failure_limit():
+    breaker = CircuitBreaker("test", min_calls=100, consecutive_failures=3)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+
+
+def test_only_provider_open_still_called(fresh_services):
+    service = get_llm_service()
+    breaker = service._providers[0].breaker
+    for _ in range(breaker.min_calls):
+        breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+
+    assert asyncio.run(service.invoke_with_fallback(PROMPT, use_cache=False))
+
+
+def test_tripped_provider_not_called(fresh_services):
+    service = get_llm_service()
+    service._providers[0].breaker.trip(RuntimeError("Error code: 401 - invalid api key"))
+
+    with pytest.raises(ValueError, match="认证失败或额度耗尽"):
+        asyncio.run(service.invoke_with_fallback(PROMPT, use_cache=False))
+
+
+def test_attempt_not_leaked_after_retry(fresh_services, monkeypatch):
+    service = get_llm_service()
+    calls = inject_failures(service, monkeypatch, 1)
+
+    async def run():
+        await service.invoke_with_fallback(PROMPT, use_cache=False)
+        return llm_service_module._call_attempt.get()
+
+    assert asyncio.run(run()) == 1
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize("failures", [1, 2, 3])
+def test_retry_continues_after_own_failures_open_breaker(fresh_services, monkeypatch, failures):
+    monkeypatch.setattr(fresh_services, "llm_retry_max_attempts", 4)
+    # 第一次失败就熔断：进行中的重试仍应用完全部尝试次数
+    monkeypatch.setattr(fresh_services, "circuit_min_calls", 1)
+    service = get_llm_service()
+    provider = service._providers[0]
+    calls = inject_failures(service, monkeypatch, failures)
+
+    assert asyncio.run(service._invoke_with_retry(provider, PROMPT))
+    assert len(calls) == failures + 1
+    assert provider.breaker.stats["opened"] == 1
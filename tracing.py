@@ -0,0 +1,221 @@
+"""
+追踪模块 - 记录工作流节点、LLM调用和解析校验步骤的时间线，导出Chrome trace-event或OTLP JSON文件
+"""
+import os
+import json
+import time
+import secrets
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional, Iterator
+
+TRACE_FORMATS = ("chrome", "otlp")
+
+
+class Span:
+    """一段有起止时间的操作"""
+
+    def __init__(self, name: str, category: str, trace_id: str, parent_id: Optional[str] = None,
+                 start: Optional[float] = None, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.category = category  # graph / node / llm / parse
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start = start if start is not None else time.time()
+        self.end: Optional[float] = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return ((self.end if self.end is not None else time.time()) - self.start)
+
+    def set(self, **attributes):
+        self.attributes.update({key: value for key, value in attributes.items() if value is not None})
+
+
+class Trace:
+    """一次运行的全部span"""
+
+    def __init__(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        self.trace_id = secrets.token_hex(16)
+        self._lock = threading.Lock()
+        self.spans: List[Span] = []
+        self.root = Span(name, "graph", self.trace_id, attributes=attributes)
+        self.spans.append(self.root)
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_chrome(self) -> Dict[str, Any]:
+        """Chrome trace-event格式（chrome://tracing、Perfetto可直接打开），时间单位为微秒"""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        origin = self.root.start
+        # 每个顶层节点（根span的子span）及其内部的调用占一行，并行的节点分行显示
+        parents = {span.span_id: span.parent_id for span in spans}
+        lanes: Dict[str, int] = {}
+        events = []
+        for span in spans:
+            lane = span.span_id
+            while parents.get(lane) and parents[lane] != self.root.span_id:
+                lane = parents[lane]
+            if lane not in lanes:
+                lanes[lane] = len(lanes) + 1
+                events.append({
+                    "name": "thread_name", "ph": "M", "pid": 1, "tid": lanes[lane],
+                    "args": {"name": span.name}
+                })
+            args = dict(span.attributes)
+            if span.error:
+                args["error"] = span.error
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": round((span.start - origin) * 1e6, 1),
+                "dur": round(span.duration * 1e6, 1),
+                "pid": 1,
+                "tid": lanes[lane],
+                "args": args
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"trace_id": self.trace_id}}
+
+    def to_otlp(self, service_name: str = "question-generator") -> Dict[str, Any]:
+        """OTLP/JSON格式（与OpenTelemetry Collector的文件导出一致），可导入Jaeger、Tempo等"""
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", service_name)]},
+                "scopeSpans": [{
+                    "scope": {"name": "question_generator"},
+                    "spans": [_otlp_span(span) for span in spans]
+                }]
+            }]
+        }
+
+    def write(self, path: str, format: str = "chrome") -> str:
+        """把追踪写入文件，返回路径"""
+        data = self.to_otlp() if format == "otlp" else self.to_chrome()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, default=str)
+        return path
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _otlp_span(span: Span) -> Dict[str, Any]:
+    end = span.end if span.end is not None else time.time()
+    data = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(int(span.start * 1e9)),
+        "endTimeUnixNano": str(int(end * 1e9)),
+        "attributes": [_otlp_attribute("category", span.category)] + [
+            _otlp_attribute(key, value) for key, value in span.attributes.items()
+        ],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1}
+    }
+    if span.parent_id:
+        data["parentSpanId"] = span.parent_id
+    return data
+
+
+# 当前运行的追踪和当前span，由QuestionGeneratorGraph在启用追踪时设置；子任务继承
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("trace_span", default=None)
+
+
+@contextmanager
+def collect_trace(name: str = "run", **attributes) -> Iterator[Trace]:
+    """在上下文内收集span，根span覆盖整个上下文"""
+    trace = Trace(name, attributes)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(trace.root)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.root.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        trace.root.end = time.time()
+        try:
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+        except ValueError:
+            # 流式运行的生成器在其他上下文中被关闭
+            pass
+
+
+@contextmanager
+def trace_span(name: str, category: str = "app", **attributes) -> Iterator[Optional[Span]]:
+    """
+    记录一个span；不在追踪上下文中时什么也不做
+
+    Args:
+        name: 名称
+        category: 类别（node、llm、parse等）
+        attributes: 属性（大小、阶段、提供商等）
+
+    Yields:
+        Span；未启用追踪时为None
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    parent = _current_span.get()
+    span = Span(name, category, trace.trace_id, parent.span_id if parent else None)
+    span.set(**attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        span.end = time.time()
+        _current_span.reset(token)
+        trace.add(span)
+
+
+def record_span(name: str, category: str, start: float, end: float, **attributes):
+    """补记一个已经结束的span（例如限流排队），作为当前span的子span"""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    parent = _current_span.get()
+    span = Span(name, category, trace.trace_id, parent.span_id if parent else None, start=start)
+    span.end = end
+    span.set(**attributes)
+    trace.add(span)
+
+
+def annotate(**attributes):
+    """给当前span添加属性；不在追踪上下文中时什么也不做"""
+    span = _current_span.get()
+    if span is not None and _current_trace.get() is not None:
+        span.set(**attributes)
+
+
+def trace_file_path(directory: str, name: str, format: str = "chrome") -> str:
+    """一次运行的追踪文件路径（name通常为运行ID）"""
+    suffix = ".otlp.json" if format == "otlp" else ".trace.json"
+    return os.path.join(directory, f"{name}{suffix}")
@@ -0,0 +1,286 @@
+"""
+LLM用量统计模块 - 记录每次LLM调用的token和耗时，按运行汇总并导出Prometheus文本格式
+"""
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional, Iterator, Tuple
+
+# Prometheus延迟直方图的桶边界（秒）
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+
+class LLMCallRecord:
+    """一次LLM调用（或一次缓存命中、请求合并）的记录"""
+
+    def __init__(
+        self,
+        stage: str,
+        provider: str,
+        model: str,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        latency: float = 0.0,
+        attempt: int = 1,
+        cache_hit: bool = False,
+        coalesced: bool = False,
+        error_class: Optional[str] = None,
+        error_type: Optional[str] = None,
+        estimated_tokens: bool = False,
+        cost: float = 0.0
+    ):
+        self.stage = stage
+        self.provider = provider
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.latency = latency
+        self.attempt = attempt
+        self.cache_hit = cache_hit
+        self.coalesced = coalesced  # 与进行中的相同请求合并，没有单独访问提供商
+        self.error_class = error_class  # retryable / rate_limited / fatal / cancelled
+        self.error_type = error_type  # 异常类名
+        self.estimated_tokens = estimated_tokens  # 提供商未返回用量时按字符数估算
+        self.cost = cost  # 按模型单价估算的费用
+
+    @property
+    def retries(self) -> int:
+        return max(0, self.attempt - 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+
+class UsageAggregator:
+    """按(阶段, 提供商, 模型)累加调用记录"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._groups: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+
+    @staticmethod
+    def _empty() -> Dict[str, Any]:
+        return {
+            "calls": 0,
+            "cache_hits": 0,
+            "coalesced": 0,
+            "errors": 0,
+            "retries": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cost": 0.0,
+            "latency_total": 0.0,
+            "latency_max": 0.0,
+            "error_classes": {},
+            "latency_buckets": [0] * len(LATENCY_BUCKETS)
+        }
+
+    def add(self, record: LLMCallRecord):
+        key = (record.stage, record.provider, record.model)
+        with self._lock:
+            group = self._groups.setdefault(key, self._empty())
+            if record.cache_hit:
+                group["cache_hits"] += 1
+                return
+            if record.coalesced:
+                group["coalesced"] += 1
+                return
+            group["calls"] += 1
+            group["retries"] += record.retries
+            group["prompt_tokens"] += record.prompt_tokens
+            group["completion_tokens"] += record.completion_tokens
+            group["cost"] += record.cost
+            group["latency_total"] += record.latency
+            group["latency_max"] = max(group["latency_max"], record.latency)
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if record.latency <= bound:
+                    group["latency_buckets"][index] += 1
+            if record.error_class:
+                group["errors"] += 1
+                group["error_classes"][record.error_class] = group["error_classes"].get(record.error_class, 0) + 1
+
+    def groups(self) -> Dict[Tuple[str, str, str], Dict[str, Any]]:
+        with self._lock:
+            return {
+                key: {**value, "error_classes": dict(value["error_classes"]), "latency_buckets": list(value["latency_buckets"])}
+                for key, value in self._groups.items()
+            }
+
+    @staticmethod
+    def _merge(target: Dict[str, Any], group: Dict[str, Any]):
+        for field in ("calls", "cache_hits", "coalesced", "errors", "retries", "prompt_tokens", "completion_tokens", "cost", "latency_total"):
+            target[field] = target.get(field, 0) + group[field]
+        target["latency_max"] = max(target.get("latency_max", 0.0), group["latency_max"])
+
+    @staticmethod
+    def _finish(entry: Dict[str, Any]) -> Dict[str, Any]:
+        entry["total_tokens"] = entry.get("prompt_tokens", 0) + entry.get("completion_tokens", 0)
+        calls = entry.get("calls", 0)
+        entry["latency_avg"] = entry.get("latency_total", 0.0) / calls if calls else 0.0
+        for field in ("latency_total", "latency_avg", "latency_max"):
+            entry[field] = round(entry.get(field, 0.0), 3)
+        entry["cost"] = round(entry.get("cost", 0.0), 6)
+        return entry
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        汇总统计
+
+        Returns:
+            {"totals": {...}, "by_stage": {阶段: {..., "models": [模型]}}, "by_provider": {提供商/模型: {...}}}
+        """
+        totals: Dict[str, Any] = {}
+        by_stage: Dict[str, Dict[str, Any]] = {}
+        by_provider: Dict[str, Dict[str, Any]] = {}
+        error_classes: Dict[str, int] = {}
+        for (stage, provider, model), group in self.groups().items():
+            self._merge(totals, group)
+            stage_entry = by_stage.setdefault(stage, {"models": []})
+            self._merge(stage_entry, group)
+            if model not in stage_entry["models"]:
+                stage_entry["models"].append(model)
+            self._merge(by_provider.setdefault(f"{provider}/{model}", {}), group)
+            for name, count in group["error_classes"].items():
+                error_classes[name] = error_classes.get(name, 0) + count
+        totals = self._finish(totals)
+        totals["error_classes"] = error_classes
+        return {
+            "totals": totals,
+            "by_stage": {stage: self._finish(entry) for stage, entry in by_stage.items()},
+            "by_provider": {name: self._finish(entry) for name, entry in by_provider.items()}
+        }
+
+    def to_prometheus(self, prefix: str = "qa_llm") -> str:
+        """导出Prometheus文本格式"""
+        groups = self.groups()
+        lines: List[str] = []
+
+        def labels(stage: str, provider: str, model: str, **extra: str) -> str:
+            pairs = {"stage": stage, "provider": provider, "model": model, **extra}
+            return ",".join(f'{key}="{_escape_label(value)}"' for key, value in pairs.items())
+
+        def metric(name: str, kind: str, help_text: str):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+        metric("calls_total", "counter", "LLM calls sent to providers")
+        for (stage, provider, model), group in groups.items():
+            lines.append(f"{prefix}_calls_total{{{labels(stage, provider, model)}}} {group['calls']}")
+        metric("cache_hits_total", "counter", "LLM responses served from cache")
+        for (stage, provider, model), group in groups.items():
+            lines.append(f"{prefix}_cache_hits_total{{{labels(stage, provider, model)}}} {group['cache_hits']}")
+        metric("coalesced_total", "counter", "LLM calls that joined an identical in-flight request")
+        for (stage, provider, model), group in groups.items():
+            lines.append(f"{prefix}_coalesced_total{{{labels(stage, provider, model)}}} {group['coalesced']}")
+        metric("retries_total", "counter", "LLM call retries")
+        for (stage, provider, model), group in groups.items():
+            lines.append(f"{prefix}_retries_total{{{labels(stage, provider, model)}}} {group['retries']}")
+        metric("tokens_total", "counter", "Tokens consumed by LLM calls")
+        for (stage, provider, model), group in groups.items():
+            lines.append(f"{prefix}_tokens_total{{{labels(stage, provider, model, type='prompt')}}} {group['prompt_tokens']}")
+            lines.append(f"{prefix}_tokens_total{{{labels(stage, provider, model, type='completion')}}} {group['completion_tokens']}")
+        metric("cost_total", "counter", "Estimated cost of LLM calls by model price")
+        for (stage, provider, model), group in groups.items():
+            lines.append(f"{prefix}_cost_total{{{labels(stage, provider, model)}}} {group['cost']:.6f}")
+        metric("errors_total", "counter", "Failed LLM calls by error class")
+        for (stage, provider, model), group in groups.items():
+            for error_class, count in group["error_classes"].items():
+                lines.append(f"{prefix}_errors_total{{{labels(stage, provider, model, error_class=error_class)}}} {count}")
+        metric("latency_seconds", "histogram", "LLM call latency")
+        for (stage, provider, model), group in groups.items():
+            for bound, count in zip(LATENCY_BUCKETS, group["latency_buckets"]):
+                lines.append(f"{prefix}_latency_seconds_bucket{{{labels(stage, provider, model, le=str(bound))}}} {count}")
+            lines.append(f"{prefix}_latency_seconds_bucket{{{labels(stage, provider, model, le='+Inf')}}} {group['calls']}")
+            lines.append(f"{prefix}_latency_seconds_sum{{{labels(stage, provider, model)}}} {group['latency_total']:.6f}")
+            lines.append(f"{prefix}_latency_seconds_count{{{labels(stage, provider, model)}}} {group['calls']}")
+        return "\n".join(lines) + "\n"
+
+
+def estimate_cost(
+    model: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+    prices: Optional[Dict[str, Dict[str, float]]]
+) -> float:
+    """
+    按模型单价估算一次调用的费用
+
+    Args:
+        model: 模型名称；没有完全匹配的价格时按最长前缀匹配（如qwen-plus-latest使用qwen-plus的价格）
+        prompt_tokens: 输入token数
+        completion_tokens: 输出token数
+        prices: {模型: {"input": 每千token价格, "output": 每千token价格}}
+
+    Returns:
+        费用；没有价格时为0
+    """
+    if not prices or not model:
+        return 0.0
+    price = prices.get(model)
+    if price is None:
+        matches = [name for name in prices if model.startswith(name)]
+        if not matches:
+            return 0.0
+        price = prices[max(matches, key=len)]
+    return (prompt_tokens * price.get("input", 0.0) + completion_tokens * price.get("output", 0.0)) / 1000.0
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class UsageCollector(UsageAggregator):
+    """一次运行（一个文档）的调用记录"""
+
+    def __init__(self):
+        super().__init__()
+        self.records: List[LLMCallRecord] = []
+
+    def add(self, record: LLMCallRecord):
+        super().add(record)
+        with self._lock:
+            self.records.append(record)
+
+
+# 进程级汇总，用于Prometheus导出
+usage_registry = UsageAggregator()
+
+# 当前运行的记录收集器，由QuestionGeneratorGraph.run设置
+_current_collector: ContextVar[Optional[UsageCollector]] = ContextVar("llm_usage_collector", default=None)
+
+
+def record_llm_call(record: LLMCallRecord):
+    """记录一次调用到进程级汇总和当前运行的收集器"""
+    usage_registry.add(record)
+    collector = _current_collector.get()
+    if collector is not None:
+        collector.add(record)
+
+
+@contextmanager
+def collect_usage() -> Iterator[UsageCollector]:
+    """在上下文内收集LLM调用记录（子任务继承同一个收集器）"""
+    collector = UsageCollector()
+    token = _current_collector.set(collector)
+    try:
+        yield collector
+    finally:
+        try:
+            _current_collector.reset(token)
+        except ValueError:
+            # 流式运行的生成器提前结束时可能在其他上下文中被关闭
+            pass
+
+
+def current_usage_summary() -> Optional[Dict[str, Any]]:
+    """当前运行的用量汇总，不在收集上下文中时返回None"""
+    collector = _current_collector.get()
+    return collector.summary() if collector is not None else None
+
+
+def export_prometheus(path: str) -> str:
+    """把进程级汇总写入Prometheus文本文件"""
+    text = usage_registry.to_prometheus()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path